@@ -0,0 +1,231 @@
+""" Benchmarks for scoring, crib throws, pegging and whole games.
+
+Every workload builds its fixtures up front from a fixed seed, then times
+each call on its own. Results can be saved as JSON and compared against a
+saved baseline; the run fails if any workload's throughput drops more than
+--max_regression below the baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import crib
+import cribbage
+import game
+import kyle_ai
+import test_ai
+
+DEFAULT_SEED = 1234
+PERCENTILES = (50, 90, 99)
+
+# Run in a fresh interpreter, like a newly started worker, from the repo
+STARTUP_IMPORT = 'import game, kyle_ai'
+STARTUP_FIRST_THROW = '''
+import random
+import cribbage, kyle_ai
+bot = kyle_ai.KyleBotV3(rng=random.Random(0))
+bot.notify_new_hand(cribbage.Hand(sorted(cribbage.Deck.draw(6, random.Random(0)))))
+bot.ask_for_crib_throw(True, [0, 0])
+'''
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_values, percent):
+    """ Nearest-rank percentile of an already sorted list
+    """
+    rank = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def _deal_hand(rng, num_cards):
+    return cribbage.Hand(sorted(cribbage.Deck.draw(num_cards, rng)))
+
+
+def score_calls(rng, iterations):
+    calls = []
+    for _ in xrange(iterations):
+        hand = _deal_hand(rng, 5)
+        hand.add_starter_card(hand.cards.pop(rng.randrange(5)))
+        is_crib = rng.random() < 0.5
+        calls.append(lambda hand=hand, is_crib=is_crib: cribbage.Scorer.score(hand, is_crib=is_crib))
+    return calls
+
+
+def crib_throw_calls(bot_class):
+    def make_calls(rng, iterations):
+        calls = []
+        for _ in xrange(iterations):
+            bot = bot_class(rng=random.Random(rng.getrandbits(64)))
+            has_crib = rng.random() < 0.5
+
+            def call(bot=bot, cards=_deal_hand(rng, 6).cards, has_crib=has_crib):
+                bot.notify_new_hand(cribbage.Hand(list(cards)))
+                return bot.ask_for_crib_throw(has_crib, [0, 0])
+            calls.append(call)
+        return calls
+    return make_calls
+
+
+def pegging_calls(rng, iterations):
+    calls = []
+    for _ in xrange(iterations):
+        runner = game.GameRunner(test_ai.OneSixBot(), test_ai.OneSixBot(), seed=rng.getrandbits(64))
+        cards = cribbage.Deck.draw(12, rng)
+        hands = [sorted(cards[0:6]), sorted(cards[6:12])]
+        player_one_has_crib = rng.random() < 0.5
+
+        def call(runner=runner, hands=hands, player_one_has_crib=player_one_has_crib):
+            runner.scores = [0, 0]
+            for bot, hand_cards in zip(runner.bots, hands):
+                bot.notify_new_hand(cribbage.Hand(list(hand_cards)))
+                bot.ask_for_crib_throw(player_one_has_crib ^ (bot is runner.bot2))
+            return runner.do_pegging(player_one_has_crib)
+        calls.append(call)
+    return calls
+
+
+def game_calls(rng, iterations):
+    calls = []
+    for _ in xrange(iterations):
+        seed = rng.getrandbits(64)
+        calls.append(lambda seed=seed: game.GameRunner(
+            kyle_ai.KyleBotV1(), test_ai.OneSixBot(), seed=seed).run_game())
+    return calls
+
+
+def startup_calls(script):
+    def make_calls(rng, iterations):
+        command = [sys.executable, '-c', script]
+        return [lambda: subprocess.check_call(command, cwd=REPO_DIR)] * iterations
+    return make_calls
+
+
+# name -> (fixture builder, default iterations)
+WORKLOADS = [
+    ('scorer.score', score_calls, 20000),
+    ('kyle_bot_v1.ask_for_crib_throw', crib_throw_calls(kyle_ai.KyleBotV1), 200),
+    ('kyle_bot_v2.ask_for_crib_throw', crib_throw_calls(kyle_ai.KyleBotV2), 50),
+    ('kyle_bot_v3.ask_for_crib_throw', crib_throw_calls(kyle_ai.KyleBotV3), 50),
+    ('game_runner.do_pegging', pegging_calls, 2000),
+    ('game_runner.run_game', game_calls, 20),
+    ('startup.import', startup_calls(STARTUP_IMPORT), 10),
+    ('startup.first_throw', startup_calls(STARTUP_FIRST_THROW), 10),
+]
+
+
+def run_workload(make_calls, iterations, seed):
+    calls = make_calls(random.Random(seed), iterations)
+    latencies = []
+    for call in calls:
+        start_time = time.time()
+        call()
+        latencies.append(time.time() - start_time)
+
+    total_time = sum(latencies)
+    latencies.sort()
+    result = dict(
+        calls=len(latencies),
+        total_time=total_time,
+        calls_per_sec=len(latencies) / total_time if total_time else float('inf'),
+        max=latencies[-1],
+    )
+    for percent in PERCENTILES:
+        result['p%d' % percent] = percentile(latencies, percent)
+    return result
+
+
+def find_regressions(results, baseline, max_regression):
+    """ (name, baseline calls/sec, current calls/sec) for each slowdown
+    """
+    regressions = []
+    for name, result in sorted(results['workloads'].items()):
+        if name not in baseline['workloads']:
+            continue
+        baseline_rate = baseline['workloads'][name]['calls_per_sec']
+        if result['calls_per_sec'] < baseline_rate * (1 - max_regression):
+            regressions.append((name, baseline_rate, result['calls_per_sec']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cribbage engine and AIs.')
+    parser.add_argument(
+        '--seed',
+        default=DEFAULT_SEED,
+        required=False,
+        type=int,
+        help='Seed for the workload fixtures',
+    )
+    parser.add_argument(
+        '--scale',
+        default=1.0,
+        required=False,
+        type=float,
+        help='Multiplier on every workload\'s number of calls',
+    )
+    parser.add_argument(
+        '--only',
+        default=None,
+        required=False,
+        help='Only run workloads whose name contains this string',
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        required=False,
+        help='Write results as JSON to this file',
+    )
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        required=False,
+        help='JSON results to compare against',
+    )
+    parser.add_argument(
+        '--max_regression',
+        default=0.2,
+        required=False,
+        type=float,
+        help='Allowed fractional drop in calls/sec against the baseline',
+    )
+    args = parser.parse_args()
+
+    # Load lookup tables before anything is timed
+    cribbage.SCORE_TABLE.load_if_present()
+    crib.rank_scores()
+
+    results = dict(
+        meta=dict(
+            seed=args.seed,
+            scale=args.scale,
+            python=platform.python_version(),
+            timestamp=time.time(),
+        ),
+        workloads={},
+    )
+    for name, make_calls, iterations in WORKLOADS:
+        if args.only and args.only not in name:
+            continue
+        result = run_workload(make_calls, max(1, int(iterations * args.scale)), args.seed)
+        results['workloads'][name] = result
+        print "%-32s %10.1f calls/sec  p50 %.6fs  p90 %.6fs  p99 %.6fs" % (
+            name, result['calls_per_sec'], result['p50'], result['p90'], result['p99'])
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(results, baseline, args.max_regression)
+        for name, baseline_rate, rate in regressions:
+            print "REGRESSION %s: %.1f -> %.1f calls/sec" % (name, baseline_rate, rate)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,60 @@
+""" The interface GameRunner plays cribbage through.
+"""
+
+import importlib
+import random
+import time
+
+# Modules searched for bot classes given without a module
+BOT_MODULES = ('kyle_ai', 'test_ai')
+
+
+class Bot(object):
+
+    # Absolute time.time() by which the current decision must be returned.
+    # GameRunner sets it around every ask_for_* call; bots that can refine
+    # an answer should check out_of_time and return their best so far.
+    deadline = None
+    # [own score, opponent's score] as the current decision is asked for,
+    # also set by GameRunner, for bots that play to the score
+    scores = None
+
+    def __init__(self, rng=None):
+        # GameRunner replaces this with a stream seeded from the game seed
+        self.rng = rng if rng is not None else random.Random()
+
+    def time_remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def out_of_time(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def ask_for_crib_throw(self, has_crib, scores=None):
+        raise NotImplementedError
+
+    def notify_starter_card(self, card):
+        self.hand.add_starter_card(card)
+
+    def notify_new_hand(self, hand):
+        self.hand = hand
+
+    def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
+        raise NotImplementedError
+
+
+def load_bot(name):
+    """ The Bot class called name, either 'module.Class' or a class in BOT_MODULES
+    """
+    if '.' in name:
+        module_name, class_name = name.rsplit('.', 1)
+        module_names = [module_name]
+    else:
+        class_name = name
+        module_names = BOT_MODULES
+    for module_name in module_names:
+        bot_class = getattr(importlib.import_module(module_name), class_name, None)
+        if isinstance(bot_class, type) and issubclass(bot_class, Bot):
+            return bot_class
+    raise ValueError("No bot class named %s" % name)
@@ -0,0 +1,115 @@
+""" Opt-in, per-process logging of bot decisions.
+
+Bots log to children of the 'bots' logger, which is off unless enable is
+called, so checking isEnabledFor is all a run without logging pays for.
+Once enabled, records are put on a queue and a background thread formats
+and writes them, one file per process, so forked workers never share a
+log file and a bot never waits on the disk.
+"""
+
+import logging
+import multiprocessing.util
+import os
+import Queue
+import threading
+
+LOGGER_NAME = 'bots'
+LOG_FORMAT = '%(message)s'
+
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.WARNING)
+
+
+class QueueHandler(logging.Handler):
+    """ Queues records for a writer thread, started anew in each process
+    """
+
+    def __init__(self, directory, prefix):
+        logging.Handler.__init__(self)
+        self.directory = directory
+        self.prefix = prefix
+        self.pid = None
+        # The process that last started a writer, whose file a restart
+        # after flush appends to rather than truncates
+        self.opened_pid = None
+        self.queue = None
+        self.thread = None
+
+    def path(self):
+        return os.path.join(self.directory, '%s-%d.log' % (self.prefix, os.getpid()))
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue()
+        mode = 'a' if self.opened_pid == self.pid else 'w'
+        self.opened_pid = self.pid
+        file_handler = logging.FileHandler(self.path(), mode=mode)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.thread = threading.Thread(target=self._write, args=(self.queue, file_handler))
+        self.thread.daemon = True
+        self.thread.start()
+        # Also runs when a pool worker exits, which skips atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    @staticmethod
+    def _write(record_queue, file_handler):
+        while True:
+            record = record_queue.get()
+            if record is None:
+                break
+            file_handler.handle(record)
+        file_handler.close()
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put(record)
+
+    def flush(self):
+        """ Write out everything queued and stop this process's writer
+        """
+        if self.pid == os.getpid() and self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+            self.thread = None
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+
+def enable(directory, prefix='bots', level=logging.INFO):
+    """ Log bot decisions at level into directory/<prefix>-<pid>.log
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    disable()
+    logger.addHandler(QueueHandler(directory, prefix))
+    logger.setLevel(level)
+
+
+def disable():
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    logger.setLevel(logging.WARNING)
+
+
+class LazyCards(object):
+    """ Cards formatted with colored_print, only once a record is written
+
+    Takes a copy of the cards, since hands change after logging.
+    """
+
+    def __init__(self, cards):
+        self.cards = tuple(cards)
+
+    def __unicode__(self):
+        return ' '.join(card.colored_print for card in self.cards)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
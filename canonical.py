@@ -0,0 +1,278 @@
+""" Reduce hands to a canonical form under the 4! permutations of suits.
+
+Every scoring rule treats the suits alike, so two hands that differ only by
+a renaming of suits score the same and call for the same play.
+
+The canonical form is found by walking the ranks from king down to ace
+while keeping the suits partitioned into cells of suits that nothing has
+told apart yet. At each rank, the suits of a cell holding a hand card take
+the cell's lowest positions, then a starter card, then empty suits, and
+the cell splits accordingly. For a hand without a starter this gives the
+smallest deck mask the hand reaches under any suit permutation.
+
+Counting the ways to finish the walk from each (rank, cells, cards left)
+state gives every equivalence class a dense index, in walk order.
+"""
+
+import itertools
+import math
+
+import cribbage
+
+# Each permutation maps suit position (index & 3) to a new suit position
+SUIT_PERMUTATIONS = list(itertools.permutations(xrange(4)))
+
+EMPTY = 0
+HAND = 1
+STARTER = 2
+# Order in which suit groups take positions within a cell
+LABEL_ORDER = (HAND, STARTER, EMPTY)
+
+NO_STARTER = 0
+
+
+def permute_index(index, perm):
+    return (index & ~3) | perm[index & 3]
+
+
+def invert_permutation(perm):
+    inverse = [0] * len(perm)
+    for position, target in enumerate(perm):
+        inverse[target] = position
+    return tuple(inverse)
+
+
+def _labels(cards, starter_card=None):
+    labels = [[EMPTY] * 4 for _ in xrange(13)]
+    for card in cards:
+        labels[card.index >> 2][card.index & 3] = HAND
+    if starter_card is not None:
+        labels[starter_card.index >> 2][starter_card.index & 3] = STARTER
+    return labels
+
+
+def canonical_perm(cards, starter_card=None):
+    """ Suit permutation taking the cards to their canonical form
+
+    Returns the permutation and the final cells, as lists of the original
+    suit positions that no card distinguishes.
+    """
+    labels = _labels(cards, starter_card)
+    cells = [[0, 1, 2, 3]]
+    for rank_idx in reversed(xrange(13)):
+        rank_labels = labels[rank_idx]
+        refined = []
+        for cell in cells:
+            for label in LABEL_ORDER:
+                group = [suit for suit in cell if rank_labels[suit] == label]
+                if group:
+                    refined.append(group)
+        cells = refined
+
+    perm = [0] * 4
+    for position, suit in enumerate(itertools.chain.from_iterable(cells)):
+        perm[suit] = position
+    return tuple(perm), cells
+
+
+def canonical_mask(cards):
+    """ Smallest deck mask the cards reach under any suit permutation
+
+    Returns the mask and the permutation that produces it.
+    """
+    perm, _ = canonical_perm(cards)
+    mask = 0
+    for card in cards:
+        mask |= 1 << permute_index(card.index, perm)
+    return mask, perm
+
+
+def canonicalize(cards, starter_card=None):
+    """ Canonical cards and starter (or None), plus the permutation used
+    """
+    perm, _ = canonical_perm(cards, starter_card)
+    canonical_cards = sorted(cribbage.Card.from_index(permute_index(card.index, perm))
+            for card in cards)
+    canonical_starter = None
+    if starter_card is not None:
+        canonical_starter = cribbage.Card.from_index(permute_index(starter_card.index, perm))
+    return canonical_cards, canonical_starter, perm
+
+
+def canonical_key(cards, starter_card=None):
+    """ Integer key shared by every suit permutation of a hand and starter
+
+    The canonical deck mask of the cards, shifted left 6 bits, plus one
+    more than the canonical starter's index (0 without a starter).
+    """
+    canonical_cards, canonical_starter, _ = canonicalize(cards, starter_card)
+    starter_code = NO_STARTER
+    if canonical_starter is not None:
+        starter_code = canonical_starter.index + 1
+    return (cribbage.cards_to_mask(canonical_cards) << 6) | starter_code
+
+
+def key_to_cards(key):
+    """ Canonical cards and starter (or None) of a canonical_key
+    """
+    starter_code = key & 0x3F
+    starter_card = None
+    if starter_code != NO_STARTER:
+        starter_card = cribbage.Card.from_index(starter_code - 1)
+    return cribbage.mask_to_cards(key >> 6), starter_card
+
+
+def orbit_size(cards, starter_card=None):
+    """ Number of distinct hands in this hand's equivalence class
+    """
+    _, cells = canonical_perm(cards, starter_card)
+    stabilizer_size = 1
+    for cell in cells:
+        stabilizer_size *= math.factorial(len(cell))
+    return len(SUIT_PERMUTATIONS) // stabilizer_size
+
+
+def _cell_options(cell_size, num_starters):
+    return [(num_hand, num_starter)
+            for num_hand in xrange(cell_size + 1)
+            for num_starter in xrange(min(cell_size - num_hand, num_starters) + 1)]
+
+
+def _choices(cell_sizes, hand_left, starters_left):
+    """ Ways to label the suits of one rank, as per cell (hand, starter) counts
+    """
+    options = [_cell_options(cell_size, starters_left) for cell_size in cell_sizes]
+    for choice in itertools.product(*options):
+        if (sum(num_hand for num_hand, _ in choice) <= hand_left and
+                sum(num_starter for _, num_starter in choice) <= starters_left):
+            yield choice
+
+
+def _refine_sizes(cell_sizes, choice):
+    refined = []
+    for cell_size, (num_hand, num_starter) in zip(cell_sizes, choice):
+        for group_size in (num_hand, num_starter, cell_size - num_hand - num_starter):
+            if group_size:
+                refined.append(group_size)
+    return tuple(refined)
+
+
+# XXX: Ghetto memoization
+_COMPLETIONS = {}
+
+
+def _num_completions(rank_idx, cell_sizes, hand_left, starters_left):
+    """ Canonical classes that finish a walk from this state
+    """
+    if rank_idx < 0:
+        return int(hand_left == 0 and starters_left == 0)
+    state = (rank_idx, cell_sizes, hand_left, starters_left)
+    if state not in _COMPLETIONS:
+        total = 0
+        for choice in _choices(cell_sizes, hand_left, starters_left):
+            total += _num_completions(
+                rank_idx - 1,
+                _refine_sizes(cell_sizes, choice),
+                hand_left - sum(num_hand for num_hand, _ in choice),
+                starters_left - sum(num_starter for _, num_starter in choice),
+            )
+        _COMPLETIONS[state] = total
+    return _COMPLETIONS[state]
+
+
+def num_classes(num_cards, has_starter=False):
+    """ Number of equivalence classes of num_cards hands (plus starter)
+    """
+    return _num_completions(12, (4,), num_cards, int(has_starter))
+
+
+def num_hands(num_cards, has_starter=False):
+    """ Number of distinct hands of num_cards (plus starter), for comparison
+    """
+    total = cribbage.binomial(52, num_cards)
+    if has_starter:
+        total *= 52 - num_cards
+    return total
+
+
+def canonical_index(cards, starter_card=None):
+    """ Dense index of the hand's class, in [0, num_classes)
+    """
+    perm, _ = canonical_perm(cards, starter_card)
+    labels = [[EMPTY] * 4 for _ in xrange(13)]
+    for card in cards:
+        index = permute_index(card.index, perm)
+        labels[index >> 2][index & 3] = HAND
+    starters_left = 0
+    if starter_card is not None:
+        index = permute_index(starter_card.index, perm)
+        labels[index >> 2][index & 3] = STARTER
+        starters_left = 1
+
+    hand_left = len(cards)
+    cell_sizes = (4,)
+    class_index = 0
+    for rank_idx in reversed(xrange(13)):
+        rank_labels = labels[rank_idx]
+        actual = []
+        position = 0
+        for cell_size in cell_sizes:
+            cell_labels = rank_labels[position:position + cell_size]
+            actual.append((cell_labels.count(HAND), cell_labels.count(STARTER)))
+            position += cell_size
+        actual = tuple(actual)
+
+        for choice in _choices(cell_sizes, hand_left, starters_left):
+            if choice == actual:
+                break
+            class_index += _num_completions(
+                rank_idx - 1,
+                _refine_sizes(cell_sizes, choice),
+                hand_left - sum(num_hand for num_hand, _ in choice),
+                starters_left - sum(num_starter for _, num_starter in choice),
+            )
+        cell_sizes = _refine_sizes(cell_sizes, actual)
+        hand_left -= sum(num_hand for num_hand, _ in actual)
+        starters_left -= sum(num_starter for _, num_starter in actual)
+    return class_index
+
+
+def index_to_cards(class_index, num_cards, has_starter=False):
+    """ Canonical cards and starter (or None) of a canonical_index
+    """
+    if not 0 <= class_index < num_classes(num_cards, has_starter):
+        raise ValueError("No such class.")
+
+    hand_left = num_cards
+    starters_left = int(has_starter)
+    cell_sizes = (4,)
+    cards = []
+    starter_card = None
+    for rank_idx in reversed(xrange(13)):
+        for choice in _choices(cell_sizes, hand_left, starters_left):
+            refined = _refine_sizes(cell_sizes, choice)
+            next_hand_left = hand_left - sum(num_hand for num_hand, _ in choice)
+            next_starters_left = starters_left - sum(num_starter for _, num_starter in choice)
+            num_below = _num_completions(rank_idx - 1, refined, next_hand_left, next_starters_left)
+            if class_index < num_below:
+                break
+            class_index -= num_below
+
+        position = 0
+        for cell_size, (num_hand, num_starter) in zip(cell_sizes, choice):
+            for suit in xrange(position, position + num_hand):
+                cards.append(cribbage.Card.from_index(rank_idx * 4 + suit))
+            for suit in xrange(position + num_hand, position + num_hand + num_starter):
+                starter_card = cribbage.Card.from_index(rank_idx * 4 + suit)
+            position += cell_size
+        cell_sizes = refined
+        hand_left = next_hand_left
+        starters_left = next_starters_left
+    return sorted(cards), starter_card
+
+
+def uncanonicalize_indexes(indexes, perm):
+    """ Map canonical card indexes back through the inverse of perm
+    """
+    inverse = invert_permutation(perm)
+    return [permute_index(index, inverse) for index in indexes]
@@ -0,0 +1,216 @@
+""" Exact expected crib scores.
+
+Rather than scoring every 2 card completion of a crib, completions are
+counted by rank: pairs, fifteens and runs only depend on the crib's rank
+multiset, and flush and nobs only on a few suit counts. An expectation
+over all C(45, 2) completions becomes at most 91 table lookups.
+
+The same pass can count how many completions give each crib score, for
+when the whole distribution matters and not just its mean.
+"""
+
+import array
+
+import cribbage
+
+RANK_WEIGHTS = [5 ** rank_idx for rank_idx in xrange(13)]
+
+# XXX: Ghetto memoization
+_rank_scores = None
+
+
+def rank_scores():
+    """ Pairs + fifteens + runs points keyed like ScoreTable.rank_parts
+    """
+    global _rank_scores
+    if _rank_scores is not None:
+        return _rank_scores
+    # Only published once complete, so a concurrent caller never sees a
+    # partly built dict
+    scores = {}
+    for key, entry in cribbage.ScoreTable.rank_parts().iteritems():
+        scores[key] = (
+            ((entry >> cribbage.PAIRS_SHIFT) & 0xF) +
+            ((entry >> cribbage.FIFTEENS_SHIFT) & 0x1F) +
+            ((entry >> cribbage.RUNS_SHIFT) & 0xF)
+        )
+    _rank_scores = scores
+    return scores
+
+
+def _count_work(num_starters):
+    """ Count a crib expectation or distribution over num_starters starters
+    """
+    stats = cribbage.SCORER_STATS
+    if stats is not None:
+        stats['crib_calls'] += 1
+        stats['crib_starters'] += num_starters
+
+
+def _rank_key(cards):
+    return sum(RANK_WEIGHTS[card.rank - 1] for card in cards)
+
+
+def _rank_counts(cards):
+    counts = [0] * 13
+    for card in cards:
+        counts[card.rank - 1] += 1
+    return counts
+
+
+def _total_rank_points(base_key, counts):
+    """ Rank points summed over every pair of cards drawn from counts
+    """
+    scores = rank_scores()
+    total = 0
+    for i in xrange(13):
+        count_i = counts[i]
+        if not count_i:
+            continue
+        key_i = base_key + RANK_WEIGHTS[i]
+        if count_i > 1:
+            total += cribbage.binomial(count_i, 2) * scores[key_i + RANK_WEIGHTS[i]]
+        for j in xrange(i + 1, 13):
+            if counts[j]:
+                total += count_i * counts[j] * scores[key_i + RANK_WEIGHTS[j]]
+    return total
+
+
+def _suit_points(cards_to_throw, starter_card, other_cards):
+    """ Flush and nobs points summed over every completion from other_cards
+    """
+    num_completions = cribbage.binomial(len(other_cards), 2)
+    total = 0
+    if all(card.suit == starter_card.suit for card in cards_to_throw):
+        num_suited = sum(1 for card in other_cards if card.suit == starter_card.suit)
+        total += 5 * cribbage.binomial(num_suited, 2)
+
+    nobs_card = cribbage.Card(cribbage.JACK, starter_card.suit)
+    if nobs_card in cards_to_throw:
+        total += num_completions
+    elif nobs_card in other_cards:
+        total += len(other_cards) - 1
+    return total
+
+
+def expected_crib_score_for_starter(cards_to_throw, starter_card, other_cards):
+    """ Mean crib score over every 2 card completion drawn from other_cards
+
+    other_cards are the cards the completion can come from, which must not
+    include the starter card or the cards thrown.
+    """
+    _count_work(1)
+    other_cards = list(other_cards)
+    total = _total_rank_points(
+        _rank_key(cards_to_throw) + RANK_WEIGHTS[starter_card.rank - 1],
+        _rank_counts(other_cards),
+    )
+    total += _suit_points(cards_to_throw, starter_card, other_cards)
+    return float(total) / cribbage.binomial(len(other_cards), 2)
+
+
+def expected_crib_score(cards_to_throw, unseen_cards):
+    """ Mean crib score over every starter and completion from unseen_cards
+
+    Equivalent to averaging expected_crib_score_for_starter over each
+    unseen starter, but the rank points are only counted once per starter
+    rank.
+    """
+    unseen_cards = list(unseen_cards)
+    _count_work(len(unseen_cards))
+    counts = _rank_counts(unseen_cards)
+    thrown_key = _rank_key(cards_to_throw)
+
+    total = 0
+    for rank_idx in xrange(13):
+        num_starters = counts[rank_idx]
+        if not num_starters:
+            continue
+        counts[rank_idx] -= 1
+        total += num_starters * _total_rank_points(
+            thrown_key + RANK_WEIGHTS[rank_idx], counts)
+        counts[rank_idx] += 1
+
+    for starter_card in unseen_cards:
+        total += _suit_points(
+            cards_to_throw,
+            starter_card,
+            [card for card in unseen_cards if card != starter_card],
+        )
+
+    num_outcomes = len(unseen_cards) * cribbage.binomial(len(unseen_cards) - 1, 2)
+    return float(total) / num_outcomes
+
+
+def crib_score_counts_for_starter(cards_to_throw, starter_card, other_cards, counts=None):
+    """ How many 2 card completions from other_cards give each crib score
+
+    Counts are added to counts if given, else to a new count array. Each
+    rank pair's completions are split by whether they make a flush or
+    hold the nobs jack, so the counts are exact.
+    """
+    if counts is None:
+        counts = array.array(b'H', [0] * cribbage.NUM_SCORE_COUNTS)
+    _count_work(1)
+    other_cards = list(other_cards)
+    scores = rank_scores()
+    base_key = _rank_key(cards_to_throw) + RANK_WEIGHTS[starter_card.rank - 1]
+    rank_counts = _rank_counts(other_cards)
+
+    # Which ranks can be drawn in the starter's suit
+    suited = [0] * 13
+    for card in other_cards:
+        if card.suit == starter_card.suit:
+            suited[card.rank - 1] = 1
+    can_flush = all(card.suit == starter_card.suit for card in cards_to_throw)
+    jack_idx = cribbage.JACK - 1
+    thrown_nobs = int(cribbage.Card(cribbage.JACK, starter_card.suit) in cards_to_throw)
+    nobs_drawable = suited[jack_idx] and not thrown_nobs
+
+    for i in xrange(13):
+        count_i = rank_counts[i]
+        if not count_i:
+            continue
+        key_i = base_key + RANK_WEIGHTS[i]
+        for j in xrange(i, 13):
+            count_j = rank_counts[j]
+            if i == j:
+                num_completions = cribbage.binomial(count_i, 2)
+            else:
+                num_completions = count_i * count_j
+            if not num_completions:
+                continue
+            points = scores[key_i + RANK_WEIGHTS[j]] + thrown_nobs
+
+            with_nobs = 0
+            if nobs_drawable:
+                if i == jack_idx:
+                    with_nobs += count_j - 1 if i == j else count_j
+                elif j == jack_idx:
+                    with_nobs += count_i
+            flushed = suited[i] * suited[j] if can_flush and i != j else 0
+            # A suited jack is the nobs jack
+            flushed_with_nobs = flushed if nobs_drawable and jack_idx in (i, j) else 0
+
+            counts[points] += num_completions - with_nobs - flushed + flushed_with_nobs
+            if with_nobs:
+                counts[points + 1] += with_nobs - flushed_with_nobs
+            if flushed:
+                counts[points + 5] += flushed - flushed_with_nobs
+                counts[points + 6] += flushed_with_nobs
+    return counts
+
+
+def crib_score_counts(cards_to_throw, unseen_cards):
+    """ How many (starter, completion) draws from unseen_cards give each crib score
+    """
+    unseen_cards = list(unseen_cards)
+    counts = array.array(b'H', [0] * cribbage.NUM_SCORE_COUNTS)
+    for starter_card in unseen_cards:
+        crib_score_counts_for_starter(
+            cards_to_throw,
+            starter_card,
+            [card for card in unseen_cards if card != starter_card],
+            counts,
+        )
+    return counts
@@ -17,15 +17,35 @@ Pedagogical Goals:
 """
 
 
+import array
+import ctypes
 import itertools
 import collections
-import math
+import mmap
 import os
+import struct
 import random
-import string
-import sys
+import threading
 import time
-import types
+
+# Only needed for the batched scoring in Scorer.score_many, and slower to
+# import than everything else here, so left to load_numpy
+numpy = None
+_numpy_imported = False
+
+
+def load_numpy():
+    """ Import numpy on first use, returning None if it is not installed
+    """
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            numpy_module = None
+        numpy = numpy_module
+    return numpy
 
 HAND_LENGTH = 5
 
@@ -45,6 +65,9 @@ SUITS = {
         CLUBS:    u'♣',
         }
 
+# Suits in Card sort order, used to number the deck 0-51
+SUIT_ORDER = sorted(SUITS.keys())
+
 KING = 13
 QUEEN = 12
 JACK = 11
@@ -101,8 +124,12 @@ def ranged_powerset(iterable, range_):
 class Card(object):
     """ One of the 52 standard playing cards.
 
-    Cards know their suit, rank, and how to be displayed.
+    Cards know their suit, rank, and how to be displayed. Each card also
+    carries its compact form: an index 0-51 and the matching bit of a 52-bit
+    deck mask.
     """
+    __slots__ = ('rank', 'suit', 'index', 'mask')
+
     def __init__(self, rank, suit):
         """
         """
@@ -111,12 +138,18 @@ class Card(object):
 
         self.rank = rank
         self.suit = suit
+        self.index = (rank - 1) * 4 + SUIT_ORDER.index(suit)
+        self.mask = 1 << self.index
+
+    @classmethod
+    def from_index(cls, index):
+        return Deck.cards_by_index()[index]
 
     def __hash__(self):
-        return hash(self.plaintext_print)
+        return self.index
 
     def __eq__(self, other):
-        return self.rank == other.rank and self.suit == other.suit
+        return self.index == other.index
 
     def __cmp__(self, other):
         rank_cmp = self.rank - other.rank
@@ -151,13 +184,129 @@ class Card(object):
     def __repr__(self):
         return self.plaintext_print
 
+FULL_DECK_MASK = (1 << 52) - 1
+
+def cards_to_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= card.mask
+    return mask
+
+def mask_to_indexes(mask):
+    return [index for index in xrange(52) if mask >> index & 1]
+
+def mask_to_cards(mask):
+    cards_by_index = Deck.cards_by_index()
+    return [cards_by_index[index] for index in mask_to_indexes(mask)]
+
 def sum_cards_for_pegging(cards_in_pegging_round):
     return sum(VALUES[card.rank] for card in cards_in_pegging_round)
 
+PEGGING_LIMIT = 31
+PAIR_POINTS = {2: 2, 3: 6, 4: 12}
+# (count, pair_length, recent_ranks) of a round no card has been played in
+PEGGING_ROUND_START = (0, 0, ())
+
+
+def pegging_points(round_state, rank):
+    """ Points for playing rank onto a pegging round in round_state
+
+    round_state is the (count, pair_length, recent_ranks) PeggingState
+    keeps: the count, how many cards of the last rank were played in a
+    row, and the ranks played since a rank last repeated, which is as far
+    back as a run can reach. Scoring takes no scan of the round.
+    """
+    count, pair_length, recent_ranks = round_state
+    points = 0
+    if count + VALUES[rank] in (15, PEGGING_LIMIT):
+        points += 2
+
+    if recent_ranks and recent_ranks[-1] == rank:
+        # A pair breaks any run
+        return points + PAIR_POINTS[pair_length + 1]
+
+    # Longest k >= 3 where the last k ranks are distinct and consecutive
+    lowest = highest = rank
+    num_cards = 1
+    run_length = 0
+    for previous in reversed(recent_ranks):
+        if previous == rank:
+            break
+        lowest = min(lowest, previous)
+        highest = max(highest, previous)
+        num_cards += 1
+        if num_cards >= 3 and highest - lowest == num_cards - 1:
+            run_length = num_cards
+    return points + run_length
+
+
+def pegging_state_after(round_state, rank):
+    """ The round_state pegging_points takes, after rank is played
+    """
+    count, pair_length, recent_ranks = round_state
+    count += VALUES[rank]
+    if recent_ranks and recent_ranks[-1] == rank:
+        return count, pair_length + 1, (rank,)
+    if rank in recent_ranks:
+        recent_ranks = recent_ranks[recent_ranks.index(rank) + 1:]
+    return count, 1, recent_ranks + (rank,)
+
+
+def pegging_round_state(cards_in_pegging_round):
+    """ The round_state of the cards played so far in a pegging round
+    """
+    round_state = PEGGING_ROUND_START
+    for card in cards_in_pegging_round:
+        round_state = pegging_state_after(round_state, card.rank)
+    return round_state
+
+
+class PeggingState(object):
+    """ The count of a pegging round, scored one card at a time.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Start a new round, after a 31 or a go
+        """
+        self.count, self.pair_length, self.recent_ranks = PEGGING_ROUND_START
+
+    @property
+    def round_state(self):
+        return self.count, self.pair_length, self.recent_ranks
+
+    def can_play(self, card):
+        return self.count + VALUES[card.rank] <= PEGGING_LIMIT
+
+    def points_for(self, card):
+        """ Points playing card would score now, without playing it
+        """
+        return pegging_points(self.round_state, card.rank)
+
+    def play(self, card):
+        """ Add card to the count and return the points it scores
+        """
+        if not self.can_play(card):
+            raise ValueError("Card would go over 31.")
+        points = self.points_for(card)
+        self.count, self.pair_length, self.recent_ranks = pegging_state_after(
+            self.round_state, card.rank)
+        return points
+
+    def last_card_points(self):
+        """ Point for the last card of a round that stopped short of 31
+        """
+        if self.recent_ranks and self.count < PEGGING_LIMIT:
+            return 1
+        return 0
+
 class Deck(object):
 
     # XXX: Ghetto memoization
     _all_cards = None
+    _cards_by_index = None
 
     @classmethod
     def all_cards(cls):
@@ -170,13 +319,20 @@ class Deck(object):
         return hand_as_cards
 
     @classmethod
-    def draw(cls, num_cards):
-        """
+    def cards_by_index(cls):
+        if cls._cards_by_index is not None:
+            return cls._cards_by_index
+        cls._cards_by_index = sorted(cls.all_cards(), key=lambda card: card.index)
+        return cls._cards_by_index
+
+    @classmethod
+    def draw(cls, num_cards, rng=random):
+        """ Draw num_cards distinct cards using rng, a random.Random
         """
         if num_cards < 0 or num_cards > 52:
             raise ValueError
         else:
-            return random.sample(cls.all_cards(), num_cards)
+            return rng.sample(cls.all_cards(), num_cards)
 
 
 class Hand(object):
@@ -202,6 +358,17 @@ class Hand(object):
         plaintext_cards = [card.plaintext_print for card in self.all_cards]
         return ' '.join(color_cards)
 
+    @property
+    def mask(self):
+        return cards_to_mask(self.cards)
+
+    @classmethod
+    def from_mask(cls, mask, starter_index=None):
+        starter_card = None
+        if starter_index is not None:
+            starter_card = Card.from_index(starter_index)
+        return cls(mask_to_cards(mask), starter_card)
+
     @property
     def all_cards(self):
         if self.starter_card is not None:
@@ -218,7 +385,107 @@ class Hand(object):
         return cards
 
 
-SERIALIZED_HAND_CACHE = {}
+LRU = 'lru'
+CLOCK = 'clock'
+DEFAULT_SCORE_CACHE_SIZE = 8192
+
+_MISSING = object()
+
+
+class ScoreCache(object):
+    """ Bounded, thread-safe cache of the rank-only part of Scorer.score
+
+    Evicts the least recently used key (LRU), or approximates that with the
+    CLOCK second-chance sweep, which makes hits cheaper. stats counts hits,
+    misses and evictions.
+    """
+
+    def __init__(self, max_size=DEFAULT_SCORE_CACHE_SIZE, policy=LRU):
+        if policy not in (LRU, CLOCK):
+            raise ValueError("No such eviction policy.")
+        if max_size < 1:
+            raise ValueError("Cache must hold at least one entry.")
+        self.max_size = max_size
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            if self.policy == LRU:
+                self.entries = collections.OrderedDict()
+            else:
+                # key -> slot, with the CLOCK ring in parallel lists
+                self.entries = {}
+                self.slot_keys = []
+                self.slot_values = []
+                self.referenced = []
+                self.clock_hand = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if self.policy == LRU:
+                value = self.entries.pop(key, _MISSING)
+                if value is not _MISSING:
+                    self.entries[key] = value
+            else:
+                slot = self.entries.get(key)
+                value = _MISSING
+                if slot is not None:
+                    self.referenced[slot] = True
+                    value = self.slot_values[slot]
+
+            if value is _MISSING:
+                self.stats['misses'] += 1
+                return default
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if self.policy == LRU:
+                self.entries.pop(key, None)
+                self.entries[key] = value
+                if len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+                return
+
+            slot = self.entries.get(key)
+            if slot is not None:
+                self.slot_values[slot] = value
+                self.referenced[slot] = True
+                return
+            if len(self.slot_keys) < self.max_size:
+                self.entries[key] = len(self.slot_keys)
+                self.slot_keys.append(key)
+                self.slot_values.append(value)
+                self.referenced.append(False)
+                return
+
+            while self.referenced[self.clock_hand]:
+                self.referenced[self.clock_hand] = False
+                self.clock_hand = (self.clock_hand + 1) % self.max_size
+            slot = self.clock_hand
+            del self.entries[self.slot_keys[slot]]
+            self.entries[key] = slot
+            self.slot_keys[slot] = key
+            self.slot_values[slot] = value
+            self.clock_hand = (slot + 1) % self.max_size
+            self.stats['evictions'] += 1
+
+
+# Shared by every Scorer.score call in the process that doesn't pass its own
+SCORE_CACHE = ScoreCache()
+RANK_COUNTS_CACHE = {}
+
+# Set to a collections.Counter to count scoring work: Scorer.score calls and
+# cache hits, score_many batches, score table lookups and crib expectations
+SCORER_STATS = None
 
 
 class Scorer(object):
@@ -265,10 +532,92 @@ class Scorer(object):
 
     @classmethod
     def _serialize_hand(cls, cards):
-        return tuple(sorted([VALUES[card.rank] for card in cards]))
+        # Ranks, not values: a king and a queen make fifteens alike but
+        # don't pair or run alike
+        return tuple(sorted([card.rank for card in cards]))
+
+    @classmethod
+    def _score_ranks(cls, all_cards):
+        """ Pairs, fifteens and runs of a sorted hand, as lists of points
+        """
+        pairs = []
+        if Scorer.has_pairs(all_cards):
+            counts = collections.Counter([card.rank for card in all_cards])
+            pairs = [2 * sum(xrange(1, val)) for val in counts.values() if val > 1]
+
+        fifteens = [2 for combo in ranged_powerset(all_cards, [2, 5]) if
+                sum([VALUES[card.rank] for card in combo]) == 15]
+
+        runs = []
+        if Scorer.has_run(all_cards):
+            prev_len = 0
+            for run in reversed(list(ranged_powerset(all_cards, [3, 5]))):
+                run_len = len(run)
+                if runs and run_len != prev_len:
+                    break
+                prev_len = run_len
+                if Scorer.is_run(run):
+                    runs.append(run_len)
+        return pairs, fifteens, runs
 
     @classmethod
-    def score(cls, hand, has_crib=False, is_crib=False):
+    def score_rank_counts(cls, rank_counts):
+        """ Score pairs, fifteens and runs of 13 rank counts, aces first
+
+        Suits are not known here, so flush, nobs and heels are left out.
+        """
+        rank_counts = tuple(rank_counts)
+        if rank_counts not in RANK_COUNTS_CACHE:
+            cards = []
+            for rank_idx, count in enumerate(rank_counts):
+                cards.extend(Card(rank_idx + 1, suit) for suit in SUIT_ORDER[:count])
+            pairs, fifteens, runs = cls._score_ranks(sorted(cards))
+            RANK_COUNTS_CACHE[rank_counts] = dict(
+                score=sum(pairs + fifteens + runs),
+                pairs=sum(pairs),
+                fifteens=sum(fifteens),
+                runs=sum(runs),
+            )
+        return dict(RANK_COUNTS_CACHE[rank_counts])
+
+    @classmethod
+    def score_mask(cls, hand_mask, starter_index=None, has_crib=False, is_crib=False):
+        """ Score a hand given as a 52-bit card mask and a starter card index
+
+        Returns the same dict as score.
+        """
+        indexes = mask_to_indexes(hand_mask)
+        if starter_index is not None and len(indexes) == 4:
+            entry = SCORE_TABLE.lookup(indexes, starter_index)
+            return ScoreTable.unpack(entry, (starter_index >> 2) + 1, has_crib, is_crib)
+        return cls.score(Hand.from_mask(hand_mask, starter_index),
+                has_crib=has_crib, is_crib=is_crib)
+
+    @classmethod
+    def score_many(cls, hands, starters, has_crib=False, is_crib=False):
+        """ Score every 4 card hand against every starter card at once
+
+        Returns a dict with the same keys as score, each holding a
+        (len(hands), len(starters)) numpy array. Starters are expected to be
+        cards outside the hand; a starter that is in the hand scores 0.
+        """
+        if load_numpy() is None:
+            raise RuntimeError("Scorer.score_many requires numpy")
+        if SCORER_STATS is not None:
+            SCORER_STATS['score_many_calls'] += 1
+            SCORER_STATS['score_many_hands'] += len(hands) * len(starters)
+        hand_indexes = [[card.index for card in hand] for hand in hands]
+        starter_indexes = [card.index for card in starters]
+        entries = SCORE_TABLE.lookup_many(hand_indexes, starter_indexes)
+        return ScoreTable.unpack_many(
+            entries,
+            [card.rank for card in starters],
+            has_crib=has_crib,
+            is_crib=is_crib,
+        )
+
+    @classmethod
+    def score(cls, hand, has_crib=False, is_crib=False, cache=None):
         """ Score the hand in this Deal
 
         The following patterns are searched for:
@@ -278,32 +627,31 @@ class Scorer(object):
         Runs - consecutive cards of any suit - 3 for 3, 4 for 4, etc.
         Flush - 4 for 4 in the hand, 5 for 5
         Nobs - J of same suit as starter
+
+        Hands other than 4 cards plus a starter cache their pairs, fifteens
+        and runs in cache, a ScoreCache, or the process-wide SCORE_CACHE.
         """
 
+        if SCORER_STATS is not None:
+            SCORER_STATS['score_calls'] += 1
+        if (hand.starter_card is not None and len(hand.cards) == 4 and
+                SCORE_TABLE.load_if_present() is not None):
+            return SCORE_TABLE.score(hand, has_crib=has_crib, is_crib=is_crib)
+
         all_cards = sorted(hand.all_cards)
+        if cache is None:
+            cache = SCORE_CACHE
         serialized_hand = cls._serialize_hand(all_cards)
-        if serialized_hand in SERIALIZED_HAND_CACHE:
-            pairs, fifteens, runs = SERIALIZED_HAND_CACHE[serialized_hand]
+        cached = cache.get(serialized_hand)
+        if cached is not None:
+            if SCORER_STATS is not None:
+                SCORER_STATS['score_cache_hits'] += 1
+            pairs, fifteens, runs = cached
         else:
-            pairs = []
-            if Scorer.has_pairs(all_cards):
-                counts = collections.Counter([card.rank for card in all_cards])
-                pairs = [2 * sum(xrange(1, val)) for val in counts.values() if val > 1]
-
-            fifteens = [2 for combo in ranged_powerset(all_cards, [2, 5]) if
-                    sum([VALUES[card.rank] for card in combo]) == 15]
-
-            runs = []
-            if Scorer.has_run(all_cards):
-                prev_len = 0
-                for run in reversed(list(ranged_powerset(all_cards, [3, 5]))):
-                    run_len = len(run)
-                    if runs and run_len != prev_len:
-                        break
-                    prev_len = run_len
-                    if Scorer.is_run(run):
-                        runs.append(run_len)
-            SERIALIZED_HAND_CACHE[serialized_hand] = (pairs, fifteens, runs)
+            if SCORER_STATS is not None:
+                SCORER_STATS['score_cache_misses'] += 1
+            pairs, fifteens, runs = cls._score_ranks(all_cards)
+            cache.put(serialized_hand, (pairs, fifteens, runs))
 
         flush_points = Scorer.flush_points(all_cards)
         if flush_points != 5 and is_crib:
@@ -315,11 +663,10 @@ class Scorer(object):
         if hand.starter_card is not None:
             heels = [2 if hand.starter_card.rank == JACK and has_crib else 0]
 
-            if not heels:
-                nobs = [1 for card in cards if card.rank == JACK and card.suit ==
-                    hand.starter_card.suit]
+            nobs = [1 for card in hand.cards if card.rank == JACK and card.suit ==
+                hand.starter_card.suit]
 
-                assert sum(nobs) in [0, 1]
+            assert sum(nobs) in [0, 1]
 
         score = sum(pairs + fifteens + runs + nobs + heels) + flush_points
 
@@ -335,7 +682,401 @@ class Scorer(object):
 
         return score_dict
 
+
+def binomial(n, k):
+    if k < 0 or k > n:
+        return 0
+    result = 1
+    for i in xrange(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+# Length of a score count array: every hand or crib score, up to 29 plus heels
+NUM_SCORE_COUNTS = 32
+
+
+def score_counts(scores):
+    """ How many of scores are each score, as a compact count array
+    """
+    counts = array.array(b'H', [0] * NUM_SCORE_COUNTS)
+    for score in scores:
+        counts[score] += 1
+    return counts
+
+
+def mean_score(counts):
+    """ Mean score of a score count array
+    """
+    return float(sum(score * count for score, count in enumerate(counts))) / sum(counts)
+
+# Colex offsets for ranking sorted 4 card combinations of the deck
+_COMBO_OFFSETS = [[binomial(i, k) for i in xrange(52)] for k in xrange(1, 5)]
+
+# Bit layout of a packed ScoreTable entry. Rank and suit parts live in
+# disjoint bits so that they can simply be added together.
+PAIRS_SHIFT = 0
+FIFTEENS_SHIFT = 4
+RUNS_SHIFT = 9
+FLUSH_SHIFT = 13
+NOBS_SHIFT = 15
+FLUSH_POINTS = (0, 4, 5)
+
+SCORE_TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'score_table.bin',
+)
+# Built only on request, with python cribbage.py --build_score_table; until
+# then scoring falls back to computing entries directly.
+# A saved table starts with the magic, the format version and the number of
+# entries; bump the version whenever the packing or the scoring changes so
+# tables saved by older code are rebuilt rather than misread
+SCORE_TABLE_MAGIC = b'CRIBSCR1'
+SCORE_TABLE_VERSION = 1
+SCORE_TABLE_HEADER = struct.Struct(b'<8sII')
+
+
+class ScoreTable(object):
+    """ Precomputed scores for every 4 card hand plus starter.
+
+    Each entry packs pairs, fifteens, runs, flush and nobs into 16 bits, and
+    is found at the colex rank of the sorted hand's card indexes times 52
+    plus the starter's card index. Heels only depends on the starter and
+    who owns the crib, so it is added at lookup time.
+
+    The table is about 28MB, so it is never built behind a caller's back:
+    build it once with python cribbage.py --build_score_table. Without a
+    saved table, lookups compute the same entries directly.
+    """
+    NUM_HANDS = binomial(52, 4)
+    RANK_WEIGHTS = [5 ** rank_idx for rank_idx in xrange(13)]
+
+    # XXX: Ghetto memoization
+    _rank_parts = None
+
+    def __init__(self, path=SCORE_TABLE_PATH):
+        self.path = path
+        self.entries = None
+        self.build_time = None
+        self.load_time = None
+        self._mmap = None
+        # Set once loading has failed, so a missing table isn't looked for
+        # on every lookup
+        self._unavailable = False
+
+    @property
+    def nbytes(self):
+        if self.entries is None:
+            return 0
+        return ctypes.sizeof(self.entries) if self._mmap is not None else (
+                len(self.entries) * self.entries.itemsize)
+
+    @property
+    def stats(self):
+        return dict(
+            entries=len(self.entries) if self.entries is not None else 0,
+            nbytes=self.nbytes,
+            build_time=self.build_time,
+            load_time=self.load_time,
+        )
+
+    @classmethod
+    def hand_rank(cls, hand_indexes):
+        c0, c1, c2, c3 = sorted(hand_indexes)
+        return (_COMBO_OFFSETS[0][c0] + _COMBO_OFFSETS[1][c1] +
+                _COMBO_OFFSETS[2][c2] + _COMBO_OFFSETS[3][c3])
+
+    @classmethod
+    def entry_index(cls, hand_indexes, starter_index):
+        return cls.hand_rank(hand_indexes) * 52 + starter_index
+
+    @classmethod
+    def rank_parts(cls):
+        """ Packed pairs, fifteens and runs of every 5 card rank multiset
+
+        Keyed by the rank counts read as a base 5 number, aces lowest.
+        Once SCORE_TABLE is loaded these are read out of it, which is
+        several times faster than scoring every multiset.
+        """
+        if cls._rank_parts is not None:
+            return cls._rank_parts
+        if SCORE_TABLE.load_if_present() is not None:
+            cls._rank_parts = cls._rank_parts_from_entries(SCORE_TABLE.entries)
+            return cls._rank_parts
+        rank_parts = {}
+        for ranks in itertools.combinations_with_replacement(xrange(1, 14), 5):
+            counts = collections.Counter(ranks)
+            if max(counts.values()) > 4:
+                continue
+            cards = []
+            for rank, count in counts.items():
+                cards.extend(Card(rank, suit) for suit in SUIT_ORDER[:count])
+            pairs, fifteens, runs = Scorer._score_ranks(sorted(cards))
+            key = sum(5 ** (rank - 1) for rank in ranks)
+            rank_parts[key] = (
+                (sum(pairs) << PAIRS_SHIFT) |
+                (sum(fifteens) << FIFTEENS_SHIFT) |
+                (sum(runs) << RUNS_SHIFT)
+            )
+        cls._rank_parts = rank_parts
+        return rank_parts
+
+    @classmethod
+    def _rank_parts_from_entries(cls, entries):
+        rank_weights = [5 ** rank_idx for rank_idx in xrange(13)]
+        rank_mask = (0xF << PAIRS_SHIFT) | (0x1F << FIFTEENS_SHIFT) | (0xF << RUNS_SHIFT)
+        rank_parts = {}
+        for ranks in itertools.combinations_with_replacement(xrange(13), 5):
+            if ranks[0] == ranks[4]:
+                # Five of a kind
+                continue
+            # Same ranks take successive suits, so the indexes come out sorted
+            indexes = []
+            suit_idx = 0
+            for position, rank_idx in enumerate(ranks):
+                suit_idx = suit_idx + 1 if position and ranks[position - 1] == rank_idx else 0
+                indexes.append(rank_idx * 4 + suit_idx)
+            entry = entries[cls.entry_index(indexes[:4], indexes[4])]
+            rank_parts[sum(rank_weights[rank_idx] for rank_idx in ranks)] = entry & rank_mask
+        return rank_parts
+
+    @classmethod
+    def row(cls, hand_indexes, rank_parts=None):
+        """ The 52 packed entries of a 4 card hand, one per starter index
+        """
+        if rank_parts is None:
+            rank_parts = cls.rank_parts()
+        rank_weights = cls.RANK_WEIGHTS
+        key = sum(rank_weights[idx >> 2] for idx in hand_indexes)
+        by_rank = [rank_parts.get(key + weight, 0) for weight in rank_weights]
+
+        suit_counts = [0, 0, 0, 0]
+        for idx in hand_indexes:
+            suit_counts[idx & 3] += 1
+        most_of_one_suit = max(suit_counts)
+        jack_suits = [idx & 3 for idx in hand_indexes if idx >> 2 == JACK - 1]
+        by_suit = []
+        for suit_idx in xrange(4):
+            flush_len = max(most_of_one_suit, suit_counts[suit_idx] + 1)
+            flush_code = max(flush_len - 3, 0)
+            nobs = int(suit_idx in jack_suits)
+            by_suit.append((flush_code << FLUSH_SHIFT) | (nobs << NOBS_SHIFT))
+
+        row = [by_rank[idx >> 2] + by_suit[idx & 3] for idx in xrange(52)]
+        for idx in hand_indexes:
+            row[idx] = 0
+        return row
+
+    def build(self):
+        start_time = time.time()
+        rank_parts = self.rank_parts()
+        entries = array.array(b'H')
+
+        # Nested loops with the largest card outermost walk the hands in
+        # colex order, matching entry_index
+        for c3 in xrange(52):
+            for c2 in xrange(c3):
+                for c1 in xrange(c2):
+                    for c0 in xrange(c1):
+                        entries.extend(self.row((c0, c1, c2, c3), rank_parts))
+
+        self.entries = entries
+        self._mmap = None
+        self.build_time = time.time() - start_time
+        return self
+
+    def save(self, path=None):
+        """ Write the table, renaming it into place once it is complete
+        """
+        path = path or self.path
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as table_file:
+            table_file.write(SCORE_TABLE_HEADER.pack(
+                SCORE_TABLE_MAGIC, SCORE_TABLE_VERSION, len(self.entries)))
+            self.entries.tofile(table_file)
+        os.rename(temp_path, path)
+
+    def load(self, path=None):
+        """ Map a saved table into memory, read-only and without copying
+
+        Every process that loads the same file shares its pages through
+        the OS page cache, so more workers add no table memory. Raises
+        ValueError for a file saved by an older version of the table.
+        """
+        start_time = time.time()
+        num_entries = self.NUM_HANDS * 52
+        with open(path or self.path, 'rb') as table_file:
+            header = table_file.read(SCORE_TABLE_HEADER.size)
+            if len(header) < SCORE_TABLE_HEADER.size:
+                raise EOFError
+            if SCORE_TABLE_HEADER.unpack(header) != (
+                    SCORE_TABLE_MAGIC, SCORE_TABLE_VERSION, num_entries):
+                raise ValueError("Stale score table: %s" % (path or self.path))
+            # A copy-on-write map is the only kind ctypes can wrap; nothing
+            # writes to it, so its pages are never copied
+            table_map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(table_map) < SCORE_TABLE_HEADER.size + 2 * num_entries:
+            table_map.close()
+            raise EOFError
+        self.entries = (ctypes.c_uint16 * num_entries).from_buffer(
+                table_map, SCORE_TABLE_HEADER.size)
+        self._mmap = table_map
+        self.load_time = time.time() - start_time
+        return self
+
+    def load_if_present(self):
+        """ The table's entries, loading the saved table on first use
+
+        Returns None if there is no current table saved at path, which is
+        only looked for once. Nothing is ever built here.
+        """
+        if self.entries is None and not self._unavailable:
+            try:
+                self.load()
+            except (IOError, OSError, EOFError, ValueError):
+                self._unavailable = True
+        return self.entries
+
+    def build_and_save(self):
+        """ Build the table and save it to path, then map the saved file
+
+        Mapping it back means the process that built it shares the file's
+        pages like every other.
+        """
+        self.build()
+        self.save()
+        self._unavailable = False
+        return self.load()
+
+    def lookup(self, hand_indexes, starter_index):
+        entries = self.load_if_present()
+        if SCORER_STATS is not None:
+            SCORER_STATS['score_table_lookups'] += 1
+        if entries is None:
+            return self.row(hand_indexes)[starter_index]
+        return entries[self.entry_index(hand_indexes, starter_index)]
+
+    def as_numpy(self):
+        """ A zero-copy numpy view of the packed entries, or None without a table
+        """
+        load_numpy()
+        entries = self.load_if_present()
+        if entries is None:
+            return None
+        return numpy.frombuffer(entries, dtype=numpy.uint16)
+
+    def lookup_many(self, hands_indexes, starter_indexes):
+        """ Packed entries for every hand's card indexes against every starter index
+        """
+        load_numpy()
+        if SCORER_STATS is not None:
+            SCORER_STATS['score_table_lookups'] += len(hands_indexes) * len(starter_indexes)
+        table = self.as_numpy()
+        starter_indexes = numpy.asarray(starter_indexes, dtype=numpy.int64)
+        if table is None:
+            rank_parts = self.rank_parts()
+            rows = numpy.array([self.row(hand_indexes, rank_parts) for hand_indexes in hands_indexes],
+                    dtype=numpy.uint16).reshape(len(hands_indexes), 52)
+            return rows[:, starter_indexes]
+        hand_ranks = [self.hand_rank(hand_indexes) for hand_indexes in hands_indexes]
+        entry_indexes = (numpy.asarray(hand_ranks, dtype=numpy.int64)[:, None] * 52 +
+                starter_indexes[None, :])
+        return table[entry_indexes]
+
+    @classmethod
+    def unpack_many(cls, entries, starter_ranks, has_crib=False, is_crib=False):
+        """ Vectorized unpack, returning an array per Scorer.score category
+        """
+        load_numpy()
+        entries = entries.astype(numpy.int32)
+        pairs = (entries >> PAIRS_SHIFT) & 0xF
+        fifteens = (entries >> FIFTEENS_SHIFT) & 0x1F
+        runs = (entries >> RUNS_SHIFT) & 0xF
+        flushes = numpy.array(FLUSH_POINTS, dtype=numpy.int32)[(entries >> FLUSH_SHIFT) & 0x3]
+        if is_crib:
+            # Crib flushes must be all 5
+            flushes[flushes != 5] = 0
+        nobs = (entries >> NOBS_SHIFT) & 0x1
+        heels = numpy.zeros_like(entries)
+        if has_crib:
+            heels[:, numpy.asarray(starter_ranks) == JACK] = 2
+        return dict(
+            score=pairs + fifteens + runs + flushes + nobs + heels,
+            pairs=pairs,
+            fifteens=fifteens,
+            runs=runs,
+            flushes=flushes,
+            nobs=nobs,
+            heels=heels,
+        )
+
+    @classmethod
+    def points(cls, entry, starter_rank, has_crib=False, is_crib=False):
+        """ Total points of a packed entry, without building the full dict
+        """
+        flushes = FLUSH_POINTS[(entry >> FLUSH_SHIFT) & 0x3]
+        if flushes != 5 and is_crib:
+            flushes = 0
+        return (((entry >> PAIRS_SHIFT) & 0xF) +
+                ((entry >> FIFTEENS_SHIFT) & 0x1F) +
+                ((entry >> RUNS_SHIFT) & 0xF) +
+                flushes +
+                ((entry >> NOBS_SHIFT) & 0x1) +
+                (2 if starter_rank == JACK and has_crib else 0))
+
+    @classmethod
+    def unpack(cls, entry, starter_rank, has_crib=False, is_crib=False):
+        """ Expand a packed entry into the Scorer.score dict
+        """
+        pairs = (entry >> PAIRS_SHIFT) & 0xF
+        fifteens = (entry >> FIFTEENS_SHIFT) & 0x1F
+        runs = (entry >> RUNS_SHIFT) & 0xF
+        flushes = FLUSH_POINTS[(entry >> FLUSH_SHIFT) & 0x3]
+        if flushes != 5 and is_crib:
+            # Crib flushes must be all 5
+            flushes = 0
+        nobs = (entry >> NOBS_SHIFT) & 0x1
+        heels = 2 if starter_rank == JACK and has_crib else 0
+        return dict(
+            score=pairs + fifteens + runs + flushes + nobs + heels,
+            pairs=pairs,
+            fifteens=fifteens,
+            runs=runs,
+            flushes=flushes,
+            nobs=nobs,
+            heels=heels,
+        )
+
+    def score(self, hand, has_crib=False, is_crib=False):
+        entry = self.lookup(
+            [card.index for card in hand.cards],
+            hand.starter_card.index,
+        )
+        return self.unpack(entry, hand.starter_card.rank, has_crib, is_crib)
+
+
+SCORE_TABLE = ScoreTable()
+
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score some hands, or build the score table.')
+    parser.add_argument(
+        '--build_score_table',
+        action='store_true',
+        help='Build the score table and save it to --score_table_path',
+    )
+    parser.add_argument(
+        '--score_table_path',
+        default=SCORE_TABLE_PATH,
+        required=False,
+        help='Where the score table is saved',
+    )
+    args = parser.parse_args()
+    if args.build_score_table:
+        table = ScoreTable(args.score_table_path).build_and_save()
+        print "Score table:", table.stats
+        raise SystemExit
+
     cards = Deck.all_cards()
     test_hand1 = Hand([cards[0], cards[1], cards[2], cards[5], cards[9]])
     print test_hand1.prompt
@@ -345,3 +1086,6 @@ if __name__ == '__main__':
         print hand.prompt
         print Scorer.score(hand)
 
+    if SCORE_TABLE.load_if_present() is not None:
+        print "Score table:", SCORE_TABLE.stats
+
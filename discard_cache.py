@@ -0,0 +1,184 @@
+""" Persistent cache of crib throw decisions.
+
+Decisions are keyed by the 6 dealt cards, reduced under suit permutation,
+and whether the bot owns the crib. Each bot class gets its own table: a
+fixed-size open-addressing hash file that is memory mapped, so worker
+processes forked from one parent (or opening the same directory) share
+every stored decision. A small LRU dict sits in front of the file.
+"""
+
+import collections
+import errno
+import mmap
+import os
+import struct
+import zlib
+
+import canonical
+import cribbage
+
+MAGIC = b'CRIBDSC1'
+HEADER = struct.Struct(b'<8sII')
+# key, expected score, keep-4 bitmask over the sorted canonical cards, check
+RECORD = struct.Struct(b'<QfBB2x')
+OCCUPIED = 1 << 63
+HAS_CRIB = 1 << 52
+
+DEFAULT_NUM_SLOTS = 1 << 20
+DEFAULT_MEMORY_SIZE = 100000
+MAX_PROBES = 8
+
+
+def _check_byte(key, score, keep):
+    return zlib.crc32(RECORD.pack(key, score, keep, 0)) & 0xFF
+
+
+class DiscardTable(object):
+    """ Memory-mapped open-addressing table of decision records
+    """
+
+    def __init__(self, path, num_slots=DEFAULT_NUM_SLOTS):
+        if not os.path.exists(path):
+            self._create(path, num_slots)
+        self.table_file = open(path, 'r+b')
+        header = self.table_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("Not a discard cache file: %s" % path)
+        magic, record_size, num_slots = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError("Not a discard cache file: %s" % path)
+        size = HEADER.size + num_slots * RECORD.size
+        self.num_slots = num_slots
+        self.data = mmap.mmap(self.table_file.fileno(), size)
+
+    @classmethod
+    def _create(cls, path, num_slots):
+        """ Create an empty table at path, unless another process got there first
+
+        The table is written under a temporary name and linked into place,
+        which fails rather than replaces if path already exists, so path
+        only ever holds a complete header and no process can truncate a
+        table another one has mapped.
+        """
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as table_file:
+            table_file.write(HEADER.pack(MAGIC, RECORD.size, num_slots))
+            table_file.truncate(HEADER.size + num_slots * RECORD.size)
+        try:
+            os.link(temp_path, path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        finally:
+            os.unlink(temp_path)
+
+    def _slots(self, key):
+        start = (key * 0x9E3779B97F4A7C15 >> 11) % self.num_slots
+        for probe in xrange(MAX_PROBES):
+            yield HEADER.size + ((start + probe) % self.num_slots) * RECORD.size
+
+    def get(self, key):
+        for offset in self._slots(key):
+            stored_key, score, keep, check = RECORD.unpack_from(self.data, offset)
+            if not stored_key:
+                return None
+            if stored_key == key and check == _check_byte(key, score, keep):
+                return keep, score
+        return None
+
+    def put(self, key, keep, score):
+        score = struct.unpack(b'<f', struct.pack(b'<f', score))[0]
+        record = RECORD.pack(key, score, keep, _check_byte(key, score, keep))
+        target = None
+        for offset in self._slots(key):
+            stored_key = RECORD.unpack_from(self.data, offset)[0]
+            if not stored_key or stored_key == key:
+                target = offset
+                break
+        if target is None:
+            # Probe sequence is full, replace its first slot
+            target = next(self._slots(key))
+        self.data[target:target + RECORD.size] = record
+
+    def close(self):
+        self.data.close()
+        self.table_file.close()
+
+
+class DiscardCache(object):
+    """ Crib throw decisions shared across games, bots and processes
+
+    stats counts memory hits, disk hits, misses, stores and evictions from
+    the in-memory front.
+    """
+
+    def __init__(self, directory, num_slots=DEFAULT_NUM_SLOTS, memory_size=DEFAULT_MEMORY_SIZE):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.num_slots = num_slots
+        self.memory_size = memory_size
+        self.memory = collections.OrderedDict()
+        self.tables = {}
+        self.stats = collections.Counter()
+
+    def _table(self, namespace):
+        if namespace not in self.tables:
+            path = os.path.join(self.directory, '%s.bin' % namespace)
+            self.tables[namespace] = DiscardTable(path, self.num_slots)
+        return self.tables[namespace]
+
+    @classmethod
+    def _key(cls, cards, has_crib):
+        mask, perm = canonical.canonical_mask(cards)
+        key = OCCUPIED | mask
+        if has_crib:
+            key |= HAS_CRIB
+        return key, mask, perm
+
+    def _remember(self, memory_key, value):
+        self.memory[memory_key] = value
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def lookup(self, namespace, cards, has_crib):
+        """ Cached (keep cards, expected score) for a 6 card deal, or None
+        """
+        key, mask, perm = self._key(cards, has_crib)
+        memory_key = (namespace, key)
+        value = self.memory.pop(memory_key, None)
+        if value is not None:
+            self.memory[memory_key] = value
+            self.stats['hits'] += 1
+        else:
+            value = self._table(namespace).get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+            self._remember(memory_key, value)
+
+        keep, score = value
+        canonical_indexes = cribbage.mask_to_indexes(mask)
+        kept_indexes = [index for position, index in enumerate(canonical_indexes)
+                if keep >> position & 1]
+        keep_cards = [cribbage.Card.from_index(index)
+                for index in canonical.uncanonicalize_indexes(kept_indexes, perm)]
+        return keep_cards, score
+
+    def store(self, namespace, cards, has_crib, keep_cards, score):
+        key, mask, perm = self._key(cards, has_crib)
+        kept_indexes = set(canonical.permute_index(card.index, perm) for card in keep_cards)
+        keep = 0
+        for position, index in enumerate(cribbage.mask_to_indexes(mask)):
+            if index in kept_indexes:
+                keep |= 1 << position
+        self._table(namespace).put(key, keep, score)
+        self._remember((namespace, key), (keep, score))
+        self.stats['stores'] += 1
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
@@ -1,22 +1,87 @@
 import argparse
+import collections
+import contextlib
 import logging
+import multiprocessing
+import multiprocessing.util
+import os
 import random
 import time
 
+import bot
+import bot_logging
 import cribbage
+import discard_cache
+import game_record
+import instrumentation
 import kyle_ai
+import sprt
 import test_ai
 
 GAME_OVER_POINTS = 121
 MAX_TIME_FOR_PLAY = 15
+# Share of the time limit given to bots as their deadline, leaving room to
+# return a best-so-far answer before the limit forfeits the game
+DEADLINE_FRACTION = 0.9
+# Phases where going over the time limit forfeits the game. Pegging plays
+# get a deadline and are timed, but as before they were timed, a slow one
+# doesn't forfeit
+FORFEIT_PHASES = (instrumentation.THROW,)
+PAIR_SEED_STRIDE = 1000003
+# Most games an --sprt run plays when --num_games isn't given
+SPRT_MAX_GAMES = 100000
+
+class Play(object):
+    """ A call GameRunner needs made on one of its bots
+
+    A phase of None marks a notification, which is neither timed nor
+    answered.
+    """
+    __slots__ = ('player_index', 'phase', 'method', 'args')
+
+    def __init__(self, player_index, phase, method, *args):
+        self.player_index = player_index
+        self.phase = phase
+        self.method = method
+        self.args = args
+
 
 class GameRunner(object):
+    """ Referees a game between two bots
+
+    The rules live in generators (game_plays, round_plays and
+    pegging_plays) that yield a Play whenever a bot is needed and are sent
+    its answer, so the same game can be driven synchronously by run_game
+    or interleaved with many others by match_server.
+    """
 
-    def __init__(self, bot1, bot2):
+    def __init__(self, bot1, bot2, seed=None, stats=None, profile=False,
+            max_time_for_play=MAX_TIME_FOR_PLAY, recorder=None):
         self.bots = [bot1, bot2]
         self.bot1 = bot1
         self.bot2 = bot2
         self.forfeits = [False, False]
+        self.max_time_for_play = max_time_for_play
+        # Optional instrumentation.Instrumentation, and whether to also run
+        # its sampling profiler for this game
+        self.stats = stats
+        self.profile = profile
+        # Optional game_record.GameRecordWriter that every finished game is
+        # written to
+        self.recorder = recorder
+        self.record = None
+
+        # Always settle on a concrete seed, so a recorded game can be replayed
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        self.seed = seed
+
+        # Dealing and each bot get their own stream, so a bot's sampling
+        # never changes the cards dealt and a game replays from its seed
+        seed_rng = random.Random(seed)
+        self.deal_rng = random.Random(seed_rng.getrandbits(64))
+        for bot in self.bots:
+            bot.rng = random.Random(seed_rng.getrandbits(64))
 
     def player_index(self, bot):
         if bot is self.bot1:
@@ -27,63 +92,115 @@ class GameRunner(object):
     def _game_over(self):
         return self.scores[0] >= GAME_OVER_POINTS or self.scores[1] >= GAME_OVER_POINTS or any(self.forfeits)
 
-    def _time_play(self, player_index, run_func, *run_args, **run_kwargs):
+    def _time_play(self, player_index, phase, run_func, *run_args, **run_kwargs):
+        bot = self.bots[player_index]
         start_time = time.time()
-        ret_val = run_func(*run_args, **run_kwargs)
+        bot.deadline = start_time + self.max_time_for_play * DEADLINE_FRACTION
+        bot.scores = [self.scores[player_index], self.scores[player_index ^ 1]]
+        try:
+            with self._counting():
+                ret_val = run_func(*run_args, **run_kwargs)
+        finally:
+            bot.deadline = None
+            bot.scores = None
         end_time = time.time()
-        if end_time - start_time > MAX_TIME_FOR_PLAY:
+        if self.stats is not None:
+            self.stats.record(
+                type(self.bots[player_index]).__name__, phase, end_time - start_time)
+        if phase in FORFEIT_PHASES and end_time - start_time > self.max_time_for_play:
             self.forfeits[player_index] = True
         return ret_val
 
+    def run_play(self, play):
+        """ Make play's call on a local bot, timing it if it is a decision
+        """
+        method = getattr(self.bots[play.player_index], play.method)
+        if play.phase is None:
+            return method(*play.args)
+        return self._time_play(play.player_index, play.phase, method, *play.args)
+
+    def _drive(self, plays):
+        answer = None
+        while True:
+            try:
+                play = plays.send(answer)
+            except StopIteration:
+                return
+            answer = self.run_play(play)
+
     def do_pegging(self, player_one_has_crib):
+        self._drive(self.pegging_plays(player_one_has_crib))
+
+    def pegging_plays(self, player_one_has_crib):
         player_idx_to_start = 0
         if player_one_has_crib:
             player_idx_to_start = 1
 
         all_cards_pegged = set()
         cards_in_pegging_round = []
+        pegging = cribbage.PeggingState()
+        last_player_idx = None
         gos = [False, False]
         while len(all_cards_pegged) < 8 and not self._game_over():
-            peg_card = self.bots[player_idx_to_start].ask_for_next_peg_card(
+            peg_card = yield Play(
+                player_idx_to_start,
+                instrumentation.PEG,
+                'ask_for_next_peg_card',
                 list(cards_in_pegging_round),
                 list(all_cards_pegged),
             )
             if peg_card is None:
                 gos[player_idx_to_start] = True
+                points = 0
                 if sum(gos) == 2:
                     gos = [False, False]
                     cards_in_pegging_round = []
-                    self.scores[player_idx_to_start] += 1
+                    points = pegging.last_card_points()
+                    pegging.reset()
+                self._score_peg(player_idx_to_start, None, points)
                 player_idx_to_start ^= 1
                 continue
 
             # TODO: Check if cheating
             all_cards_pegged.add(peg_card)
             cards_in_pegging_round.append(peg_card)
-            # TODO: Score card
-            pegging_sum = cribbage.sum_cards_for_pegging(cards_in_pegging_round)
-            assert pegging_sum <= 31
-            if pegging_sum == 31:
+            self._score_peg(player_idx_to_start, peg_card, pegging.play(peg_card))
+            last_player_idx = player_idx_to_start
+            if pegging.count == cribbage.PEGGING_LIMIT:
                 gos = [False, False]
                 cards_in_pegging_round = []
-                self.scores[player_idx_to_start] += 2
+                pegging.reset()
             player_idx_to_start ^= 1
 
-    def _run_round(self, player_one_has_crib):
-        cards = cribbage.Deck.draw(13)
+        if len(all_cards_pegged) == 8 and not self._game_over():
+            points = pegging.last_card_points()
+            self.scores[last_player_idx] += points
+            if self.record is not None:
+                self.record.rounds[-1].pegging_points[last_player_idx] += points
+
+    def _score_peg(self, player_index, peg_card, points):
+        self.scores[player_index] += points
+        if self.record is not None:
+            self.record.record_peg(player_index, peg_card, points)
+
+    def round_plays(self, player_one_has_crib):
+        cards = cribbage.Deck.draw(13, self.deal_rng)
         hand1_cards = sorted(cards[0:6])
         hand2_cards = sorted(cards[6:12])
         starter_card = cards[-1]
 
         hand1 = cribbage.Hand(list(hand1_cards))
         hand2 = cribbage.Hand(list(hand2_cards))
+        if self.record is not None:
+            self.record.start_round(player_one_has_crib, [hand1_cards, hand2_cards], starter_card)
 
-        self.bot1.notify_new_hand(hand1)
-        self.bot2.notify_new_hand(hand2)
+        yield Play(0, None, 'notify_new_hand', hand1)
+        yield Play(1, None, 'notify_new_hand', hand2)
 
-        bot1_crib_throw = self._time_play(
+        bot1_crib_throw = yield Play(
             0,
-            self.bot1.ask_for_crib_throw,
+            instrumentation.THROW,
+            'ask_for_crib_throw',
             player_one_has_crib,
             self.scores,
         )
@@ -93,9 +210,10 @@ class GameRunner(object):
             self.scores[0] = -1
             return
 
-        bot2_crib_throw = self._time_play(
+        bot2_crib_throw = yield Play(
             1,
-            self.bot2.ask_for_crib_throw,
+            instrumentation.THROW,
+            'ask_for_crib_throw',
             not player_one_has_crib,
             list(reversed(self.scores)),
         )
@@ -106,11 +224,21 @@ class GameRunner(object):
             return
 
         crib_cards = bot1_crib_throw + bot2_crib_throw
+        if self.record is not None:
+            self.record.record_throws([bot1_crib_throw, bot2_crib_throw])
 
-        self.bot1.notify_starter_card(starter_card)
-        self.bot2.notify_starter_card(starter_card)
+        yield Play(0, None, 'notify_starter_card', starter_card)
+        yield Play(1, None, 'notify_starter_card', starter_card)
 
-        self.do_pegging(player_one_has_crib)
+        # Python 2 has no yield from, so pass the pegging plays through
+        pegging = self.pegging_plays(player_one_has_crib)
+        answer = None
+        while True:
+            try:
+                play = pegging.send(answer)
+            except StopIteration:
+                break
+            answer = yield play
         if self._game_over():
             return
 
@@ -118,57 +246,384 @@ class GameRunner(object):
         if player_one_has_crib:
             count_order.reverse()
         for player_idx in count_order:
-            self.scores[player_idx] += cribbage.Scorer.score(
+            self.scores[player_idx] += self._time_count(
+                player_idx,
+                game_record.COUNTS[player_idx],
                 self.bots[player_idx].hand,
                 has_crib=bool(player_one_has_crib ^ player_idx),
-            )['score']
+            )
             if self._game_over():
                 return
 
         crib = cribbage.Hand(crib_cards)
         crib.add_starter_card(starter_card)
 
-        self.scores[count_order[-1]] += cribbage.Scorer.score(crib, is_crib=True)['score']
+        self.scores[count_order[-1]] += self._time_count(count_order[-1], 'crib', crib, is_crib=True)
+
+    @contextlib.contextmanager
+    def _counting(self):
+        """ Context in which Scorer counts its work into this game's stats
+        """
+        if self.stats is None:
+            yield
+        else:
+            with self.stats.counting():
+                yield
+
+    def _time_count(self, player_index, count_name, hand, **score_kwargs):
+        start_time = time.time()
+        with self._counting():
+            score_dict = cribbage.Scorer.score(hand, **score_kwargs)
+        if self.stats is not None:
+            self.stats.record(
+                type(self.bots[player_index]).__name__,
+                instrumentation.COUNT,
+                time.time() - start_time,
+            )
+        if self.record is not None:
+            self.record.record_count(count_name, score_dict)
+        return score_dict['score']
 
     def run_game(self):
+        profiling = self.stats is not None and self.profile
+        if profiling:
+            self.stats.profiler.start()
+        try:
+            self._drive(self.game_plays())
+        finally:
+            if profiling:
+                self.stats.profiler.stop()
+        return self.scores
+
+    def game_plays(self):
         self.scores = [0, 0]
-        player_one_has_crib = bool(random.choice([0, 1]))
+        player_one_has_crib = bool(self.deal_rng.choice([0, 1]))
+        if self.recorder is not None:
+            self.record = game_record.GameRecord(
+                self.seed, [type(bot).__name__ for bot in self.bots])
 
         while not self._game_over():
-            self._run_round(player_one_has_crib)
+            round_plays = self.round_plays(player_one_has_crib)
+            answer = None
+            while True:
+                try:
+                    play = round_plays.send(answer)
+                except StopIteration:
+                    break
+                answer = yield play
             player_one_has_crib = bool(not player_one_has_crib)
 
-        return self.scores
+        # A forfeit loses however far ahead the player was
+        for player_idx, forfeited in enumerate(self.forfeits):
+            if forfeited:
+                self.scores[player_idx] = -1
+
+        if self.record is not None:
+            self.record.finish(self.scores, self.forfeits)
+            self.recorder.write(self.record)
+            self.record = None
+
+
+def game_outcome(scores):
+    """ Points for player one: 1 for a win, 0.5 for a draw and 0 for a loss
+
+    Forfeited games are scored -1, so they count as losses.
+    """
+    if scores[0] > scores[1]:
+        return 1.0
+    elif scores[0] < scores[1]:
+        return 0.0
+    return 0.5
+
+
+def pair_seed(seed, pair_idx):
+    """ Deterministic seed for one mirrored pair of games
+    """
+    return seed * PAIR_SEED_STRIDE + pair_idx
+
+
+def play_mirrored_pair(players, seed, stats=None, profile=False,
+        max_time_for_play=MAX_TIME_FOR_PLAY, recorder=None):
+    """ Play a game, then replay the same deals with the seats swapped
+
+    Scores of the mirrored game are reported in the original seat order.
+    """
+    runner = GameRunner(*[player() for player in players], seed=seed,
+            stats=stats, profile=profile,
+            max_time_for_play=max_time_for_play, recorder=recorder)
+    first_scores = runner.run_game()
+
+    runner = GameRunner(*list(reversed([player() for player in players])), seed=seed,
+            stats=stats, profile=profile,
+            max_time_for_play=max_time_for_play, recorder=recorder)
+    second_scores = list(reversed(runner.run_game()))
+    return first_scores, second_scores
+
+
+# Each process appends to its own record file, opened on first use
+_process_recorder = None
+
+
+def _recorder_for_process(record_dir):
+    global _process_recorder
+    if _process_recorder is None:
+        _process_recorder = game_record.GameRecordWriter(
+            game_record.process_record_path(record_dir))
+        # Pool workers never return to main, so flush when they exit
+        multiprocessing.util.Finalize(_process_recorder, _process_recorder.close, exitpriority=10)
+    return _process_recorder
+
+
+def _play_mirrored_pair(args):
+    players, seed, instrument, profile, max_time_for_play, record_dir = args
+    pair_instrumentation = None
+    if instrument:
+        pair_instrumentation = instrumentation.Instrumentation()
+    recorder = None
+    if record_dir:
+        recorder = _recorder_for_process(record_dir)
+    # The discard cache's stats live in whichever process plays the pair,
+    # so hand back what this pair added to them
+    cache = kyle_ai.KyleBotV1.discard_cache
+    cache_stats_before = collections.Counter(cache.stats) if cache is not None else None
+    pair_scores = play_mirrored_pair(players, seed, pair_instrumentation, profile,
+            max_time_for_play, recorder)
+    cache_stats = None
+    if cache is not None:
+        cache_stats = cache.stats - cache_stats_before
+    return pair_scores, pair_instrumentation, cache_stats
+
+
+def worker_pool(workers):
+    """ A process pool for playing games, with any saved score table already mapped
+
+    The table is mapped before forking, so every worker shares the one
+    mapping rather than each loading its own.
+    """
+    cribbage.SCORE_TABLE.load_if_present()
+    return multiprocessing.Pool(workers)
+
+
+def run_mirrored_pairs(players, num_pairs, seed, workers=1, instrument=False, profile_every=0,
+        max_time_for_play=MAX_TIME_FOR_PLAY, record_dir=None):
+    """ Yield the scores of each mirrored pair, its instrumentation, and
+    what it added to the discard cache stats
+
+    Every pair is seeded from seed and its index alone, so the results do
+    not depend on the number of workers. When instrumenting, every
+    profile_every-th pair also runs the sampling profiler. With a
+    record_dir, every game is also recorded there, one file per process.
+    """
+    pair_args = [
+        (
+            players,
+            pair_seed(seed, pair_idx),
+            instrument,
+            bool(instrument and profile_every and pair_idx % profile_every == 0),
+            max_time_for_play,
+            record_dir,
+        )
+        for pair_idx in xrange(num_pairs)
+    ]
+    if workers <= 1:
+        try:
+            for args in pair_args:
+                yield _play_mirrored_pair(args)
+        finally:
+            if _process_recorder is not None:
+                _process_recorder.flush()
+        return
+
+    pool = worker_pool(workers)
+    try:
+        for pair_result in pool.imap(_play_mirrored_pair, pair_args):
+            yield pair_result
+        pool.close()
+    except:
+        # Including GeneratorExit, when the caller closes the generator
+        # before the last pair
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run some cribbage AIs.')
+    parser.add_argument(
+        '--players',
+        nargs=2,
+        default=['KyleBotV2', 'KyleBotV1'],
+        required=False,
+        help='The two bot classes, as module.Class or a class name from kyle_ai or test_ai',
+    )
     parser.add_argument(
         '--num_games',
+        default=None,
+        required=False,
+        type=int,
+        help='Number of games to run (default 1), or the most to run with --sprt (default %d)' % SPRT_MAX_GAMES,
+    )
+    parser.add_argument(
+        '--sprt',
+        action='store_true',
+        help='Stop as soon as a sequential test decides between --elo0 and --elo1',
+    )
+    parser.add_argument(
+        '--elo0',
+        default=sprt.DEFAULT_ELO0,
+        required=False,
+        type=float,
+        help='With --sprt, Elo advantage of player 1 under the null hypothesis',
+    )
+    parser.add_argument(
+        '--elo1',
+        default=sprt.DEFAULT_ELO1,
+        required=False,
+        type=float,
+        help='With --sprt, Elo advantage of player 1 under the alternative',
+    )
+    parser.add_argument(
+        '--alpha',
+        default=sprt.DEFAULT_ALPHA,
+        required=False,
+        type=float,
+        help='With --sprt, chance of accepting elo1 when elo0 holds',
+    )
+    parser.add_argument(
+        '--beta',
+        default=sprt.DEFAULT_BETA,
+        required=False,
+        type=float,
+        help='With --sprt, chance of accepting elo0 when elo1 holds',
+    )
+    parser.add_argument(
+        '--workers',
         default=1,
         required=False,
         type=int,
-        help='Number of games to run',
+        help='Number of processes to spread mirrored game pairs across',
+    )
+    parser.add_argument(
+        '--seed',
+        default=None,
+        required=False,
+        type=int,
+        help='Seed for reproducing a run, random if not given',
+    )
+    parser.add_argument(
+        '--discard_cache',
+        default=None,
+        required=False,
+        help='Directory of a persistent crib throw cache shared by workers',
+    )
+    parser.add_argument(
+        '--instrument',
+        action='store_true',
+        help='Report per-bot phase timings and scorer counters at the end',
+    )
+    parser.add_argument(
+        '--profile_every',
+        default=0,
+        required=False,
+        type=int,
+        help='With --instrument, run the sampling profiler every Nth pair',
+    )
+    parser.add_argument(
+        '--max_time_for_play',
+        default=MAX_TIME_FOR_PLAY,
+        required=False,
+        type=float,
+        help='Seconds a bot gets per decision; a slower crib throw forfeits',
+    )
+    parser.add_argument(
+        '--record_dir',
+        default=None,
+        required=False,
+        help='Directory to append a binary record of every game to',
+    )
+    parser.add_argument(
+        '--log_dir',
+        default=None,
+        required=False,
+        help='Directory for per-process logs of bot decisions, off if not given',
     )
     args = parser.parse_args()
+    if args.discard_cache:
+        kyle_ai.KyleBotV1.discard_cache = discard_cache.DiscardCache(args.discard_cache)
+    if args.log_dir:
+        bot_logging.enable(args.log_dir)
+    if args.record_dir and not os.path.isdir(args.record_dir):
+        os.makedirs(args.record_dir)
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+    print "Seed:", args.seed
+    if args.num_games is None:
+        args.num_games = SPRT_MAX_GAMES if args.sprt else 1
+
     game_scores = []
-    players = [
-        kyle_ai.KyleBotV2,
-        kyle_ai.KyleBotV1,
-    ]
-    for i in xrange(args.num_games / 2):
-        random_state = random.getstate()
-        runner = GameRunner(*[player() for player in players])
-        game_scores.append(runner.run_game())
-        print i, game_scores[-1]
+    players = [bot.load_bot(name) for name in args.players]
+    sequential_test = None
+    if args.sprt:
+        sequential_test = sprt.SPRT(args.elo0, args.elo1, args.alpha, args.beta)
+    tournament_instrumentation = instrumentation.Instrumentation()
+    discard_cache_stats = collections.Counter()
+    pairs = run_mirrored_pairs(
+        players,
+        (args.num_games + 1) / 2,
+        args.seed,
+        args.workers,
+        instrument=args.instrument,
+        profile_every=args.profile_every,
+        max_time_for_play=args.max_time_for_play,
+        record_dir=args.record_dir,
+    )
+    try:
+        for i, (pair_scores, pair_instrumentation, pair_cache_stats) in enumerate(pairs):
+            for scores in pair_scores:
+                game_scores.append(scores)
+                print i, game_scores[-1]
+            if pair_instrumentation is not None:
+                tournament_instrumentation.merge(pair_instrumentation)
+            if pair_cache_stats is not None:
+                discard_cache_stats.update(pair_cache_stats)
+            if sequential_test is not None:
+                sequential_test.add_pair(sum(game_outcome(scores) for scores in pair_scores) / 2)
+                if sequential_test.status() is not None:
+                    break
+    finally:
+        # Terminates the pool, rather than leaving its workers playing the
+        # rest of the games once the test has decided
+        pairs.close()
 
-        random.setstate(random_state)
-        runner = GameRunner(*list(reversed([player() for player in players])))
-        game_scores.append(list(reversed(runner.run_game())))
-        print i, game_scores[-1]
+    if args.instrument:
+        print tournament_instrumentation.report()
 
+    if args.discard_cache:
+        print "Discard cache:", dict(discard_cache_stats)
 
-    num_player_one_wins = sum(score[0] > score[1] for score in game_scores)
-    print "Player 1:", num_player_one_wins
-    print "Player 2:", args.num_games - num_player_one_wins
+    outcomes = [game_outcome(scores) for scores in game_scores]
+    wins = [outcomes.count(1.0), outcomes.count(0.0)]
+    draws = outcomes.count(0.5)
+    for player_idx, name in enumerate(args.players):
+        print "Player %d (%s): %d wins, %d losses, %d draws, %d forfeits" % (
+            player_idx + 1,
+            name,
+            wins[player_idx],
+            wins[player_idx ^ 1],
+            draws,
+            sum(scores[player_idx] < 0 for scores in game_scores),
+        )
+
+    if sequential_test is not None:
+        print "SPRT: LLR %.3f, bounds (%.3f, %.3f), after %d games: %s" % (
+            sequential_test.llr(),
+            sequential_test.lower,
+            sequential_test.upper,
+            len(game_scores),
+            {
+                sprt.H0: 'accepted elo0 (%g)' % args.elo0,
+                sprt.H1: 'accepted elo1 (%g)' % args.elo1,
+            }.get(sequential_test.status(), 'undecided'),
+        )
 
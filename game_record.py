@@ -0,0 +1,261 @@
+""" Compact, append-only game records, written in batches and read lazily.
+
+A record file starts with MAGIC and holds length-prefixed game records.
+Cards are single bytes (their 0-51 index), so a whole game takes a few
+hundred bytes. Each round stores the deal, the crib throws, the pegging
+sequence and the points of every counted hand by category; sections a
+round never reached (the game ended first) are left out.
+"""
+
+import glob
+import os
+import struct
+
+import cribbage
+
+MAGIC = b'CRIBREC1'
+LENGTH = struct.Struct(b'<I')
+GAME_HEADER = struct.Struct(b'<QhhBB')
+ROUND_HEADER = struct.Struct(b'<BB')
+NO_SEED = (1 << 64) - 1
+
+CATEGORIES = ('pairs', 'fifteens', 'runs', 'flushes', 'nobs', 'heels')
+# Counted hands, in the order their sections are stored
+COUNTS = ('hand1', 'hand2', 'crib')
+
+HAS_THROWS = 1 << 0
+HAS_PEGGING = 1 << 1
+COUNT_FLAGS = dict((name, 1 << (2 + idx)) for idx, name in enumerate(COUNTS))
+
+GO = 0x3F
+PEG_PLAYER_BIT = 0x80
+
+DEFAULT_BATCH_SIZE = 64
+# game.GAME_OVER_POINTS, which can't be imported here as game imports this
+GAME_OVER_POINTS = 121
+
+
+class RoundRecord(object):
+
+    def __init__(self, player_one_has_crib, hands, starter_card):
+        self.player_one_has_crib = player_one_has_crib
+        self.hands = hands
+        self.starter_card = starter_card
+        # Per player, the two cards thrown to the crib
+        self.throws = None
+        # (player index, card or None for a go), in order
+        self.pegging = None
+        self.pegging_points = None
+        # COUNTS name -> Scorer.score dict
+        self.counts = {}
+
+
+class GameRecord(object):
+    """ Everything that happened in one game, as GameRunner saw it
+    """
+
+    def __init__(self, seed=None, bot_names=('', '')):
+        self.seed = seed
+        self.bot_names = list(bot_names)
+        self.rounds = []
+        self.scores = [0, 0]
+        self.forfeits = [False, False]
+
+    def start_round(self, player_one_has_crib, hands, starter_card):
+        self.rounds.append(RoundRecord(player_one_has_crib, [list(hand) for hand in hands], starter_card))
+
+    def record_throws(self, throws):
+        self.rounds[-1].throws = [list(throw) for throw in throws]
+        self.rounds[-1].pegging = []
+        self.rounds[-1].pegging_points = [0, 0]
+
+    def record_peg(self, player_index, card, points):
+        self.rounds[-1].pegging.append((player_index, card))
+        self.rounds[-1].pegging_points[player_index] += points
+
+    def record_count(self, name, score_dict):
+        self.rounds[-1].counts[name] = score_dict
+
+    def finish(self, scores, forfeits):
+        self.scores = list(scores)
+        self.forfeits = list(forfeits)
+
+    def encode(self):
+        seed = self.seed if self.seed is not None and 0 <= self.seed < NO_SEED else NO_SEED
+        forfeit_bits = int(self.forfeits[0]) | (int(self.forfeits[1]) << 1)
+        parts = [GAME_HEADER.pack(seed, self.scores[0], self.scores[1], forfeit_bits, len(self.rounds))]
+        for name in self.bot_names:
+            encoded_name = name.encode('utf-8')[:255]
+            parts.append(chr(len(encoded_name)) + encoded_name)
+
+        for round_record in self.rounds:
+            flags = 0
+            if round_record.throws is not None:
+                flags |= HAS_THROWS
+            if round_record.pegging is not None:
+                flags |= HAS_PEGGING
+            for name in round_record.counts:
+                flags |= COUNT_FLAGS[name]
+            parts.append(ROUND_HEADER.pack(int(round_record.player_one_has_crib), flags))
+            parts.append(_card_bytes(round_record.hands[0] + round_record.hands[1] +
+                    [round_record.starter_card]))
+            if round_record.throws is not None:
+                parts.append(_card_bytes(round_record.throws[0] + round_record.throws[1]))
+            if round_record.pegging is not None:
+                events = [(player_index << 7) | (GO if card is None else card.index)
+                        for player_index, card in round_record.pegging]
+                parts.append(chr(len(events)) + b''.join(chr(event) for event in events))
+                parts.append(b''.join(chr(points) for points in round_record.pegging_points))
+            for name in COUNTS:
+                if name in round_record.counts:
+                    parts.append(b''.join(chr(round_record.counts[name][category])
+                            for category in CATEGORIES))
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, data):
+        seed, score1, score2, forfeit_bits, num_rounds = GAME_HEADER.unpack_from(data, 0)
+        offset = GAME_HEADER.size
+        record = cls(seed=None if seed == NO_SEED else seed)
+        record.scores = [score1, score2]
+        record.forfeits = [bool(forfeit_bits & 1), bool(forfeit_bits & 2)]
+        for idx in xrange(2):
+            name_length = ord(data[offset])
+            record.bot_names[idx] = data[offset + 1:offset + 1 + name_length].decode('utf-8')
+            offset += 1 + name_length
+
+        for _ in xrange(num_rounds):
+            player_one_has_crib, flags = ROUND_HEADER.unpack_from(data, offset)
+            offset += ROUND_HEADER.size
+            deal = _cards(data[offset:offset + 13])
+            offset += 13
+            record.start_round(bool(player_one_has_crib), [deal[0:6], deal[6:12]], deal[12])
+            round_record = record.rounds[-1]
+            if flags & HAS_THROWS:
+                throws = _cards(data[offset:offset + 4])
+                offset += 4
+                round_record.throws = [throws[0:2], throws[2:4]]
+            if flags & HAS_PEGGING:
+                num_events = ord(data[offset])
+                events = [ord(event) for event in data[offset + 1:offset + 1 + num_events]]
+                offset += 1 + num_events
+                round_record.pegging = [
+                    (event >> 7, None if event & GO == GO else cribbage.Card.from_index(event & GO))
+                    for event in events
+                ]
+                round_record.pegging_points = [ord(points) for points in data[offset:offset + 2]]
+                offset += 2
+            for name in COUNTS:
+                if flags & COUNT_FLAGS[name]:
+                    values = [ord(value) for value in data[offset:offset + len(CATEGORIES)]]
+                    offset += len(CATEGORIES)
+                    score_dict = dict(zip(CATEGORIES, values))
+                    score_dict['score'] = sum(values)
+                    round_record.counts[name] = score_dict
+        return record
+
+
+def _card_bytes(cards):
+    return b''.join(chr(card.index) for card in cards)
+
+
+def _cards(data):
+    return [cribbage.Card.from_index(ord(byte)) for byte in data]
+
+
+class GameRecordWriter(object):
+    """ Appends encoded games to a record file, batch_size games at a time
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.record_file = open(path, 'ab')
+        if self.record_file.tell() == 0:
+            self.record_file.write(MAGIC)
+
+    def write(self, record):
+        data = record.encode()
+        self.pending.append(LENGTH.pack(len(data)) + data)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.record_file.write(b''.join(self.pending))
+            self.pending = []
+        self.record_file.flush()
+
+    def close(self):
+        if self.record_file is not None:
+            self.flush()
+            self.record_file.close()
+            self.record_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_games(*paths):
+    """ Lazily yield the GameRecords in each record file, in order
+
+    Paths may be glob patterns, such as a directory of per-worker files.
+    """
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, 'rb') as record_file:
+                if record_file.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("Not a game record file: %s" % path)
+                while True:
+                    length_bytes = record_file.read(LENGTH.size)
+                    if len(length_bytes) < LENGTH.size:
+                        break
+                    data = record_file.read(LENGTH.unpack(length_bytes)[0])
+                    yield GameRecord.decode(data)
+
+
+def replay(record):
+    """ Rescore a recorded game from its deals and plays
+
+    Returns the final scores, which match the recorded ones for a game
+    that was neither forfeited nor ended by a time limit.
+    """
+    scores = [0, 0]
+    for round_record in record.rounds:
+        if round_record.pegging is not None:
+            pegging = cribbage.PeggingState()
+            passes = set()
+            last_player = None
+            for player_index, card in round_record.pegging:
+                if card is None:
+                    passes.add(player_index)
+                    if len(passes) == 2:
+                        scores[player_index] += pegging.last_card_points()
+                        pegging.reset()
+                        passes = set()
+                    continue
+                scores[player_index] += pegging.play(card)
+                last_player = player_index
+                if pegging.count == cribbage.PEGGING_LIMIT:
+                    pegging.reset()
+                    passes = set()
+            # As in GameRunner, the last card scores only if the game isn't
+            # already over
+            num_cards = len(round_record.pegging) - sum(1 for _, card in round_record.pegging if card is None)
+            if num_cards == 8 and max(scores) < GAME_OVER_POINTS:
+                scores[last_player] += pegging.last_card_points()
+        dealer = 0 if round_record.player_one_has_crib else 1
+        for name, player_index in zip(COUNTS, (0, 1, dealer)):
+            if name in round_record.counts:
+                scores[player_index] += round_record.counts[name]['score']
+    return scores
+
+
+def process_record_path(directory):
+    """ Per-process file in directory, so parallel writers never interleave
+    """
+    return os.path.join(directory, 'games-%d.rec' % os.getpid())
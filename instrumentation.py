@@ -0,0 +1,113 @@
+""" Timers, counters and a sampling profiler for games under load.
+
+A GameRunner given an Instrumentation records how long each bot spends in
+each phase of a round (throw, peg, count) and, while its bots and counts
+run, has cribbage.Scorer count its calls and cache hits into the same
+object. Counting is switched on only around the runner's own calls, so
+games interleaved in one process, as match_server runs them, each count
+just their own work.
+Instrumentation objects from many games or worker processes are merged
+with merge and summarized with report at the end of a tournament.
+"""
+
+import collections
+import contextlib
+import os
+import signal
+
+import cribbage
+
+THROW = 'throw'
+PEG = 'peg'
+COUNT = 'count'
+
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+
+class SamplingProfiler(object):
+    """ Counts the innermost function running every interval of CPU time
+
+    Uses SIGPROF, so it can only be started from the main thread.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._previous_handler = None
+
+    def _sample(self, signum, frame):
+        if frame is not None:
+            code = frame.f_code
+            self.samples['%s:%s' % (os.path.basename(code.co_filename), code.co_name)] += 1
+
+    def start(self):
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        self._previous_handler = None
+
+
+class Instrumentation(object):
+    """ Per-bot, per-phase timings plus engine counters
+    """
+
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        # (bot name, phase) -> [calls, total seconds, max seconds]
+        self.timers = {}
+        self.counters = collections.Counter()
+        self.profiler = SamplingProfiler(sample_interval)
+
+    def record(self, bot_name, phase, elapsed):
+        timer = self.timers.get((bot_name, phase))
+        if timer is None:
+            timer = self.timers[(bot_name, phase)] = [0, 0.0, 0.0]
+        timer[0] += 1
+        timer[1] += elapsed
+        timer[2] = max(timer[2], elapsed)
+
+    @contextlib.contextmanager
+    def counting(self):
+        """ Route cribbage.Scorer's counters into this object for a block
+        """
+        previous = cribbage.SCORER_STATS
+        cribbage.SCORER_STATS = self.counters
+        try:
+            yield
+        finally:
+            cribbage.SCORER_STATS = previous
+
+    def merge(self, other):
+        for key, (calls, total, longest) in other.timers.items():
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += calls
+            timer[1] += total
+            timer[2] = max(timer[2], longest)
+        self.counters.update(other.counters)
+        self.profiler.samples.update(other.profiler.samples)
+        return self
+
+    @property
+    def stats(self):
+        return dict(
+            timers=dict(
+                ('%s.%s' % key, dict(calls=calls, total=total, mean=total / calls, max=longest))
+                for key, (calls, total, longest) in self.timers.items()
+            ),
+            counters=dict(self.counters),
+            profile=dict(self.profiler.samples),
+        )
+
+    def report(self, num_profile_lines=20):
+        lines = ['%-32s %10s %12s %12s %12s' % ('timer', 'calls', 'total', 'mean', 'max')]
+        for (bot_name, phase), (calls, total, longest) in sorted(self.timers.items()):
+            lines.append('%-32s %10d %12.4f %12.6f %12.6f' % (
+                '%s.%s' % (bot_name, phase), calls, total, total / calls, longest))
+        for name, count in sorted(self.counters.items()):
+            lines.append('%-32s %10d' % (name, count))
+        num_samples = sum(self.profiler.samples.values())
+        for location, count in self.profiler.samples.most_common(num_profile_lines):
+            lines.append('%-50s %6.2f%%' % (location, 100.0 * count / num_samples))
+        return '\n'.join(lines)
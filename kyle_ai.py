@@ -1,16 +1,27 @@
 import itertools
 import logging
 import heapq
-import random
-logging.basicConfig(filename='kyle_ai.log', filemode='w', level=logging.INFO)
+import math
+import os
+import time
 
+import bot_logging
+import crib
 import cribbage
-from test_ai import Bot
+import pegging_search
+import strategy_table
+import winprob
+from bot import Bot
+
+logger = logging.getLogger(bot_logging.LOGGER_NAME + '.kyle_ai')
 
 class KyleBotV1(Bot):
 
     seen_cards = set()
 
+    # Optional discard_cache.DiscardCache, keyed per bot class
+    discard_cache = None
+
     def _score_from_hand(self, hand, card_set, has_crib):
         return cribbage.Scorer.score(hand, has_crib=has_crib)['score']
 
@@ -20,28 +31,61 @@ class KyleBotV1(Bot):
     def _eval_scores(self, hand_score, crib_score):
         return hand_score + crib_score
 
+    def _batch_scoring(self):
+        """ Whether hands can be scored by Scorer.score_many, which gives the
+        same scores as _score_from_hand only if it hasn't been overridden
+        """
+        return (type(self)._score_from_hand.__func__ is KyleBotV1._score_from_hand.__func__ and
+                cribbage.load_numpy() is not None)
+
+    def _score_from_hands(self, possible_hands, other_cards, has_crib):
+        """ Total hand score over every starter card, per possible hand
+
+        Batched with numpy unless a subclass scores hands its own way.
+        """
+        if self._batch_scoring():
+            scores = cribbage.Scorer.score_many(possible_hands, other_cards, has_crib=has_crib)
+            return scores['score'].sum(axis=1).tolist()
+
+        hand_scores = []
+        for possible_hand in possible_hands:
+            hand = cribbage.Hand(list(possible_hand))
+            hand_score = 0
+            for starter_card in other_cards:
+                hand.add_starter_card(starter_card)
+                hand_score += self._score_from_hand(hand, other_cards, has_crib)
+            hand_scores.append(hand_score)
+        return hand_scores
+
     def notify_new_hand(self, hand):
         super(KyleBotV1, self).notify_new_hand(hand)
         self.seen_cards = set()
 
     def _get_best_hand(self, has_crib, scores):
         assert self.hand
-        card_set = set(cribbage.Deck.all_cards())
-        hand_set = set(self.hand.all_cards)
-        other_cards = card_set - hand_set
+        hand_mask = cribbage.cards_to_mask(self.hand.all_cards)
+        other_mask = cribbage.FULL_DECK_MASK & ~hand_mask
+        other_cards = cribbage.mask_to_cards(other_mask)
+
+        possible_hands = list(itertools.combinations(self.hand.all_cards, 4))
+        hand_scores = self._score_from_hands(possible_hands, other_cards, has_crib)
+
+        # Most promising hands first, so running out of time still leaves a
+        # sensible best so far
+        order = sorted(xrange(len(possible_hands)), key=hand_scores.__getitem__, reverse=True)
 
         best_hand = None
         best_score = -1000
-        for possible_hand in itertools.combinations(hand_set, 4):
-            hand = cribbage.Hand(list(possible_hand))
-            cards_to_throw = list(hand_set - set(possible_hand))
+        for hand_idx in order:
+            if best_hand is not None and self.out_of_time():
+                break
+            possible_hand = possible_hands[hand_idx]
+            hand_score = hand_scores[hand_idx]
+            cards_to_throw = cribbage.mask_to_cards(hand_mask & ~cribbage.cards_to_mask(possible_hand))
             total_score = 0
-            hand_score = 0
             crib_score = 0
             for starter_card in other_cards:
-                hand.add_starter_card(starter_card)
-                hand_score += self._score_from_hand(hand, other_cards, has_crib)
-                crib_score += self._score_from_crib(cards_to_throw, starter_card, other_cards - set([starter_card]), has_crib)
+                crib_score += self._score_from_crib(cards_to_throw, starter_card, cribbage.mask_to_cards(other_mask & ~starter_card.mask), has_crib)
 
             total_score = self._eval_scores(hand_score, crib_score)
             if total_score > best_score:
@@ -50,19 +94,36 @@ class KyleBotV1(Bot):
         normalized_score = float(best_score) / float(len(other_cards))
         return best_hand, normalized_score
 
+    def _get_cached_best_hand(self, has_crib, scores):
+        if self.discard_cache is None:
+            return self._get_best_hand(has_crib, scores)
+
+        namespace = type(self).__name__
+        cached = self.discard_cache.lookup(namespace, self.hand.cards, has_crib)
+        if cached is not None:
+            return cached
+        best_hand, best_score = self._get_best_hand(has_crib, scores)
+        # A search cut short by the deadline only has its best so far, which
+        # must not become this deal's answer for every later game
+        if not self.out_of_time():
+            self.discard_cache.store(namespace, self.hand.cards, has_crib, best_hand, best_score)
+        return best_hand, best_score
+
     def ask_for_crib_throw(self, has_crib, scores=None):
         assert self.hand
-        best_hand, best_score = self._get_best_hand(has_crib, scores)
-        card_set = set(cribbage.Deck.all_cards())
+        best_hand, best_score = self._get_cached_best_hand(has_crib, scores)
 
-        cards_to_throw = list(set(self.hand.cards) - set(best_hand))
+        cards_to_throw = cribbage.mask_to_cards(self.hand.mask & ~cribbage.cards_to_mask(best_hand))
         assert len(cards_to_throw) == 2
+        self.seen_cards.update(cards_to_throw)
 
-        logging.info("\nPLAYER %s", type(self))
-        logging.info("Full hand: %s, %s %s", self.hand.prompt, has_crib, scores)
-        logging.info("Keeping: %s", ' '.join([card.colored_print for card in best_hand]))
-        logging.info("Throwing: %s", ' '.join([card.colored_print for card in cards_to_throw]))
-        logging.info("Expected points: %s", best_score)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("\nPLAYER %s", type(self))
+            logger.info("Full hand: %s, %s %s", bot_logging.LazyCards(self.hand.all_cards),
+                    has_crib, scores and list(scores))
+            logger.info("Keeping: %s", bot_logging.LazyCards(best_hand))
+            logger.info("Throwing: %s", bot_logging.LazyCards(cards_to_throw))
+            logger.info("Expected points: %s", best_score)
 
         return self.hand.throw_cards(cards_to_throw[0], cards_to_throw[1])
 
@@ -76,63 +137,121 @@ class KyleBotV1(Bot):
         return sorted(cards_can_play)[-1]
 
 class KyleBotV2(KyleBotV1):
-    NUM_SAMPLES = 100
-    def _score_from_crib(self, cards_to_throw, starter_card, other_cards, has_crib):
-        crib_score = 0
-        num_other_cribs = 0
-        for sample_num in xrange(self.NUM_SAMPLES):
-            other_cribs = random.sample(other_cards, 2)
-            new_hand = cribbage.Hand(list(cards_to_throw) + list(other_cribs))
-            new_hand.add_starter_card(starter_card)
-            crib_score += cribbage.Scorer.score(new_hand, is_crib=True)['score']
-            num_other_cribs += 1
-        expected_crib_score = float(crib_score) / float(num_other_cribs)
-        if not has_crib:
-            return -1 * expected_crib_score
-        return expected_crib_score
+    """ Estimates the crib by sampling starter and completion cards.
+
+    Hand scores are exact. Crib samples are drawn in batches and shared by
+    all 15 candidate discards (common random numbers), so only the gaps
+    between candidates need to be resolved. Sampling stops once the leader
+    is separated from every other candidate, every gap is known to within
+    MAX_ERROR points, or the sample or time budget runs out.
+    """
+    BATCH_SIZE = 50
+    MIN_SAMPLES = 100
+    MAX_SAMPLES = 4600
+    MAX_ERROR = 0.1
+    CONFIDENCE_Z = 2.0
+    TIME_BUDGET = 1.0
+
+    last_num_samples = 0
+
+    def _sample_crib_scores(self, throw_indexes, other_cards, crib_samples):
+        for _ in xrange(self.BATCH_SIZE):
+            starter_card, first_card, second_card = self.rng.sample(other_cards, 3)
+            completion = [first_card.index, second_card.index]
+            for samples, thrown in zip(crib_samples, throw_indexes):
+                entry = cribbage.SCORE_TABLE.lookup(thrown + completion, starter_card.index)
+                samples.append(cribbage.ScoreTable.points(entry, starter_card.rank, is_crib=True))
+
+    def _pick_leader(self, hand_means, crib_samples, crib_sign):
+        """ Index of the best candidate so far, and whether it is decided
+        """
+        num_samples = len(crib_samples[0])
+        means = [
+            hand_mean + crib_sign * float(sum(samples)) / num_samples
+            for hand_mean, samples in zip(hand_means, crib_samples)
+        ]
+        leader = max(xrange(len(means)), key=means.__getitem__)
+        if num_samples < self.MIN_SAMPLES:
+            return leader, means, False
+
+        separated = True
+        max_half_width = 0.0
+        for idx, samples in enumerate(crib_samples):
+            if idx == leader:
+                continue
+            diffs = [a - b for a, b in zip(crib_samples[leader], samples)]
+            diff_mean = float(sum(diffs)) / num_samples
+            variance = sum((diff - diff_mean) ** 2 for diff in diffs) / (num_samples - 1)
+            half_width = self.CONFIDENCE_Z * math.sqrt(variance / num_samples)
+            max_half_width = max(max_half_width, half_width)
+            if means[leader] - means[idx] <= half_width:
+                separated = False
+        return leader, means, separated or max_half_width <= self.MAX_ERROR
+
+    def _get_best_hand(self, has_crib, scores):
+        assert self.hand
+        start_time = time.time()
+        hand_mask = cribbage.cards_to_mask(self.hand.all_cards)
+        other_cards = cribbage.mask_to_cards(cribbage.FULL_DECK_MASK & ~hand_mask)
+
+        possible_hands = list(itertools.combinations(self.hand.all_cards, 4))
+        hand_means = [
+            float(hand_score) / len(other_cards)
+            for hand_score in self._score_from_hands(possible_hands, other_cards, has_crib)
+        ]
+        throw_indexes = [
+            cribbage.mask_to_indexes(hand_mask & ~cribbage.cards_to_mask(possible_hand))
+            for possible_hand in possible_hands
+        ]
+        crib_sign = 1 if has_crib else -1
+
+        crib_samples = [[] for _ in possible_hands]
+        while True:
+            self._sample_crib_scores(throw_indexes, other_cards, crib_samples)
+            leader, means, decided = self._pick_leader(hand_means, crib_samples, crib_sign)
+            if (decided or len(crib_samples[0]) >= self.MAX_SAMPLES or
+                    time.time() - start_time >= self.TIME_BUDGET or self.out_of_time()):
+                break
+
+        self.last_num_samples = len(crib_samples[0])
+        return possible_hands[leader], means[leader]
 
 class KyleBotV3(KyleBotV1):
 
     def _score_from_crib(self, cards_to_throw, starter_card, other_cards, has_crib):
-        crib_score = 0
-        num_other_cribs = 0
-        for other_cribs in itertools.combinations(other_cards, 2):
-            new_hand = cribbage.Hand(list(cards_to_throw) + list(other_cribs))
-            new_hand.add_starter_card(starter_card)
-            crib_score += cribbage.Scorer.score(new_hand, is_crib=True)['score']
-            num_other_cribs += 1
-        expected_crib_score = float(crib_score) / float(num_other_cribs)
+        expected_crib_score = crib.expected_crib_score_for_starter(
+            cards_to_throw,
+            starter_card,
+            other_cards,
+        )
         if not has_crib:
             return -1 * expected_crib_score
         return expected_crib_score
 
     def _get_best_hand(self, has_crib, scores):
         assert self.hand
-        card_set = set(cribbage.Deck.all_cards())
-        hand_set = set(self.hand.all_cards)
-        other_cards = card_set - hand_set
+        hand_mask = cribbage.cards_to_mask(self.hand.all_cards)
+        other_mask = cribbage.FULL_DECK_MASK & ~hand_mask
+        other_cards = cribbage.mask_to_cards(other_mask)
 
-        hands_and_scores = []
-        for possible_hand in itertools.combinations(hand_set, 4):
-            hand = cribbage.Hand(list(possible_hand))
-            total_score = 0
-            hand_score = 0
-            crib_score = 0
-            for starter_card in other_cards:
-                hand.add_starter_card(starter_card)
-                hand_score += self._score_from_hand(hand, other_cards, has_crib)
+        possible_hands = list(itertools.combinations(self.hand.all_cards, 4))
+        hand_scores = self._score_from_hands(possible_hands, other_cards, has_crib)
 
+        hands_and_scores = []
+        for possible_hand, hand_score in zip(possible_hands, hand_scores):
             heapq.heappush(hands_and_scores, (-1 * hand_score, possible_hand))
 
         best_hand = None
         best_score = -1000
         for _ in xrange(3):
+            if best_hand is not None and self.out_of_time():
+                break
             negative_hand_score, possible_hand = heapq.heappop(hands_and_scores)
             crib_score = 0
             hand = cribbage.Hand(list(possible_hand))
-            cards_to_throw = list(hand_set - set(possible_hand))
+            cards_to_throw = cribbage.mask_to_cards(hand_mask & ~cribbage.cards_to_mask(possible_hand))
             for starter_card in other_cards:
-                crib_score += self._score_from_crib(cards_to_throw, starter_card, other_cards - set([starter_card]), has_crib)
+                crib_score += self._score_from_crib(cards_to_throw, starter_card, cribbage.mask_to_cards(other_mask & ~starter_card.mask), has_crib)
             total_score = self._eval_scores(-1 * negative_hand_score, crib_score)
 
             if total_score > best_score:
@@ -141,6 +260,190 @@ class KyleBotV3(KyleBotV1):
         normalized_score = float(best_score) / float(len(other_cards))
         return best_hand, normalized_score
 
+class KyleBotV4(KyleBotV3):
+    """ KyleBotV3's crib throws, with pegging chosen by expectimax search.
+    """
+    MAX_PEGGING_NODES = pegging_search.DEFAULT_MAX_NODES
+    PEGGING_TIME_BUDGET = pegging_search.DEFAULT_TIME_BUDGET
+
+    def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
+        search = pegging_search.PeggingSearch(self.MAX_PEGGING_NODES, self.PEGGING_TIME_BUDGET)
+        known_cards = set(self.seen_cards)
+        if self.hand.starter_card is not None:
+            known_cards.add(self.hand.starter_card)
+        return search.choose(
+            self.hand.cards,
+            cards_in_pegging_round,
+            all_cards_pegged,
+            known_cards=known_cards,
+            deadline=self.deadline,
+        )
+
+class KyleBotV5(KyleBotV4):
+    """ KyleBotV4, with crib throws read from the prebuilt strategy table.
+
+    The table weighs all 15 ways to keep 4 cards exactly. Deals it does not
+    have yet, or a missing table, fall back to KyleBotV3's search.
+    """
+    # strategy_table.StrategyTable, opened from its default path on first use
+    throw_table = None
+
+    @classmethod
+    def _throw_table(cls):
+        if KyleBotV5.throw_table is None and os.path.exists(strategy_table.DEFAULT_PATH):
+            KyleBotV5.throw_table = strategy_table.StrategyTable().open()
+        return KyleBotV5.throw_table
+
+    def _get_best_hand(self, has_crib, scores):
+        throw_table = self._throw_table()
+        if throw_table is not None:
+            looked_up = throw_table.lookup(self.hand.cards, has_crib)
+            if looked_up is not None:
+                return looked_up
+        return super(KyleBotV5, self)._get_best_hand(has_crib, scores)
+
+class KyleBotV6(KyleBotV4):
+    """ KyleBotV4, playing to win rather than for points near the end.
+
+    Once either score reaches ENDGAME_SCORE, and with a win table built by
+    winprob, crib throws keep the hand with the best chance of winning
+    from the counts each starter gives it, and pegging plays a card that
+    wins outright, or steers clear of one the opponent could win with.
+    """
+    # Below this, no round is likely to end the game, and win chance goes
+    # with expected points
+    ENDGAME_SCORE = 80
+    NUM_CANDIDATES = 6
+
+    has_crib = None
+
+    def _hand_scores_by_starter(self, possible_hands, other_cards, has_crib):
+        """ Hand score with each starter card, per possible hand
+        """
+        if self._batch_scoring():
+            scores = cribbage.Scorer.score_many(possible_hands, other_cards, has_crib=has_crib)
+            return scores['score'].tolist()
+
+        hand_scores = []
+        for possible_hand in possible_hands:
+            hand = cribbage.Hand(list(possible_hand))
+            starter_scores = []
+            for starter_card in other_cards:
+                hand.add_starter_card(starter_card)
+                starter_scores.append(self._score_from_hand(hand, other_cards, has_crib))
+            hand_scores.append(starter_scores)
+        return hand_scores
+
+    def _get_winning_hand(self, win_table, has_crib, scores):
+        """ The hand to keep with the best chance of winning, and that chance
+        """
+        hand_mask = cribbage.cards_to_mask(self.hand.all_cards)
+        other_mask = cribbage.FULL_DECK_MASK & ~hand_mask
+        other_cards = cribbage.mask_to_cards(other_mask)
+
+        possible_hands = list(itertools.combinations(self.hand.all_cards, 4))
+        hand_scores = self._hand_scores_by_starter(possible_hands, other_cards, has_crib)
+        order = sorted(xrange(len(possible_hands)), key=lambda hand_idx: sum(hand_scores[hand_idx]),
+                reverse=True)
+
+        best_hand = None
+        best_chance = -1.0
+        for hand_idx in order[:self.NUM_CANDIDATES]:
+            if best_hand is not None and self.out_of_time():
+                break
+            cards_to_throw = cribbage.mask_to_cards(hand_mask & ~cribbage.cards_to_mask(possible_hands[hand_idx]))
+            crib_scores = [
+                crib.expected_crib_score_for_starter(
+                    cards_to_throw, starter_card, cribbage.mask_to_cards(other_mask & ~starter_card.mask))
+                for starter_card in other_cards
+            ]
+            if has_crib:
+                counts = [hand_score + crib_score
+                        for hand_score, crib_score in zip(hand_scores[hand_idx], crib_scores)]
+                crib_shift = 0
+            else:
+                counts = hand_scores[hand_idx]
+                crib_shift = int(round(sum(crib_scores) / len(crib_scores) - win_table.mean_crib))
+            by_count = win_table.by_count(scores[0], scores[1], has_crib, crib_shift)
+
+            chance = 0.0
+            for count in counts:
+                # Expected crib scores fall between counts
+                low = min(int(count), winprob.MAX_POINTS - 2)
+                fraction = count - low
+                chance += (1 - fraction) * by_count[low] + fraction * by_count[low + 1]
+            chance /= len(counts)
+            if chance > best_chance:
+                best_chance = chance
+                best_hand = possible_hands[hand_idx]
+        return best_hand, best_chance
+
+    def _get_cached_best_hand(self, has_crib, scores):
+        # The cache doesn't know the score, so only points-based throws use it
+        win_table = winprob.default_table()
+        if win_table is None or scores is None or max(scores) < self.ENDGAME_SCORE:
+            return super(KyleBotV6, self)._get_cached_best_hand(has_crib, scores)
+        return self._get_winning_hand(win_table, has_crib, scores)
+
+    def ask_for_crib_throw(self, has_crib, scores=None):
+        self.has_crib = has_crib
+        return super(KyleBotV6, self).ask_for_crib_throw(has_crib, scores)
+
+    def _peg_outcomes(self, card, cards_in_pegging_round, all_cards_pegged):
+        """ My points for playing card, and the chance the opponent replies
+        with a card that wins the game
+        """
+        round_state = cribbage.pegging_round_state(cards_in_pegging_round)
+        points = cribbage.pegging_points(round_state, card.rank)
+        round_state = cribbage.pegging_state_after(round_state, card.rank)
+        if round_state[0] == cribbage.PEGGING_LIMIT:
+            round_state = cribbage.PEGGING_ROUND_START
+        count = round_state[0]
+
+        pegged = set(all_cards_pegged) | set([card])
+        opp_left = pegging_search.HAND_SIZE - len([pegged_card for pegged_card in pegged
+                if pegged_card not in self.hand.cards])
+        seen = pegged | set(self.hand.cards) | self.seen_cards
+        if self.hand.starter_card is not None:
+            seen.add(self.hand.starter_card)
+        unseen = [other for other in cribbage.Deck.all_cards() if other not in seen]
+        opp_needs = winprob.NUM_SCORES - self.scores[1]
+        winning = len([other for other in unseen
+                if count + cribbage.VALUES[other.rank] <= cribbage.PEGGING_LIMIT and
+                cribbage.pegging_points(round_state, other.rank) >= opp_needs])
+        holdings = cribbage.binomial(len(unseen), opp_left)
+        if not winning or not holdings:
+            return points, 0.0
+        return points, 1 - float(cribbage.binomial(len(unseen) - winning, opp_left)) / holdings
+
+    def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
+        searched = super(KyleBotV6, self).ask_for_next_peg_card(cards_in_pegging_round, all_cards_pegged)
+        win_table = winprob.default_table()
+        if searched is None or win_table is None or self.scores is None or self.has_crib is None:
+            return searched
+
+        my_score, opp_score = self.scores
+        count = cribbage.sum_cards_for_pegging(cards_in_pegging_round)
+        legal_cards = [card for card in self.hand.cards if card not in all_cards_pegged and
+                count + cribbage.VALUES[card.rank] <= cribbage.PEGGING_LIMIT]
+        outcomes = dict(
+            (card, self._peg_outcomes(card, cards_in_pegging_round, all_cards_pegged))
+            for card in legal_cards
+        )
+        winners = [card for card in legal_cards if my_score + outcomes[card][0] >= winprob.NUM_SCORES]
+        if winners:
+            return searched if searched in winners else winners[0]
+
+        # Only overrule the search to cut the risk of losing on the next card
+        safest = min(loss_chance for _, loss_chance in outcomes.values())
+        if outcomes[searched][1] <= safest:
+            return searched
+
+        def win_chance(card):
+            points, loss_chance = outcomes[card]
+            return (1 - loss_chance) * win_table.after_pegging(my_score + points, opp_score, self.has_crib)
+        return max(legal_cards, key=win_chance)
+
 if __name__ == '__main__':
     me = KyleBotV1()
     me.ask_for_crib_throw(True)
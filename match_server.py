@@ -0,0 +1,465 @@
+""" Hosts many games at once, between local bots and remote clients.
+
+One event loop (asyncore) serves every connection, and each game is a
+GameRunner whose game_plays generator is resumed whenever the bot it is
+waiting on answers, so a slow client only holds up its own game. A
+remote player's time limit is a timer in the loop: when it runs out the
+player forfeits then and there, rather than after a late answer arrives.
+Local bots are called inline, so each of their decisions briefly holds
+up the loop.
+
+Clients speak JSON, one object per line. Cards are their 0-51 index,
+(rank - 1) * 4 plus the suit's position in clubs, diamonds, hearts,
+spades.
+
+    client: {"type": "join", "opponent": "KyleBotV1"}
+            (opponent null waits for another client to join, and no
+            opponent plays the server's default opponent, if it has one)
+    server: {"type": "welcome", "seat": 0, "opponent": "KyleBotV1"}
+    server: {"type": "new_hand", "cards": [3, 17, 22, 30, 41, 50]}
+    server: {"type": "throw", "has_crib": true, "scores": [0, 0], "time_limit": 15}
+    client: {"type": "throw", "cards": [3, 50]}
+    server: {"type": "starter", "card": 12}
+    server: {"type": "peg", "round": [40], "pegged": [40], "time_limit": 15}
+    client: {"type": "peg", "card": 22}         (null for a go)
+    server: {"type": "game_over", "scores": [121, 97], "forfeits": [false, false]}
+
+Scores are always sent with the client's own first. Python 2 has no
+asyncio, so asyncore/asynchat and generators stand in for it here. The
+loop polls with poll() rather than select(), which cannot watch file
+descriptors past FD_SETSIZE (usually 1024) and so would cap the server
+well short of thousands of matches.
+"""
+
+import argparse
+import asynchat
+import asyncore
+import heapq
+import itertools
+import json
+import random
+import socket
+import time
+import traceback
+
+import bot
+import cribbage
+import game
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7121
+# Longest a single request line may be before the client is dropped
+MAX_LINE_LENGTH = 4096
+
+
+def _card_indexes(cards):
+    return [card.index for card in cards]
+
+
+def _card(index):
+    if not isinstance(index, int) or not 0 <= index < 52:
+        raise ValueError("Not a card index: %r" % (index,))
+    return cribbage.Card.from_index(index)
+
+
+class RemoteBot(bot.Bot):
+    """ Stands in for a client, turning plays into messages and back
+
+    Tracks the client's hand on the server, so the game is refereed on
+    what the server dealt rather than on anything the client claims.
+    """
+
+    def __init__(self, connection):
+        super(RemoteBot, self).__init__()
+        self.connection = connection
+
+    def message(self, play, max_time_for_play):
+        """ The message for play, and whether it needs an answer
+        """
+        if play.method == 'notify_new_hand':
+            self.notify_new_hand(play.args[0])
+            return dict(type='new_hand', cards=_card_indexes(self.hand.cards)), False
+        elif play.method == 'notify_starter_card':
+            self.notify_starter_card(play.args[0])
+            return dict(type='starter', card=play.args[0].index), False
+        elif play.method == 'ask_for_crib_throw':
+            has_crib, scores = play.args
+            return dict(type='throw', has_crib=has_crib, scores=list(scores),
+                    time_limit=max_time_for_play), True
+        elif play.method == 'ask_for_next_peg_card':
+            cards_in_pegging_round, all_cards_pegged = play.args
+            return dict(type='peg', round=_card_indexes(cards_in_pegging_round),
+                    pegged=_card_indexes(all_cards_pegged), time_limit=max_time_for_play), True
+        raise ValueError("Unknown play: %s" % play.method)
+
+    def answer(self, play, message):
+        """ What the bot's method would have returned, given the client's reply
+
+        Raises ValueError for a reply that is not a legal answer.
+        """
+        if play.method == 'ask_for_crib_throw':
+            if message.get('type') != 'throw':
+                raise ValueError("Expected a throw")
+            cards = [_card(index) for index in message.get('cards') or []]
+            if len(set(cards)) != 2 or not set(cards).issubset(self.hand.cards):
+                raise ValueError("Must throw two cards from the hand")
+            return self.hand.throw_cards(*cards)
+        elif play.method == 'ask_for_next_peg_card':
+            if message.get('type') != 'peg':
+                raise ValueError("Expected a peg")
+            if message.get('card') is None:
+                return None
+            card = _card(message['card'])
+            cards_in_pegging_round, all_cards_pegged = play.args
+            if card not in self.hand.cards or card in all_cards_pegged:
+                raise ValueError("Must peg an unplayed card from the hand")
+            if (cribbage.sum_cards_for_pegging(cards_in_pegging_round) +
+                    cribbage.VALUES[card.rank] > cribbage.PEGGING_LIMIT):
+                raise ValueError("Peg would go over %d" % cribbage.PEGGING_LIMIT)
+            return card
+        raise ValueError("Unknown play: %s" % play.method)
+
+
+class Match(object):
+    """ One game, resumed each time the bot it waits on answers
+    """
+
+    def __init__(self, server, bots, seed):
+        self.server = server
+        self.bots = bots
+        self.runner = game.GameRunner(bots[0], bots[1], seed=seed,
+                max_time_for_play=server.max_time_for_play)
+        self.plays = self.runner.game_plays()
+        # The Play a remote bot owes an answer to, and its timer
+        self.waiting = None
+        self.timer = None
+        self.finished = False
+
+    def start(self):
+        self.advance(None)
+
+    def advance(self, answer):
+        """ Run the game until it needs a remote answer or is over
+        """
+        while True:
+            try:
+                play = self.plays.send(answer)
+            except StopIteration:
+                self.finish()
+                return
+            player = self.bots[play.player_index]
+            if not isinstance(player, RemoteBot):
+                try:
+                    answer = self.runner.run_play(play)
+                except Exception as e:
+                    # A failing local bot forfeits only this match
+                    self.local_failure(play.player_index, e)
+                    answer = None
+                continue
+            try:
+                message, needs_answer = player.message(play, self.server.max_time_for_play)
+            except ValueError:
+                self.runner.forfeits[play.player_index] = True
+                answer = None
+                continue
+            player.connection.send_message(message)
+            if not needs_answer:
+                answer = None
+                continue
+            self.waiting = play
+            self.timer = self.server.call_later(self.server.max_time_for_play, self.time_out, play)
+            return
+
+    def receive(self, connection, message):
+        play = self.waiting
+        if play is None or self.bots[play.player_index].connection is not connection:
+            # Late, or not this player's turn
+            return
+        self.waiting = None
+        self.server.cancel(self.timer)
+        try:
+            answer = self.bots[play.player_index].answer(play, message)
+        except (TypeError, ValueError) as e:
+            connection.send_message(dict(type='error', message=str(e)))
+            self.runner.forfeits[play.player_index] = True
+            answer = None
+        self.advance(answer)
+
+    def local_failure(self, player_index, error):
+        """ A local bot raised, forfeiting the game
+        """
+        traceback.print_exc()
+        self.runner.forfeits[player_index] = True
+        for player in self.bots:
+            if isinstance(player, RemoteBot):
+                player.connection.send_message(dict(
+                    type='error', message="Opponent failed: %s" % (error,)))
+
+    def time_out(self, play):
+        if self.waiting is play:
+            self.waiting = None
+            self.runner.forfeits[play.player_index] = True
+            self.advance(None)
+
+    def abandon(self, connection):
+        """ A player disconnected, forfeiting the game
+        """
+        for player_index, player in enumerate(self.bots):
+            if isinstance(player, RemoteBot) and player.connection is connection:
+                self.runner.forfeits[player_index] = True
+        if self.waiting is not None:
+            self.waiting = None
+            self.server.cancel(self.timer)
+            self.advance(None)
+
+    def finish(self):
+        self.finished = True
+        scores = self.runner.scores
+        forfeits = self.runner.forfeits
+        for player_index, player in enumerate(self.bots):
+            if isinstance(player, RemoteBot):
+                player.connection.match = None
+                player.connection.send_message(dict(
+                    type='game_over',
+                    scores=[scores[player_index], scores[player_index ^ 1]],
+                    forfeits=[forfeits[player_index], forfeits[player_index ^ 1]],
+                ))
+        self.server.finish_match(self)
+
+
+class ClientConnection(asynchat.async_chat):
+
+    def __init__(self, server, sock):
+        asynchat.async_chat.__init__(self, sock, map=server.socket_map)
+        self.server = server
+        self.set_terminator(b'\n')
+        self.buffer = []
+        self.buffer_length = 0
+        self.match = None
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+        self.buffer_length += len(data)
+        if self.buffer_length > MAX_LINE_LENGTH:
+            self.handle_close()
+
+    def found_terminator(self):
+        line = b''.join(self.buffer)
+        self.buffer = []
+        self.buffer_length = 0
+        if not line.strip():
+            return
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as e:
+            self.send_message(dict(type='error', message=str(e)))
+            return
+        self.server.handle_message(self, message)
+
+    def send_message(self, message):
+        if self.connected:
+            self.push(json.dumps(message) + b'\n')
+
+    def handle_close(self):
+        self.close()
+        self.server.client_gone(self)
+
+
+class MatchServer(asyncore.dispatcher):
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, default_opponent=None,
+            max_time_for_play=game.MAX_TIME_FOR_PLAY, seed=None):
+        self.socket_map = {}
+        asyncore.dispatcher.__init__(self, map=self.socket_map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(128)
+        self.default_opponent = default_opponent
+        self.max_time_for_play = max_time_for_play
+        self.rng = random.Random(seed)
+        self.matches = set()
+        self.games_played = 0
+        # A client waiting for another client to join
+        self.lobby = None
+        # (deadline, order, callback, args), cancelled ones have no callback
+        self.timers = []
+        self.timer_order = itertools.count()
+
+    @property
+    def address(self):
+        return self.socket.getsockname()
+
+    def call_later(self, delay, callback, *args):
+        timer = [time.time() + delay, next(self.timer_order), callback, args]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer is not None:
+            timer[2] = None
+
+    def run_timers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.timers)
+            if callback is not None:
+                callback(*args)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            ClientConnection(self, pair[0])
+
+    def handle_message(self, connection, message):
+        if connection.match is not None:
+            connection.match.receive(connection, message)
+        elif message.get('type') == 'join':
+            self.join(connection, message.get('opponent', self.default_opponent))
+        else:
+            connection.send_message(dict(type='error', message='Join a game first'))
+
+    def join(self, connection, opponent_name):
+        if opponent_name is None:
+            if self.lobby is None or not self.lobby.connected:
+                self.lobby = connection
+                connection.send_message(dict(type='waiting'))
+                return
+            players = [RemoteBot(self.lobby), RemoteBot(connection)]
+            self.lobby = None
+        else:
+            try:
+                opponent = bot.load_bot(opponent_name)
+            except (ImportError, ValueError) as e:
+                connection.send_message(dict(type='error', message=str(e)))
+                return
+            players = [RemoteBot(connection), opponent()]
+        self.rng.shuffle(players)
+        match = Match(self, players, self.rng.getrandbits(63))
+        self.matches.add(match)
+        for seat, player in enumerate(players):
+            if isinstance(player, RemoteBot):
+                player.connection.match = match
+                player.connection.send_message(dict(
+                    type='welcome',
+                    seat=seat,
+                    opponent=type(players[seat ^ 1]).__name__,
+                ))
+        match.start()
+
+    def finish_match(self, match):
+        self.matches.discard(match)
+        self.games_played += 1
+
+    def client_gone(self, connection):
+        if self.lobby is connection:
+            self.lobby = None
+        if connection.match is not None:
+            connection.match.abandon(connection)
+
+    def serve_forever(self, poll_interval=1.0):
+        while True:
+            self.serve_once(poll_interval)
+
+    def serve_once(self, poll_interval=1.0):
+        """ Wait for network activity or the next timer, and handle it
+        """
+        timeout = poll_interval
+        if self.timers:
+            timeout = max(0, min(timeout, self.timers[0][0] - time.time()))
+        asyncore.loop(timeout=timeout, use_poll=True, map=self.socket_map, count=1)
+        self.run_timers()
+
+
+def play_remote(host, port, local_bot, opponent=None):
+    """ Play one game on a match server with local_bot, returning the scores
+    """
+    sock = socket.create_connection((host, port))
+    lines = sock.makefile('rb')
+    try:
+        join = dict(type='join')
+        # Left out rather than null, so the server's default opponent applies
+        if opponent is not None:
+            join['opponent'] = opponent
+        sock.sendall(json.dumps(join) + b'\n')
+        for line in lines:
+            message = json.loads(line)
+            reply = None
+            if message['type'] == 'new_hand':
+                local_bot.notify_new_hand(cribbage.Hand([_card(index) for index in message['cards']]))
+            elif message['type'] == 'starter':
+                local_bot.notify_starter_card(_card(message['card']))
+            elif message['type'] == 'throw':
+                local_bot.deadline = time.time() + message['time_limit'] * game.DEADLINE_FRACTION
+                thrown = local_bot.ask_for_crib_throw(message['has_crib'], message['scores'])
+                reply = dict(type='throw', cards=_card_indexes(thrown))
+            elif message['type'] == 'peg':
+                local_bot.deadline = time.time() + message['time_limit'] * game.DEADLINE_FRACTION
+                peg_card = local_bot.ask_for_next_peg_card(
+                    [_card(index) for index in message['round']],
+                    [_card(index) for index in message['pegged']],
+                )
+                reply = dict(type='peg', card=peg_card.index if peg_card is not None else None)
+            elif message['type'] == 'game_over':
+                return message['scores']
+            local_bot.deadline = None
+            if reply is not None:
+                sock.sendall(json.dumps(reply) + b'\n')
+    finally:
+        lines.close()
+        sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host cribbage games, or play on a host.')
+    parser.add_argument(
+        '--host',
+        default=DEFAULT_HOST,
+        required=False,
+        help='Address to listen on, or to connect to with --connect',
+    )
+    parser.add_argument(
+        '--port',
+        default=DEFAULT_PORT,
+        required=False,
+        type=int,
+        help='Port to listen on, or to connect to with --connect',
+    )
+    parser.add_argument(
+        '--opponent',
+        default=None,
+        required=False,
+        help='Bot to play clients that do not name one, or to ask for with --connect',
+    )
+    parser.add_argument(
+        '--max_time_for_play',
+        default=game.MAX_TIME_FOR_PLAY,
+        required=False,
+        type=float,
+        help='Seconds a player gets per decision before forfeiting',
+    )
+    parser.add_argument(
+        '--seed',
+        default=None,
+        required=False,
+        type=int,
+        help='Seed for seating and dealing, random if not given',
+    )
+    parser.add_argument(
+        '--connect',
+        default=None,
+        required=False,
+        help='Play one game on a server with this bot, e.g. HumanBot, instead of hosting',
+    )
+    args = parser.parse_args()
+
+    if args.connect:
+        print "Final score:", play_remote(args.host, args.port, bot.load_bot(args.connect)(),
+                opponent=args.opponent)
+    else:
+        server = MatchServer(args.host, args.port, default_opponent=args.opponent,
+                max_time_for_play=args.max_time_for_play, seed=args.seed)
+        print "Serving on %s:%d" % server.address
+        server.serve_forever()
@@ -0,0 +1,226 @@
+""" Expectimax search over the rest of a pegging hand.
+
+Pegging only depends on ranks, so the search works on rank tuples. The
+opponent's hidden cards are modelled as draws from the cards the searching
+bot hasn't seen: on the opponent's turn, the chance it has no legal card is
+the chance that none of its remaining cards are legal, and otherwise it
+plays a legal rank in proportion to how many unseen cards have that rank.
+Values are the searching bot's pegging points minus the opponent's.
+
+Searches deepen iteratively, best root move first, within a node and time
+budget, and positions are cached in a transposition table keyed on the
+pegging state.
+"""
+
+import time
+
+import cribbage
+
+DEFAULT_MAX_NODES = 20000
+DEFAULT_TIME_BUDGET = 0.05
+
+ME = 0
+OPPONENT = 1
+HAND_SIZE = 4
+
+
+class SearchBudgetExceeded(Exception):
+    pass
+
+
+def _remove_rank(ranks, rank):
+    idx = ranks.index(rank)
+    return ranks[:idx] + ranks[idx + 1:]
+
+
+def _last_card_points(round_state, last_player):
+    count, _, recent_ranks = round_state
+    if not recent_ranks or count >= cribbage.PEGGING_LIMIT:
+        return 0
+    return 1 if last_player == ME else -1
+
+
+class PeggingSearch(object):
+    """ Chooses peg cards by expectimax over the opponent's unseen cards
+
+    After a choice, nodes and depth_reached describe the search that made it.
+    """
+
+    def __init__(self, max_nodes=DEFAULT_MAX_NODES, time_budget=DEFAULT_TIME_BUDGET):
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget
+        self.nodes = 0
+        self.depth_reached = 0
+        self.table = {}
+        self.exact = True
+        self.stop_time = None
+
+    def choose(self, hand_cards, cards_in_pegging_round, all_cards_pegged, known_cards=(),
+            deadline=None):
+        """ Card from hand_cards to play next, or None to say go
+
+        hand_cards are the 4 cards kept for this hand, and known_cards any
+        other cards the bot has seen, like its crib throw and the starter.
+        """
+        pegged = set(all_cards_pegged)
+        my_cards = [card for card in hand_cards if card not in pegged]
+        count = cribbage.sum_cards_for_pegging(cards_in_pegging_round)
+        legal_cards = [card for card in my_cards
+                if count + cribbage.VALUES[card.rank] <= cribbage.PEGGING_LIMIT]
+        if not legal_cards:
+            return None
+        cards_by_rank = dict((card.rank, card) for card in legal_cards)
+        if len(cards_by_rank) == 1:
+            return legal_cards[0]
+
+        seen = set(hand_cards) | set(known_cards) | pegged
+        unseen = [0] * 13
+        for card in cribbage.Deck.all_cards():
+            if card not in seen:
+                unseen[card.rank - 1] += 1
+        opp_left = HAND_SIZE - len([card for card in pegged if card not in hand_cards])
+
+        round_state = cribbage.pegging_round_state(cards_in_pegging_round)
+        last_player = None
+        passed = False
+        if cards_in_pegging_round:
+            # Our own card last means the opponent said go
+            passed = cards_in_pegging_round[-1] in hand_cards
+            last_player = ME if passed else OPPONENT
+        my_ranks = tuple(sorted(card.rank for card in my_cards))
+
+        self.stop_time = time.time() + self.time_budget
+        if deadline is not None:
+            self.stop_time = min(self.stop_time, deadline)
+        self.nodes = 0
+        self.depth_reached = 0
+        self.table = {}
+
+        # Greedy order until a search has completed
+        root_ranks = sorted(cards_by_rank, reverse=True,
+                key=lambda rank: (cribbage.pegging_points(round_state, rank), rank))
+        max_depth = 2 * (len(my_ranks) + opp_left) + 2
+        for depth in xrange(1, max_depth + 1):
+            self.exact = True
+            values = {}
+            try:
+                for rank in root_ranks:
+                    values[rank] = self._play_value(
+                        ME, rank, round_state, my_ranks, opp_left,
+                        tuple(unseen), passed, depth)
+            except SearchBudgetExceeded:
+                # A partial iteration still counts if it has searched the
+                # previous best move, as anything beating it is better
+                if values:
+                    root_ranks = sorted(values, key=values.get, reverse=True) + [
+                        rank for rank in root_ranks if rank not in values]
+                break
+            root_ranks = sorted(root_ranks, key=values.get, reverse=True)
+            self.depth_reached = depth
+            if self.exact:
+                break
+        return cards_by_rank[root_ranks[0]]
+
+    def _has_cards(self, player, my_ranks, opp_left):
+        if player == ME:
+            return bool(my_ranks)
+        return opp_left > 0
+
+    def _node(self, turn, round_state, my_ranks, opp_left, unseen, passed, last_player, depth):
+        if not my_ranks and not opp_left:
+            return _last_card_points(round_state, last_player)
+        if depth == 0:
+            self.exact = False
+            return 0.0
+
+        key = (turn, round_state, my_ranks, opp_left, unseen, passed, last_player, depth)
+        cached = self.table.get(key)
+        if cached is not None:
+            value, exact = cached
+            self.exact = self.exact and exact
+            return value
+
+        self.nodes += 1
+        if self.nodes > self.max_nodes or (self.nodes & 0xFF == 0 and time.time() > self.stop_time):
+            raise SearchBudgetExceeded
+
+        outer_exact = self.exact
+        self.exact = True
+        if turn == ME:
+            value = self._my_turn(round_state, my_ranks, opp_left, unseen, passed, last_player, depth)
+        else:
+            value = self._opponent_turn(round_state, my_ranks, opp_left, unseen, passed, last_player, depth)
+        self.table[key] = (value, self.exact)
+        self.exact = outer_exact and self.exact
+        return value
+
+    def _my_turn(self, round_state, my_ranks, opp_left, unseen, passed, last_player, depth):
+        legal_ranks = set(rank for rank in my_ranks
+                if round_state[0] + cribbage.VALUES[rank] <= cribbage.PEGGING_LIMIT)
+        if not legal_ranks:
+            return self._go_value(ME, round_state, my_ranks, opp_left, unseen,
+                    passed, last_player, depth)
+        return max(
+            self._play_value(ME, rank, round_state, my_ranks, opp_left, unseen, passed, depth)
+            for rank in legal_ranks
+        )
+
+    def _opponent_turn(self, round_state, my_ranks, opp_left, unseen, passed, last_player, depth):
+        legal = [(rank_idx + 1, num_cards) for rank_idx, num_cards in enumerate(unseen)
+                if num_cards and round_state[0] + cribbage.VALUES[rank_idx + 1] <= cribbage.PEGGING_LIMIT]
+        num_legal = sum(num_cards for _, num_cards in legal)
+        num_unseen = sum(unseen)
+        num_holdings = cribbage.binomial(num_unseen, opp_left)
+        if num_holdings:
+            go_chance = float(cribbage.binomial(num_unseen - num_legal, opp_left)) / num_holdings
+        else:
+            go_chance = float(num_legal == 0)
+
+        value = 0.0
+        if go_chance > 0:
+            value += go_chance * self._go_value(OPPONENT, round_state, my_ranks, opp_left,
+                    unseen, passed, last_player, depth)
+        for rank, num_cards in legal:
+            chance = (1 - go_chance) * num_cards / num_legal
+            value += chance * self._play_value(OPPONENT, rank, round_state, my_ranks,
+                    opp_left, unseen, passed, depth)
+        return value
+
+    def _play_value(self, player, rank, round_state, my_ranks, opp_left, unseen, passed, depth):
+        """ Value of player playing rank, including the points it scores
+        """
+        points = cribbage.pegging_points(round_state, rank)
+        if player == ME:
+            my_ranks = _remove_rank(my_ranks, rank)
+        else:
+            points = -points
+            opp_left -= 1
+            unseen = unseen[:rank - 1] + (unseen[rank - 1] - 1,) + unseen[rank:]
+
+        other = 1 - player
+        other_has_cards = self._has_cards(other, my_ranks, opp_left)
+        round_state = cribbage.pegging_state_after(round_state, rank)
+        if round_state[0] == cribbage.PEGGING_LIMIT:
+            next_turn = other if other_has_cards else player
+            return points + self._node(next_turn, cribbage.PEGGING_ROUND_START, my_ranks, opp_left, unseen,
+                    False, None, depth - 1)
+
+        if passed or not other_has_cards:
+            return points + self._node(player, round_state, my_ranks, opp_left, unseen,
+                    True, player, depth - 1)
+        return points + self._node(other, round_state, my_ranks, opp_left, unseen,
+                False, player, depth - 1)
+
+    def _go_value(self, player, round_state, my_ranks, opp_left, unseen, passed, last_player, depth):
+        """ Value of player saying go
+        """
+        other = 1 - player
+        other_has_cards = self._has_cards(other, my_ranks, opp_left)
+        if passed or not other_has_cards:
+            # Neither can play: last card point, and a new round led by
+            # the other player if they have cards left
+            next_turn = other if other_has_cards else player
+            return _last_card_points(round_state, last_player) + self._node(
+                next_turn, cribbage.PEGGING_ROUND_START, my_ranks, opp_left, unseen, False, None, depth - 1)
+        return self._node(other, round_state, my_ranks, opp_left, unseen,
+                True, last_player, depth - 1)
@@ -0,0 +1,67 @@
+""" Sequential probability ratio test for head-to-head matches.
+
+Tests H0, that the first player is elo0 stronger than the second, against
+H1, that it is elo1 stronger, one mirrored pair at a time. A pair's two
+games share their deals, so the pair, scored as its mean points per game,
+is the unit the test counts. The log-likelihood ratio uses the usual
+normal approximation on the mean and variance of those pair scores, and
+the match stops as soon as it leaves the (lower, upper) bounds that
+alpha and beta give.
+"""
+
+import math
+
+DEFAULT_ELO0 = 0.0
+DEFAULT_ELO1 = 10.0
+DEFAULT_ALPHA = 0.05
+DEFAULT_BETA = 0.05
+
+H0 = 'H0'
+H1 = 'H1'
+# Variance of a single coin flip game, blended in as one virtual pair so
+# that a run of identical results does not make the variance 0
+PRIOR_VARIANCE = 0.25
+
+
+def expected_score(elo):
+    """ Expected points per game of a player elo stronger than its opponent
+    """
+    return 1 / (1 + 10 ** (-elo / 400.0))
+
+
+class SPRT(object):
+
+    def __init__(self, elo0=DEFAULT_ELO0, elo1=DEFAULT_ELO1, alpha=DEFAULT_ALPHA, beta=DEFAULT_BETA):
+        if elo1 <= elo0:
+            raise ValueError("elo1 must be above elo0")
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.pair_scores = []
+
+    def add_pair(self, score):
+        """ Add a pair's mean points per game for the first player, 0 to 1
+        """
+        self.pair_scores.append(score)
+
+    def llr(self):
+        num_pairs = len(self.pair_scores)
+        if not num_pairs:
+            return 0.0
+        mean = sum(self.pair_scores) / num_pairs
+        variance = sum((score - mean) ** 2 for score in self.pair_scores) / num_pairs
+        variance = (num_pairs * variance + PRIOR_VARIANCE) / (num_pairs + 1)
+        score0 = expected_score(self.elo0)
+        score1 = expected_score(self.elo1)
+        return (score1 - score0) * (2 * mean - score0 - score1) * num_pairs / (2 * variance)
+
+    def status(self):
+        """ H1 or H0 once accepted, None while undecided
+        """
+        llr = self.llr()
+        if llr >= self.upper:
+            return H1
+        elif llr <= self.lower:
+            return H0
+        return None
@@ -0,0 +1,293 @@
+""" Precomputed crib throws for every 6 card deal, up to suit permutation.
+
+The best throw depends only on the 6 cards dealt and who owns the crib,
+so it is computed offline for each of the canonical.num_classes(6) deals
+and both crib owners. Each record holds the expected points (hand plus or
+minus crib, averaged over every starter and crib completion) of all 15
+ways to keep 4 cards, along with the best of them, so a bot's throw is a
+single lookup.
+
+Records sit at a fixed offset for their canonical_index, in a file that
+starts out sparse and all zeros. A record whose best byte is still 0 has
+not been built, so the builder can be stopped at any time and resumed,
+and spreads chunks of deals across worker processes.
+
+evaluate_counts gives the score distributions behind those expected
+points, for bots and analysis that care about more than the mean.
+"""
+
+import argparse
+import itertools
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+import canonical
+import crib
+import cribbage
+
+MAGIC = b'CRIBSTR1'
+VERSION = 1
+HEADER = struct.Struct(b'<8sII')
+NUM_OPTIONS = 15
+# One more than the best option (0 while unbuilt), then each option's
+# expected points in 1/VALUE_SCALE of a point
+RECORD = struct.Struct(b'<B%dhx' % NUM_OPTIONS)
+VALUE_SCALE = 256.0
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'strategy_table.bin',
+)
+DEFAULT_CHUNK_SIZE = 512
+
+
+def num_deals():
+    """ Number of canonical 6 card deals, counted on first use
+    """
+    return canonical.num_classes(6)
+
+
+def keep_options(cards):
+    """ The 15 ways to keep 4 of the 6 cards, in record order
+    """
+    return list(itertools.combinations(sorted(cards), 4))
+
+
+def _starter_scores(options, other_cards):
+    """ Hand score of each option with each of other_cards as the starter
+    """
+    if cribbage.load_numpy() is not None:
+        return cribbage.Scorer.score_many(options, other_cards)['score'].tolist()
+    hand_scores = []
+    for option in options:
+        hand = cribbage.Hand(list(option))
+        starter_scores = []
+        for starter_card in other_cards:
+            hand.add_starter_card(starter_card)
+            starter_scores.append(cribbage.Scorer.score(hand)['score'])
+        hand_scores.append(starter_scores)
+    return hand_scores
+
+
+def evaluate(cards):
+    """ Expected points of each keep option, without and with the crib
+    """
+    hand_mask = cribbage.cards_to_mask(cards)
+    other_cards = cribbage.mask_to_cards(cribbage.FULL_DECK_MASK & ~hand_mask)
+    options = keep_options(cards)
+    hand_totals = [sum(starter_scores) for starter_scores in _starter_scores(options, other_cards)]
+    # Heels is the only part of a hand's score that depends on the crib
+    heels = 2.0 * sum(1 for card in other_cards if card.rank == cribbage.JACK) / len(other_cards)
+
+    values = ([], [])
+    for option, hand_total in zip(options, hand_totals):
+        hand_value = float(hand_total) / len(other_cards)
+        cards_to_throw = cribbage.mask_to_cards(hand_mask & ~cribbage.cards_to_mask(option))
+        crib_value = crib.expected_crib_score(cards_to_throw, other_cards)
+        values[0].append(hand_value - crib_value)
+        values[1].append(hand_value + heels + crib_value)
+    return values
+
+
+def evaluate_counts(cards):
+    """ Score counts of each keep option, and the values evaluate gives
+
+    Returns (values, hand_counts, crib_counts). hand_counts holds, without
+    then with the crib, a count array per option of how many starters give
+    each hand score, and crib_counts one of how many (starter, completion)
+    draws give each crib score. The values are the means of those counts,
+    so they take no scoring beyond the counts themselves.
+    """
+    hand_mask = cribbage.cards_to_mask(cards)
+    other_cards = cribbage.mask_to_cards(cribbage.FULL_DECK_MASK & ~hand_mask)
+    options = keep_options(cards)
+    heels = [2 if card.rank == cribbage.JACK else 0 for card in other_cards]
+    hand_scores = _starter_scores(options, other_cards)
+
+    values = ([], [])
+    hand_counts = ([], [])
+    crib_counts = []
+    for option, starter_scores in zip(options, hand_scores):
+        hand_counts[0].append(cribbage.score_counts(starter_scores))
+        hand_counts[1].append(cribbage.score_counts(
+            score + heels_points for score, heels_points in zip(starter_scores, heels)))
+        cards_to_throw = cribbage.mask_to_cards(hand_mask & ~cribbage.cards_to_mask(option))
+        crib_counts.append(crib.crib_score_counts(cards_to_throw, other_cards))
+        crib_value = cribbage.mean_score(crib_counts[-1])
+        values[0].append(cribbage.mean_score(hand_counts[0][-1]) - crib_value)
+        values[1].append(cribbage.mean_score(hand_counts[1][-1]) + crib_value)
+    return values, hand_counts, crib_counts
+
+
+def _pack(values):
+    best = max(xrange(NUM_OPTIONS), key=values.__getitem__)
+    return RECORD.pack(best + 1, *[int(round(value * VALUE_SCALE)) for value in values])
+
+
+def _build_chunk(chunk):
+    """ Packed records of deals [start, stop), without then with the crib
+    """
+    start, stop = chunk
+    records = []
+    for deal_index in xrange(start, stop):
+        cards, _ = canonical.index_to_cards(deal_index, 6)
+        for has_crib_values in evaluate(cards):
+            records.append(_pack(has_crib_values))
+    return start, b''.join(records)
+
+
+class StrategyTable(object):
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def offset(cls, deal_index, has_crib):
+        return HEADER.size + (2 * deal_index + int(has_crib)) * RECORD.size
+
+    def open(self, writable=False):
+        """ Map the table, creating an empty one first if writable
+
+        Raises ValueError for a table written by another version.
+        """
+        if self._mmap is not None:
+            return self
+        size = self.offset(num_deals(), False)
+        if writable and not os.path.exists(self.path):
+            with open(self.path, 'wb') as table_file:
+                table_file.write(HEADER.pack(MAGIC, VERSION, num_deals()))
+                # Sparse, so unbuilt records cost no disk
+                table_file.truncate(size)
+        self._file = open(self.path, 'r+b' if writable else 'rb')
+        header = self._file.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, num_deals()):
+            self.close()
+            raise ValueError("Not a current strategy table: %s" % self.path)
+        self._mmap = mmap.mmap(self._file.fileno(), size,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        return self
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, deal_index, has_crib):
+        """ (best option, option values) of a canonical deal, or None if unbuilt
+        """
+        unpacked = RECORD.unpack_from(self._mmap, self.offset(deal_index, has_crib))
+        if not unpacked[0]:
+            return None
+        return unpacked[0] - 1, [value / VALUE_SCALE for value in unpacked[1:]]
+
+    def lookup(self, cards, has_crib):
+        """ The best 4 cards to keep from a 6 card deal, and their value
+
+        Returns None if the deal's record has not been built yet.
+        """
+        canonical_cards, _, perm = canonical.canonicalize(cards)
+        record = self.record(canonical.canonical_index(canonical_cards), has_crib)
+        if record is None:
+            return None
+        best, values = record
+        kept_indexes = [card.index for card in keep_options(canonical_cards)[best]]
+        keep_cards = [cribbage.Card.from_index(index)
+                for index in canonical.uncanonicalize_indexes(kept_indexes, perm)]
+        return sorted(keep_cards), values[best]
+
+    def missing_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ (start, stop) deal ranges holding any unbuilt record
+        """
+        chunks = []
+        for start in xrange(0, num_deals(), chunk_size):
+            stop = min(start + chunk_size, num_deals())
+            best_bytes = self._mmap[self.offset(start, False):self.offset(stop, False):RECORD.size]
+            if b'\x00' in best_bytes:
+                chunks.append((start, stop))
+        return chunks
+
+    def build(self, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=None, progress_every=20):
+        """ Build unbuilt records, stopping after max_chunks chunks if given
+        """
+        missing = self.missing_chunks(chunk_size)
+        chunks = missing[:max_chunks]
+        print "Building %d chunks of %d deals, %d of %d left to build" % (
+            len(chunks), chunk_size, len(missing), -(-num_deals() // chunk_size))
+        if not chunks:
+            return
+
+        # Load the lookup tables once, before any worker is forked
+        crib.rank_scores()
+        start_time = time.time()
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(_build_chunk, chunks)
+        else:
+            results = itertools.imap(_build_chunk, chunks)
+        try:
+            for num_done, (start, records) in enumerate(results, 1):
+                offset = self.offset(start, False)
+                self._mmap[offset:offset + len(records)] = records
+                if num_done % progress_every == 0 or num_done == len(chunks):
+                    self._mmap.flush()
+                    elapsed = time.time() - start_time
+                    print "%d/%d chunks, %.0fs elapsed, %.0fs to go" % (
+                        num_done, len(chunks), elapsed,
+                        elapsed / num_done * (len(chunks) - num_done))
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            self._mmap.flush()
+            if pool is not None:
+                pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the crib throw strategy table.')
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_PATH,
+        required=False,
+        help='Table file, created if missing and resumed if partly built',
+    )
+    parser.add_argument(
+        '--workers',
+        default=multiprocessing.cpu_count(),
+        required=False,
+        type=int,
+        help='Number of processes to build chunks in',
+    )
+    parser.add_argument(
+        '--chunk_size',
+        default=DEFAULT_CHUNK_SIZE,
+        required=False,
+        type=int,
+        help='Deals per unit of work',
+    )
+    parser.add_argument(
+        '--max_chunks',
+        default=None,
+        required=False,
+        type=int,
+        help='Stop after building this many chunks',
+    )
+    args = parser.parse_args()
+
+    table = StrategyTable(args.path).open(writable=True)
+    try:
+        table.build(args.workers, args.chunk_size, args.max_chunks)
+    finally:
+        table.close()
@@ -1,25 +1,13 @@
 import random
 import cribbage
 
-class Bot(object):
-
-    def ask_for_crib_throw(self, has_crib, scores=None):
-        raise NotImplementedError
-
-    def notify_starter_card(self, card):
-        self.hand.add_starter_card(card)
-
-    def notify_new_hand(self, hand):
-        self.hand = hand
-
-    def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
-        raise NotImplementedError
+from bot import Bot
 
 
 class RandomBot(Bot):
 
     def ask_for_crib_throw(self, has_crib, scores=None):
-        return self.hand.throw_cards(*random.sample(self.hand.cards, 2))
+        return self.hand.throw_cards(*self.rng.sample(self.hand.cards, 2))
 
     def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
         current_sum = cribbage.sum_cards_for_pegging(cards_in_pegging_round)
@@ -27,7 +15,7 @@ class RandomBot(Bot):
         cards_can_play = [card for card in cards_not_played if cribbage.VALUES[card.rank] < (31 - current_sum)]
         if not cards_can_play:
             return None
-        return random.choice(cards_can_play)
+        return self.rng.choice(cards_can_play)
 
 class OneSixBot(Bot):
 
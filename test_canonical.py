@@ -0,0 +1,70 @@
+import random
+
+import canonical
+import cribbage
+
+NUM_SAMPLES = 300
+
+
+def permuted(cards, perm):
+    return [cribbage.Card.from_index(canonical.permute_index(card.index, perm)) for card in cards]
+
+
+def sample_hands(seed, num_cards, num_hands=NUM_SAMPLES):
+    """ (cards, starter) pairs at random, with and without a starter
+    """
+    rng = random.Random(seed)
+    hands = []
+    for hand_idx in xrange(num_hands):
+        cards = rng.sample(cribbage.Deck.all_cards(), num_cards + 1)
+        hands.append((sorted(cards[:num_cards]), cards[num_cards] if hand_idx % 2 else None))
+    return hands
+
+
+def test_index_round_trips():
+    rng = random.Random(1)
+    for num_cards, has_starter in ((4, False), (4, True), (6, False)):
+        num_classes = canonical.num_classes(num_cards, has_starter)
+        for class_index in [0, num_classes - 1] + [rng.randrange(num_classes) for _ in xrange(NUM_SAMPLES)]:
+            cards, starter_card = canonical.index_to_cards(class_index, num_cards, has_starter)
+            assert canonical.canonical_index(cards, starter_card) == class_index
+
+
+def test_hands_round_trip_through_their_index():
+    for num_cards in (4, 6):
+        for cards, starter_card in sample_hands(num_cards, num_cards):
+            canonical_cards, canonical_starter, _ = canonical.canonicalize(cards, starter_card)
+            class_index = canonical.canonical_index(cards, starter_card)
+            assert canonical.index_to_cards(class_index, num_cards, starter_card is not None) == (
+                canonical_cards, canonical_starter)
+
+
+def test_suit_permutations_share_a_class():
+    rng = random.Random(2)
+    for cards, starter_card in sample_hands(3, 6, 50):
+        perm = rng.choice(canonical.SUIT_PERMUTATIONS)
+        other_cards = permuted(cards, perm)
+        other_starter = permuted([starter_card], perm)[0] if starter_card is not None else None
+        assert canonical.canonical_index(other_cards, other_starter) == (
+            canonical.canonical_index(cards, starter_card))
+        assert canonical.canonical_key(other_cards, other_starter) == (
+            canonical.canonical_key(cards, starter_card))
+
+
+def test_key_and_uncanonicalize_round_trip():
+    for cards, starter_card in sample_hands(4, 6):
+        canonical_cards, canonical_starter, perm = canonical.canonicalize(cards, starter_card)
+        assert canonical.key_to_cards(canonical.canonical_key(cards, starter_card)) == (
+            canonical_cards, canonical_starter)
+        original_indexes = canonical.uncanonicalize_indexes(
+            [card.index for card in canonical_cards], perm)
+        assert sorted(original_indexes) == [card.index for card in cards]
+
+
+def test_num_classes_counts_every_hand():
+    # Orbits partition the hands, so their sizes add up to every hand
+    num_hands = 0
+    for class_index in xrange(canonical.num_classes(2)):
+        cards, _ = canonical.index_to_cards(class_index, 2)
+        num_hands += canonical.orbit_size(cards)
+    assert num_hands == canonical.num_hands(2)
@@ -0,0 +1,56 @@
+import itertools
+import random
+
+import crib
+import cribbage
+
+NUM_SAMPLES = 5
+
+
+def sample_throws(seed, num_throws=NUM_SAMPLES):
+    """ (cards thrown, starter, cards a completion can come from) at random
+    """
+    rng = random.Random(seed)
+    throws = []
+    for _ in xrange(num_throws):
+        dealt = rng.sample(cribbage.Deck.all_cards(), 7)
+        other_cards = [card for card in cribbage.Deck.all_cards() if card not in dealt]
+        throws.append((dealt[:2], dealt[6], other_cards))
+    return throws
+
+
+def brute_force_counts(cards_to_throw, starter_card, other_cards):
+    """ Crib score counts from scoring every completion
+    """
+    scores = []
+    for completion in itertools.combinations(other_cards, 2):
+        hand = cribbage.Hand(list(cards_to_throw) + list(completion))
+        hand.add_starter_card(starter_card)
+        scores.append(cribbage.Scorer.score(hand, is_crib=True)['score'])
+    return cribbage.score_counts(scores)
+
+
+def test_counts_for_starter_match_brute_force():
+    for cards_to_throw, starter_card, other_cards in sample_throws(1):
+        expected = brute_force_counts(cards_to_throw, starter_card, other_cards)
+        assert crib.crib_score_counts_for_starter(cards_to_throw, starter_card, other_cards) == expected
+        assert abs(crib.expected_crib_score_for_starter(cards_to_throw, starter_card, other_cards) -
+                cribbage.mean_score(expected)) < 1e-9
+
+
+def test_nobs_and_flush_throws_match_brute_force():
+    # A suited throw with the starter's jack tests the flush and nobs splits
+    starter_card = cribbage.Card(5, cribbage.HEARTS)
+    cards_to_throw = [cribbage.Card(cribbage.JACK, cribbage.HEARTS), cribbage.Card(2, cribbage.HEARTS)]
+    other_cards = [card for card in cribbage.Deck.all_cards()
+            if card not in cards_to_throw and card != starter_card][:40]
+    assert crib.crib_score_counts_for_starter(cards_to_throw, starter_card, other_cards) == (
+        brute_force_counts(cards_to_throw, starter_card, other_cards))
+
+
+def test_expectation_over_starters():
+    for cards_to_throw, _, unseen_cards in sample_throws(2, 2):
+        counts = crib.crib_score_counts(cards_to_throw, unseen_cards)
+        assert sum(counts) == len(unseen_cards) * cribbage.binomial(len(unseen_cards) - 1, 2)
+        assert abs(crib.expected_crib_score(cards_to_throw, unseen_cards) -
+                cribbage.mean_score(counts)) < 1e-9
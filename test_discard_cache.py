@@ -0,0 +1,52 @@
+import random
+import shutil
+import tempfile
+
+import canonical
+import cribbage
+import discard_cache
+
+NUM_SLOTS = 1024
+
+
+def permuted(cards, perm):
+    return [cribbage.Card.from_index(canonical.permute_index(card.index, perm)) for card in cards]
+
+
+def test_stored_throws_come_back_under_any_suit_permutation():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = discard_cache.DiscardCache(directory, num_slots=NUM_SLOTS)
+        rng = random.Random(1)
+        for _ in xrange(50):
+            cards = rng.sample(cribbage.Deck.all_cards(), 6)
+            keep_cards = sorted(rng.sample(cards, 4))
+            cache.store('Bot', cards, True, keep_cards, 7.5)
+            assert cache.lookup('Bot', cards, False) is None
+            assert cache.lookup('Other', cards, True) is None
+
+            perm = rng.choice(canonical.SUIT_PERMUTATIONS)
+            other_keep, score = cache.lookup('Bot', permuted(cards, perm), True)
+            assert sorted(other_keep) == sorted(permuted(keep_cards, perm))
+            assert score == 7.5
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_throws_persist_on_disk():
+    directory = tempfile.mkdtemp()
+    try:
+        cards = cribbage.Deck.all_cards()[:6]
+        cache = discard_cache.DiscardCache(directory, num_slots=NUM_SLOTS)
+        cache.store('Bot', cards, False, cards[:4], 3.25)
+        cache.close()
+
+        cache = discard_cache.DiscardCache(directory, num_slots=NUM_SLOTS)
+        keep_cards, score = cache.lookup('Bot', cards, False)
+        assert sorted(keep_cards) == sorted(cards[:4])
+        assert score == 3.25
+        assert cache.stats['disk_hits'] == 1
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
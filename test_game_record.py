@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+import game
+import game_record
+import test_ai
+
+NUM_GAMES = 300
+
+
+def play_recorded_games(path, num_games=NUM_GAMES):
+    """ Scores of RandomBot games seeded 0 to num_games - 1, recorded to path
+    """
+    live_scores = []
+    with game_record.GameRecordWriter(path) as recorder:
+        for seed in xrange(num_games):
+            runner = game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=seed,
+                    recorder=recorder)
+            live_scores.append(list(runner.run_game()))
+    return live_scores
+
+
+def test_replay_matches_live_scores():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'games.rec')
+        live_scores = play_recorded_games(path)
+        records = list(game_record.read_games(path))
+        assert [record.seed for record in records] == range(NUM_GAMES)
+        for record, scores in zip(records, live_scores):
+            assert record.scores == scores
+            assert game_record.replay(record) == scores
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_records_decode_to_what_was_encoded():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'games.rec')
+        play_recorded_games(path, 20)
+        for record in game_record.read_games(path):
+            assert game_record.GameRecord.decode(record.encode()).encode() == record.encode()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_seed_replays_the_game():
+    first = game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=7).run_game()
+    second = game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=7).run_game()
+    assert first == second
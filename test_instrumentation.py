@@ -0,0 +1,57 @@
+import time
+
+import cribbage
+import game
+import instrumentation
+import test_ai
+
+
+class SlowPegBot(test_ai.RandomBot):
+
+    def ask_for_next_peg_card(self, cards_in_pegging_round, all_cards_pegged):
+        time.sleep(0.02)
+        return super(SlowPegBot, self).ask_for_next_peg_card(cards_in_pegging_round, all_cards_pegged)
+
+
+def test_runners_count_only_their_own_scoring():
+    stats = instrumentation.Instrumentation()
+    runner = game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=1, stats=stats)
+    runner.run_game()
+    assert stats.counters['score_calls'] > 0
+    assert cribbage.SCORER_STATS is None
+
+    # Scoring outside any runner's calls isn't counted
+    calls = stats.counters['score_calls']
+    hand = cribbage.Hand(cribbage.Deck.all_cards()[:4])
+    hand.add_starter_card(cribbage.Deck.all_cards()[4])
+    cribbage.Scorer.score(hand)
+    assert stats.counters['score_calls'] == calls
+
+
+def test_interleaved_games_keep_separate_stats():
+    stats = [instrumentation.Instrumentation(), instrumentation.Instrumentation()]
+    runners = [game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=2, stats=stats[0]),
+            game.GameRunner(test_ai.RandomBot(), test_ai.RandomBot(), seed=2, stats=stats[1])]
+    plays = [runner.game_plays() for runner in runners]
+    answers = [None, None]
+    running = [True, True]
+    while any(running):
+        for idx, runner in enumerate(runners):
+            if not running[idx]:
+                continue
+            try:
+                play = plays[idx].send(answers[idx])
+            except StopIteration:
+                running[idx] = False
+                continue
+            answers[idx] = runner.run_play(play)
+    # The same seed plays the same game, so each counted the same work
+    assert stats[0].counters == stats[1].counters
+    assert stats[0].counters['score_calls'] > 0
+
+
+def test_slow_pegs_do_not_forfeit():
+    runner = game.GameRunner(SlowPegBot(), test_ai.RandomBot(), seed=3, max_time_for_play=0.01)
+    scores = runner.run_game()
+    assert runner.forfeits == [False, False]
+    assert min(scores) >= 0
@@ -0,0 +1,67 @@
+import random
+import shutil
+import tempfile
+import time
+
+import cribbage
+import discard_cache
+import kyle_ai
+
+
+def dealt_bot(bot_class, seed, cache=None):
+    """ A bot_class dealt 6 random cards
+    """
+    player = bot_class(rng=random.Random(seed))
+    player.discard_cache = cache
+    player.notify_new_hand(cribbage.Hand(random.Random(seed).sample(cribbage.Deck.all_cards(), 6)))
+    return player
+
+
+def test_throws_past_the_deadline_are_not_cached():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = discard_cache.DiscardCache(directory, num_slots=1024)
+        late = dealt_bot(kyle_ai.KyleBotV1, 1, cache)
+        late.deadline = time.time() - 1
+        assert len(late.ask_for_crib_throw(False)) == 2
+        assert cache.stats['stores'] == 0
+
+        on_time = dealt_bot(kyle_ai.KyleBotV1, 1, cache)
+        thrown = on_time.ask_for_crib_throw(False)
+        assert cache.stats['stores'] == 1
+
+        cached = dealt_bot(kyle_ai.KyleBotV1, 1, cache)
+        assert sorted(cached.ask_for_crib_throw(False)) == sorted(thrown)
+        assert cache.stats['hits'] == 1
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+class FlatHandBot(kyle_ai.KyleBotV1):
+
+    def _score_from_hand(self, hand, card_set, has_crib):
+        return 1
+
+
+def test_overridden_hand_scoring_is_not_batched():
+    player = dealt_bot(FlatHandBot, 2)
+    assert not player._batch_scoring()
+    other_cards = [card for card in cribbage.Deck.all_cards() if card not in player.hand.cards]
+    possible_hands = [player.hand.cards[:4], player.hand.cards[2:]]
+    assert player._score_from_hands(possible_hands, other_cards, False) == [46, 46]
+
+
+def test_batched_hand_scoring_matches_scoring_each_hand():
+    player = dealt_bot(kyle_ai.KyleBotV1, 3)
+    other_cards = [card for card in cribbage.Deck.all_cards() if card not in player.hand.cards]
+    possible_hands = [player.hand.cards[:4], player.hand.cards[2:]]
+    expected = []
+    for possible_hand in possible_hands:
+        hand = cribbage.Hand(list(possible_hand))
+        total = 0
+        for starter_card in other_cards:
+            hand.add_starter_card(starter_card)
+            total += player._score_from_hand(hand, other_cards, True)
+        expected.append(total)
+    assert player._score_from_hands(possible_hands, other_cards, True) == expected
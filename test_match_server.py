@@ -0,0 +1,52 @@
+import asyncore
+import contextlib
+import threading
+
+import game
+import match_server
+import test_ai
+
+
+class FailingBot(test_ai.RandomBot):
+
+    def ask_for_crib_throw(self, has_crib, scores=None):
+        raise RuntimeError("Failing on purpose")
+
+
+@contextlib.contextmanager
+def running_server(default_opponent):
+    """ A MatchServer on a free port, served from a thread until the block ends
+    """
+    server = match_server.MatchServer(port=0, default_opponent=default_opponent, seed=1)
+    stopped = threading.Event()
+
+    def serve():
+        while not stopped.is_set():
+            server.serve_once(0.05)
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        yield server
+    finally:
+        stopped.set()
+        thread.join()
+        asyncore.close_all(server.socket_map)
+
+
+def test_remote_game_against_a_local_bot():
+    with running_server('test_ai.RandomBot') as server:
+        host, port = server.address
+        scores = match_server.play_remote(host, port, test_ai.RandomBot())
+    assert max(scores) >= game.GAME_OVER_POINTS
+    assert min(scores) >= 0
+    # Only counted once the game_over message is sent, so after the server stops
+    assert server.games_played == 1
+
+
+def test_failing_local_bot_forfeits_only_its_match():
+    with running_server('test_match_server.FailingBot') as server:
+        host, port = server.address
+        for _ in xrange(2):
+            assert match_server.play_remote(host, port, test_ai.RandomBot()) == [0, -1]
+    assert server.games_played == 2
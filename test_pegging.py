@@ -0,0 +1,109 @@
+import random
+
+import cribbage
+import pegging_search
+
+NUM_ROUNDS = 2000
+
+
+def brute_force_points(round_ranks, rank):
+    """ Pegging points for rank, found by looking back over the whole round
+    """
+    ranks = list(round_ranks) + [rank]
+    points = 0
+    if sum(cribbage.VALUES[played] for played in ranks) in (15, cribbage.PEGGING_LIMIT):
+        points += 2
+    pair_length = 1
+    while pair_length < len(ranks) and ranks[-1 - pair_length] == rank:
+        pair_length += 1
+    points += {1: 0, 2: 2, 3: 6, 4: 12}[pair_length]
+    run_length = 0
+    for num_cards in xrange(3, len(ranks) + 1):
+        last = ranks[-num_cards:]
+        if len(set(last)) == num_cards and max(last) - min(last) == num_cards - 1:
+            run_length = num_cards
+    return points + run_length
+
+
+def random_rounds(seed, num_rounds=NUM_ROUNDS):
+    """ Ranks of pegging rounds played from shuffled decks, up to 31
+    """
+    rng = random.Random(seed)
+    rounds = []
+    for _ in xrange(num_rounds):
+        cards = list(cribbage.Deck.all_cards())
+        rng.shuffle(cards)
+        ranks = []
+        for card in cards:
+            if sum(cribbage.VALUES[rank] for rank in ranks) + cribbage.VALUES[card.rank] > cribbage.PEGGING_LIMIT:
+                break
+            ranks.append(card.rank)
+        rounds.append(ranks)
+    # Pair streaks and runs are rare in shuffled decks, so add some
+    rounds.extend([[5, 5, 5, 5], [1, 2, 3, 3, 2, 1], [4, 6, 5, 3, 2], [7, 8, 7, 9], [2, 3, 3, 4, 5, 1]])
+    return rounds
+
+
+def test_pegging_state_matches_brute_force():
+    for ranks in random_rounds(1):
+        pegging = cribbage.PeggingState()
+        for played, rank in enumerate(ranks):
+            card = cribbage.Card(rank, cribbage.SPADES)
+            assert pegging.points_for(card) == brute_force_points(ranks[:played], rank)
+            assert pegging.play(card) == brute_force_points(ranks[:played], rank)
+        assert pegging.count == sum(cribbage.VALUES[rank] for rank in ranks)
+
+
+def test_round_state_of_cards_matches_playing_them():
+    for ranks in random_rounds(2, 200):
+        cards = [cribbage.Card(rank, cribbage.HEARTS) for rank in ranks]
+        pegging = cribbage.PeggingState()
+        for card in cards:
+            pegging.play(card)
+        assert cribbage.pegging_round_state(cards) == pegging.round_state
+
+
+def test_last_card_points():
+    pegging = cribbage.PeggingState()
+    assert pegging.last_card_points() == 0
+    pegging.play(cribbage.Card(10, cribbage.CLUBS))
+    assert pegging.last_card_points() == 1
+    pegging.play(cribbage.Card(cribbage.KING, cribbage.CLUBS))
+    pegging.play(cribbage.Card(cribbage.ACE, cribbage.CLUBS))
+    pegging.play(cribbage.Card(cribbage.QUEEN, cribbage.CLUBS))
+    assert pegging.count == cribbage.PEGGING_LIMIT
+    assert pegging.last_card_points() == 0
+    pegging.reset()
+    assert pegging.round_state == cribbage.PEGGING_ROUND_START
+
+
+def test_search_takes_the_best_endgame():
+    # The opponent is out of cards, so the rest of the hand is certain: a
+    # ten makes 15 now, then the nine gets the last card point
+    search = pegging_search.PeggingSearch(time_budget=10)
+    hand_cards = [cribbage.Card(rank, cribbage.CLUBS) for rank in (10, 9, 2, 3)]
+    opponent_cards = [cribbage.Card(rank, cribbage.HEARTS) for rank in (cribbage.KING, 6, 7, 5)]
+    cards_in_pegging_round = [opponent_cards[-1]]
+    all_cards_pegged = hand_cards[2:] + opponent_cards
+    assert search.choose(hand_cards, cards_in_pegging_round, all_cards_pegged) == hand_cards[0]
+    assert search.exact
+
+
+def test_search_plays_a_legal_card_or_go():
+    rng = random.Random(3)
+    search = pegging_search.PeggingSearch(max_nodes=2000)
+    for _ in xrange(20):
+        cards = rng.sample(cribbage.Deck.all_cards(), 8)
+        hand_cards = cards[:4]
+        pegging = cribbage.PeggingState()
+        cards_in_pegging_round = []
+        for card in cards[4:]:
+            if pegging.can_play(card):
+                pegging.play(card)
+                cards_in_pegging_round.append(card)
+        choice = search.choose(hand_cards, cards_in_pegging_round, cards_in_pegging_round)
+        legal_cards = [card for card in hand_cards if pegging.can_play(card)]
+        if legal_cards:
+            assert choice in legal_cards
+        else:
+            assert choice is None
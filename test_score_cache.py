@@ -0,0 +1,34 @@
+import random
+
+import cribbage
+
+
+def test_lru_evicts_least_recently_used():
+    cache = cribbage.ScoreCache(max_size=2, policy=cribbage.LRU)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats['evictions'] == 1
+
+
+def test_clock_stays_bounded():
+    cache = cribbage.ScoreCache(max_size=8, policy=cribbage.CLOCK)
+    for key in xrange(100):
+        cache.put(key, key * 2)
+        assert cache.get(key) == key * 2
+        assert len(cache) <= 8
+    assert cache.stats['evictions'] == 92
+
+
+def test_scores_are_the_same_through_a_small_cache():
+    rng = random.Random(1)
+    cache = cribbage.ScoreCache(max_size=4)
+    for _ in xrange(200):
+        cards = rng.sample(cribbage.Deck.all_cards(), 5)
+        # No starter, so the scores go through the cache
+        assert cribbage.Scorer.score(cribbage.Hand(cards), cache=cache) == (
+            cribbage.Scorer.score(cribbage.Hand(cards), cache=cribbage.ScoreCache()))
@@ -0,0 +1,99 @@
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+
+import cribbage
+
+NUM_SAMPLES = 2000
+
+# XXX: Ghetto memoization
+_built_table = None
+
+
+def built_table():
+    """ A score table built in memory, never saved
+    """
+    global _built_table
+    if _built_table is None:
+        _built_table = cribbage.ScoreTable(path=None).build()
+    return _built_table
+
+
+@contextlib.contextmanager
+def missing_score_table():
+    """ Make SCORE_TABLE one whose file doesn't exist, and yield it
+    """
+    directory = tempfile.mkdtemp()
+    saved_table = cribbage.SCORE_TABLE
+    cribbage.SCORE_TABLE = cribbage.ScoreTable(os.path.join(directory, 'score_table.bin'))
+    try:
+        yield cribbage.SCORE_TABLE
+    finally:
+        cribbage.SCORE_TABLE = saved_table
+        shutil.rmtree(directory)
+
+
+def sample_deals(seed, num_deals=NUM_SAMPLES):
+    """ (4 cards, starter) pairs drawn at random
+    """
+    rng = random.Random(seed)
+    deals = []
+    for _ in xrange(num_deals):
+        cards = rng.sample(cribbage.Deck.all_cards(), 5)
+        deals.append((cards[:4], cards[4]))
+    return deals
+
+
+def test_table_matches_scorer():
+    table = built_table()
+    with missing_score_table():
+        for cards, starter_card in sample_deals(1):
+            hand = cribbage.Hand(list(cards))
+            hand.add_starter_card(starter_card)
+            entry = table.entries[table.entry_index(
+                [card.index for card in cards], starter_card.index)]
+            for has_crib, is_crib in ((False, False), (True, False), (True, True)):
+                assert cribbage.ScoreTable.unpack(entry, starter_card.rank, has_crib, is_crib) == (
+                    cribbage.Scorer.score(hand, has_crib=has_crib, is_crib=is_crib))
+
+
+def test_missing_table_is_not_built():
+    table = built_table()
+    with missing_score_table() as missing:
+        for cards, starter_card in sample_deals(2):
+            indexes = [card.index for card in cards]
+            assert missing.lookup(indexes, starter_card.index) == (
+                table.entries[table.entry_index(indexes, starter_card.index)])
+        assert missing.entries is None
+        assert not os.path.exists(missing.path)
+
+
+def check_score_many(hands, starters):
+    """ Scorer.score_many against Scorer.score of each hand and starter
+    """
+    for has_crib, is_crib in ((False, False), (True, False), (True, True)):
+        scores = cribbage.Scorer.score_many(hands, starters, has_crib, is_crib)
+        for hand_idx, cards in enumerate(hands):
+            for starter_idx, starter_card in enumerate(starters):
+                if starter_card in cards:
+                    assert scores['score'][hand_idx, starter_idx] == 0
+                    continue
+                hand = cribbage.Hand(list(cards))
+                hand.add_starter_card(starter_card)
+                expected = cribbage.Scorer.score(hand, has_crib=has_crib, is_crib=is_crib)
+                for category, value in expected.items():
+                    assert scores[category][hand_idx, starter_idx] == value
+
+
+def test_score_many_matches_score():
+    if cribbage.load_numpy() is None:
+        return
+    rng = random.Random(3)
+    hands = [rng.sample(cribbage.Deck.all_cards(), 4) for _ in xrange(20)]
+    starters = rng.sample(cribbage.Deck.all_cards(), 10)
+    with missing_score_table():
+        check_score_many(hands, starters)
+        cribbage.SCORE_TABLE = built_table()
+        check_score_many(hands, starters)
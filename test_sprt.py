@@ -0,0 +1,33 @@
+import random
+
+import sprt
+
+
+def run_until_decided(score, seed, max_pairs=100000):
+    """ Status of an SPRT fed pairs a player scoring score per game would win
+    """
+    rng = random.Random(seed)
+    test = sprt.SPRT(0, 50)
+    for _ in xrange(max_pairs):
+        test.add_pair((int(rng.random() < score) + int(rng.random() < score)) / 2.0)
+        if test.status() is not None:
+            return test.status()
+    return None
+
+
+def test_accepts_the_true_hypothesis():
+    assert run_until_decided(sprt.expected_score(100), 1) == sprt.H1
+    assert run_until_decided(sprt.expected_score(-50), 2) == sprt.H0
+
+
+def test_undecided_without_results():
+    test = sprt.SPRT()
+    assert test.llr() == 0.0
+    assert test.status() is None
+
+
+def test_identical_results_keep_a_finite_llr():
+    test = sprt.SPRT(0, 50)
+    for _ in xrange(10):
+        test.add_pair(1.0)
+    assert test.status() == sprt.H1
@@ -0,0 +1,47 @@
+import os
+import random
+import shutil
+import tempfile
+
+import canonical
+import cribbage
+import strategy_table
+
+NUM_DEALS = 4
+
+
+def test_lookup_of_built_deals():
+    directory = tempfile.mkdtemp()
+    try:
+        table = strategy_table.StrategyTable(os.path.join(directory, 'strategy.bin')).open(writable=True)
+        table.build(chunk_size=NUM_DEALS, max_chunks=1)
+        rng = random.Random(1)
+        for deal_index in xrange(NUM_DEALS):
+            cards, _ = canonical.index_to_cards(deal_index, 6)
+            # Any suit permutation of the deal finds the same record
+            perm = rng.choice(canonical.SUIT_PERMUTATIONS)
+            dealt = [cribbage.Card.from_index(canonical.permute_index(card.index, perm)) for card in cards]
+            for has_crib in (False, True):
+                keep_cards, value = table.lookup(dealt, has_crib)
+                values = strategy_table.evaluate(dealt)[has_crib]
+                assert abs(value - max(values)) < 1 / strategy_table.VALUE_SCALE
+                best = max(xrange(len(values)), key=values.__getitem__)
+                assert keep_cards == list(strategy_table.keep_options(dealt)[best])
+        assert table.record(NUM_DEALS, False) is None
+        table.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_counts_agree_with_values():
+    rng = random.Random(2)
+    for _ in xrange(3):
+        cards = rng.sample(cribbage.Deck.all_cards(), 6)
+        values, hand_counts, crib_counts = strategy_table.evaluate_counts(cards)
+        for has_crib in (False, True):
+            for value, expected in zip(values[has_crib], strategy_table.evaluate(cards)[has_crib]):
+                assert abs(value - expected) < 1e-9
+            for counts in hand_counts[has_crib]:
+                assert sum(counts) == 46
+        for counts in crib_counts:
+            assert sum(counts) == 46 * cribbage.binomial(45, 2)
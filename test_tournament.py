@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+
+import tournament
+
+BOTS = ['RandomBot', 'OneSixBot']
+
+
+def test_matchup_json_round_trips():
+    matchup = tournament.Matchup(BOTS)
+    matchup.add_pair([[121, 90], [80, 121]])
+    matchup.add_pair([[121, -1], [121, 100]])
+    matchup.scheduled = 5
+    loaded = tournament.Matchup.from_json(matchup.to_json())
+    assert loaded.to_json() == matchup.to_json()
+    # Pairs scheduled but never finished are played again
+    assert loaded.scheduled == 2
+
+
+def test_cache_resumes_only_for_the_same_seed():
+    directory = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(directory, 'cache.json')
+        first = tournament.Tournament(BOTS, 1, min_pairs=10, max_pairs=2, cache_path=cache_path)
+        assert len(list(first.run())) == 2
+
+        resumed = tournament.Tournament(BOTS, 1, min_pairs=10, max_pairs=3, cache_path=cache_path)
+        assert resumed.matchups[0].num_pairs == 2
+        assert len(list(resumed.run())) == 1
+        assert resumed.matchups[0].pair_points[:2] == first.matchups[0].pair_points
+
+        reseeded = tournament.Tournament(BOTS, 2, min_pairs=10, max_pairs=2, cache_path=cache_path)
+        assert reseeded.matchups[0].num_pairs == 0
+        assert reseeded.cache_key(reseeded.matchups[0]) != first.cache_key(first.matchups[0])
+    finally:
+        shutil.rmtree(directory)
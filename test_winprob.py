@@ -0,0 +1,37 @@
+import test_ai
+import winprob
+
+# XXX: Ghetto memoization
+_table = None
+
+
+def small_table():
+    """ A win table built from a few RandomBot games, never saved
+    """
+    global _table
+    if _table is None:
+        distributions = winprob.simulate([test_ai.RandomBot, test_ai.RandomBot], 20)
+        _table = winprob.WinTable(path=None).build(distributions)
+    return _table
+
+
+def test_probabilities_are_probabilities():
+    table = small_table()
+    for my_score in xrange(0, winprob.NUM_SCORES, 10):
+        for opp_score in xrange(0, winprob.NUM_SCORES, 10):
+            for is_dealer in (False, True):
+                for chance in (table.win_probability(my_score, opp_score, is_dealer),
+                        table.after_pegging(my_score, opp_score, is_dealer),
+                        table.before_opponent_count(my_score, opp_score, is_dealer)):
+                    assert -1e-6 <= chance <= 1 + 1e-6
+
+
+def test_by_count_is_cached_and_unchanged():
+    table = small_table()
+    for is_dealer in (False, True):
+        for crib_shift in (-1, 0, 2):
+            by_count = table.by_count(100, 95, is_dealer, crib_shift)
+            assert table.by_count(100, 95, is_dealer, crib_shift) is by_count
+            assert list(by_count) == table._compute_by_count(100, 95, is_dealer, crib_shift)
+            # More points can only help
+            assert all(low <= high + 1e-6 for low, high in zip(by_count, by_count[1:]))
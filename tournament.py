@@ -0,0 +1,415 @@
+""" Round-robin tournaments between many bots, rated with Elo.
+
+Every pairing of bots plays mirrored pairs of games until its result is
+statistically decided or it reaches max_pairs, and the next pair to play
+always goes to the undecided pairing with the fewest pairs so far, so
+lopsided matchups stop early and the compute goes to the close ones.
+Finished pairs can be cached in a JSON file, so a rerun or a bigger field
+only plays the pairs that are missing. Cached results are keyed on the
+seed and a hash of each bot's code as well as the bots' names, so editing
+a bot or changing the seed starts its pairings afresh.
+"""
+
+import argparse
+import collections
+import hashlib
+import inspect
+import json
+import math
+import os
+import random
+import sys
+import zlib
+
+import bot
+import game
+
+DEFAULT_MIN_PAIRS = 10
+DEFAULT_MAX_PAIRS = 200
+# Standard errors the score must be from even for a pairing to be decided
+DEFAULT_DECISION_Z = 2.58
+CONFIDENCE_Z = 1.96
+ELO_SCALE = 400 / math.log(10)
+# Virtual draws added to every pairing, so a bot that never won still gets
+# a finite rating
+PRIOR_DRAWS = 1.0
+RATING_ITERATIONS = 200
+
+
+class Matchup(object):
+    """ Results of one pairing, counted from the first player's seat
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.forfeits = [0, 0]
+        # Player one's points from each mirrored pair, from 0 to 2
+        self.pair_points = []
+        # Pairs handed out to be played, including ones still running
+        self.scheduled = 0
+
+    @property
+    def key(self):
+        return ' vs '.join(self.names)
+
+    @property
+    def num_games(self):
+        return self.wins + self.losses + self.draws
+
+    @property
+    def num_pairs(self):
+        return len(self.pair_points)
+
+    def add_pair(self, pair_scores):
+        points = 0.0
+        for scores in pair_scores:
+            outcome = game.game_outcome(scores)
+            points += outcome
+            if outcome == 1.0:
+                self.wins += 1
+            elif outcome == 0.0:
+                self.losses += 1
+            else:
+                self.draws += 1
+            for player_idx in xrange(2):
+                if scores[player_idx] < 0:
+                    self.forfeits[player_idx] += 1
+        self.pair_points.append(points)
+
+    def score(self):
+        """ Player one's mean points per game, and its standard error
+        """
+        num_pairs = self.num_pairs
+        if not num_pairs:
+            return 0.5, float('inf')
+        mean = sum(self.pair_points) / num_pairs
+        if num_pairs < 2:
+            return mean / 2, float('inf')
+        variance = sum((points - mean) ** 2 for points in self.pair_points) / (num_pairs - 1)
+        return mean / 2, math.sqrt(variance / num_pairs) / 2
+
+    def decided(self, min_pairs, decision_z):
+        if self.num_pairs < min_pairs:
+            return False
+        mean, stderr = self.score()
+        return abs(mean - 0.5) > decision_z * stderr
+
+    def to_json(self):
+        return dict(
+            names=list(self.names),
+            wins=self.wins,
+            losses=self.losses,
+            draws=self.draws,
+            forfeits=self.forfeits,
+            pair_points=self.pair_points,
+            pairs_completed=self.num_pairs,
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        matchup = cls(data['names'])
+        matchup.wins = data['wins']
+        matchup.losses = data['losses']
+        matchup.draws = data['draws']
+        matchup.forfeits = list(data['forfeits'])
+        matchup.pair_points = list(data['pair_points'])
+        # Pairs are added in the order they were scheduled, so the next
+        # pair to play follows the ones completed
+        matchup.scheduled = data['pairs_completed']
+        return matchup
+
+
+def rate(names, matchups):
+    """ Elo rating and its standard error for every name
+
+    Fits a Bradley-Terry model, with draws as half a win each way, by
+    minorization-maximization, and centres the ratings on 0.
+    """
+    games = collections.defaultdict(float)
+    points = collections.defaultdict(float)
+    for matchup in matchups:
+        if not matchup.num_games:
+            continue
+        first, second = matchup.names
+        num_games = matchup.num_games + 2 * PRIOR_DRAWS
+        first_points = matchup.wins + 0.5 * matchup.draws + PRIOR_DRAWS
+        games[first, second] += num_games
+        games[second, first] += num_games
+        points[first] += first_points
+        points[second] += num_games - first_points
+
+    strengths = dict((name, 1.0) for name in names)
+    for _ in xrange(RATING_ITERATIONS):
+        updated = {}
+        for name in names:
+            denominator = sum(
+                games[name, other] / (strengths[name] + strengths[other])
+                for other in names if games[name, other]
+            )
+            updated[name] = points[name] / denominator if denominator else 1.0
+        log_mean = sum(math.log(strength) for strength in updated.values()) / len(names)
+        strengths = dict((name, strength / math.exp(log_mean)) for name, strength in updated.items())
+
+    ratings = {}
+    for name in names:
+        information = 0.0
+        for other in names:
+            if games[name, other]:
+                expected = strengths[name] / (strengths[name] + strengths[other])
+                information += games[name, other] * expected * (1 - expected)
+        stderr = ELO_SCALE / math.sqrt(information) if information else float('inf')
+        ratings[name] = (ELO_SCALE * math.log(strengths[name]), stderr)
+    return ratings
+
+
+def bot_version(player):
+    """ Hash of the source of the modules defining player and its bases
+    """
+    digest = hashlib.sha1()
+    for module_name in sorted(set(cls.__module__ for cls in inspect.getmro(player))):
+        path = getattr(sys.modules[module_name], '__file__', None)
+        if path is None:
+            continue
+        source_path = os.path.splitext(path)[0] + '.py'
+        with open(source_path if os.path.exists(source_path) else path, 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()[:12]
+
+
+def matchup_seed(seed, key):
+    """ Seed for a pairing's games, the same however the field changes
+
+    Kept to 32 bits, so the seeds of its games still fit in a game record.
+    """
+    return (seed * game.PAIR_SEED_STRIDE + zlib.crc32(key.encode('utf-8'))) % (2 ** 32)
+
+
+class Tournament(object):
+
+    def __init__(self, names, seed, min_pairs=DEFAULT_MIN_PAIRS, max_pairs=DEFAULT_MAX_PAIRS,
+            decision_z=DEFAULT_DECISION_Z, cache_path=None,
+            max_time_for_play=game.MAX_TIME_FOR_PLAY, record_dir=None):
+        self.names = list(names)
+        self.players = dict((name, bot.load_bot(name)) for name in self.names)
+        self.versions = dict((name, bot_version(player)) for name, player in self.players.items())
+        self.seed = seed
+        self.min_pairs = min_pairs
+        self.max_pairs = max_pairs
+        self.decision_z = decision_z
+        self.cache_path = cache_path
+        self.max_time_for_play = max_time_for_play
+        self.record_dir = record_dir
+
+        cached = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)['matchups']
+        self.matchups = []
+        for idx, first in enumerate(self.names):
+            for second in self.names[idx + 1:]:
+                matchup = Matchup(sorted([first, second]))
+                if self.cache_key(matchup) in cached:
+                    matchup = Matchup.from_json(cached[self.cache_key(matchup)])
+                self.matchups.append(matchup)
+
+    def cache_key(self, matchup):
+        """ Key of a pairing's cached results, for this seed and these bots' code
+        """
+        return '%s seed %d (%s)' % (matchup.key, self.seed,
+                ' '.join(self.versions[name] for name in matchup.names))
+
+    def finished(self, matchup):
+        return (matchup.num_pairs >= self.max_pairs or
+                matchup.decided(self.min_pairs, self.decision_z))
+
+    def _next_matchup(self):
+        candidates = [
+            matchup for matchup in self.matchups
+            if matchup.scheduled < self.max_pairs and not self.finished(matchup)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda matchup: matchup.scheduled)
+
+    def _pair_args(self, matchup):
+        pair_idx = matchup.scheduled
+        matchup.scheduled += 1
+        return (
+            [self.players[name] for name in matchup.names],
+            game.pair_seed(matchup_seed(self.seed, matchup.key), pair_idx),
+            False,
+            False,
+            self.max_time_for_play,
+            self.record_dir,
+        )
+
+    def save(self):
+        if not self.cache_path:
+            return
+        cache = dict(matchups={})
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as cache_file:
+                cache = json.load(cache_file)
+        for matchup in self.matchups:
+            cache['matchups'][self.cache_key(matchup)] = matchup.to_json()
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(cache, cache_file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.cache_path)
+
+    def run(self, workers=1):
+        """ Play until every pairing is finished, yielding each finished pair
+
+        Yields (matchup, pair_scores) as results come in, and keeps up to
+        two pairs per worker running at once.
+        """
+        if workers <= 1:
+            matchup = self._next_matchup()
+            while matchup is not None:
+                pair_scores, _, _ = game._play_mirrored_pair(self._pair_args(matchup))
+                matchup.add_pair(pair_scores)
+                self.save()
+                yield matchup, pair_scores
+                matchup = self._next_matchup()
+            return
+
+        pool = game.worker_pool(workers)
+        running = collections.deque()
+        try:
+            while True:
+                while len(running) < 2 * workers:
+                    matchup = self._next_matchup()
+                    if matchup is None:
+                        break
+                    running.append((matchup, pool.apply_async(
+                        game._play_mirrored_pair, (self._pair_args(matchup),))))
+                if not running:
+                    break
+                matchup, pair_result = running.popleft()
+                pair_scores, _, _ = pair_result.get()
+                matchup.add_pair(pair_scores)
+                self.save()
+                yield matchup, pair_scores
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def standings(self):
+        """ A printable table of ratings and of every pairing's results
+        """
+        ratings = rate(self.names, self.matchups)
+        games_played = collections.Counter()
+        for matchup in self.matchups:
+            for name in matchup.names:
+                games_played[name] += matchup.num_games
+        lines = ["%-24s %8s %8s %6s" % ('Bot', 'Elo', '95% CI', 'Games')]
+        for name in sorted(self.names, key=lambda name: -ratings[name][0]):
+            elo, stderr = ratings[name]
+            lines.append("%-24s %8.1f %8s %6d" % (
+                name, elo, '+/-%.0f' % (CONFIDENCE_Z * stderr), games_played[name]))
+        lines.append('')
+        for matchup in self.matchups:
+            score, _ = matchup.score()
+            lines.append("%-50s %3d-%3d-%3d  forfeits %d-%d  %5.1f%%%s" % (
+                matchup.key, matchup.wins, matchup.losses, matchup.draws,
+                matchup.forfeits[0], matchup.forfeits[1], 100 * score,
+                '  decided' if matchup.decided(self.min_pairs, self.decision_z) else ''))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rate cribbage AIs in a round-robin tournament.')
+    parser.add_argument(
+        'bots',
+        nargs='+',
+        help='Bot classes, as module.Class or a class name from kyle_ai or test_ai',
+    )
+    parser.add_argument(
+        '--workers',
+        default=1,
+        required=False,
+        type=int,
+        help='Number of processes to spread mirrored game pairs across',
+    )
+    parser.add_argument(
+        '--seed',
+        default=None,
+        required=False,
+        type=int,
+        help='Seed for reproducing a run, random if not given',
+    )
+    parser.add_argument(
+        '--min_pairs',
+        default=DEFAULT_MIN_PAIRS,
+        required=False,
+        type=int,
+        help='Mirrored pairs every pairing plays before it can stop early',
+    )
+    parser.add_argument(
+        '--max_pairs',
+        default=DEFAULT_MAX_PAIRS,
+        required=False,
+        type=int,
+        help='Mirrored pairs after which a pairing stops regardless',
+    )
+    parser.add_argument(
+        '--decision_z',
+        default=DEFAULT_DECISION_Z,
+        required=False,
+        type=float,
+        help='Standard errors from an even score at which a pairing is decided',
+    )
+    parser.add_argument(
+        '--cache',
+        default=None,
+        required=False,
+        help='JSON file of finished pairs, reused and extended across runs',
+    )
+    parser.add_argument(
+        '--report_every',
+        default=10,
+        required=False,
+        type=int,
+        help='Print the standings every this many pairs',
+    )
+    parser.add_argument(
+        '--max_time_for_play',
+        default=game.MAX_TIME_FOR_PLAY,
+        required=False,
+        type=float,
+        help='Seconds a bot gets per decision before forfeiting',
+    )
+    parser.add_argument(
+        '--record_dir',
+        default=None,
+        required=False,
+        help='Directory to append a binary record of every game to',
+    )
+    args = parser.parse_args()
+    if args.record_dir and not os.path.isdir(args.record_dir):
+        os.makedirs(args.record_dir)
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+    print "Seed:", args.seed
+
+    tournament = Tournament(
+        args.bots,
+        args.seed,
+        min_pairs=args.min_pairs,
+        max_pairs=args.max_pairs,
+        decision_z=args.decision_z,
+        cache_path=args.cache,
+        max_time_for_play=args.max_time_for_play,
+        record_dir=args.record_dir,
+    )
+    for i, (matchup, pair_scores) in enumerate(tournament.run(args.workers)):
+        print i, matchup.key, pair_scores
+        if args.report_every and (i + 1) % args.report_every == 0:
+            print tournament.standings()
+    print tournament.standings()
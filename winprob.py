@@ -0,0 +1,378 @@
+""" Chance of winning from any score, for bots that play to the score.
+
+Expected points are the wrong thing to maximize near 121: a pone one
+point from winning should keep the hand most likely to score a point, not
+the one that scores most on average. WinTable holds the probability of
+winning from every (my score, opponent score, dealer) position, so a bot
+can weigh its options by the positions they lead to.
+
+The table comes from dynamic programming over how many points a round
+gives each side: pegging for both players jointly, the pone's hand, and
+the dealer's hand plus crib, counted from recorded games. Within a round
+points are credited pegging first (pone before dealer), then the pone's
+hand, then the dealer's hand and crib, and the first player to 121 wins.
+Every round pegs at least a point, so each position only depends on
+positions with a higher total, and the table is filled from 240 down.
+
+Besides the start of a round, the table has the chance of winning once
+pegging is over, and once only the opponent's count is left to come, so
+a bot that knows its own count can look up where it leads.
+"""
+
+import argparse
+import array
+import collections
+import os
+import struct
+
+import game_record
+
+MAGIC = b'CRIBWIN1'
+VERSION = 1
+# Magic, version, game length, points range of the distributions, and the
+# mean crib score of the recorded rounds
+HEADER = struct.Struct(b'<8sIIIf')
+# game.GAME_OVER_POINTS, which bots can't import game for, as it imports them
+NUM_SCORES = 121
+# More than any side can score in one part of a round
+MAX_POINTS = 64
+
+# Stages of a round the table has win chances for
+START = 0
+AFTER_PEGGING = 1
+# Pegging is over and my count is in my score, but the opponent's isn't
+BEFORE_OPPONENT_COUNT = 2
+NUM_STAGES = 3
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'win_table.bin',
+)
+DEFAULT_SIMULATED_GAMES = 200
+DEFAULT_PLAYERS = ('KyleBotV4', 'KyleBotV4')
+
+
+class RoundDistributions(object):
+    """ How often a round gives each side how many points
+    """
+
+    def __init__(self):
+        # (pone pegging, dealer pegging) -> rounds
+        self.pegging = collections.Counter()
+        self.pone_hand = collections.Counter()
+        self.dealer_hand_and_crib = collections.Counter()
+        self.crib = collections.Counter()
+
+    def add_game(self, record):
+        """ Count every round of a game_record.GameRecord that was played out
+        """
+        for round_record in record.rounds:
+            if round_record.pegging is None or len(round_record.counts) < len(game_record.COUNTS):
+                continue
+            dealer = 0 if round_record.player_one_has_crib else 1
+            pone = dealer ^ 1
+            pegging_points = round_record.pegging_points
+            if max(pegging_points) >= MAX_POINTS:
+                continue
+            crib_score = round_record.counts['crib']['score']
+            self.pegging[pegging_points[pone], pegging_points[dealer]] += 1
+            self.pone_hand[round_record.counts[game_record.COUNTS[pone]]['score']] += 1
+            self.dealer_hand_and_crib[round_record.counts[game_record.COUNTS[dealer]]['score'] + crib_score] += 1
+            self.crib[crib_score] += 1
+
+    @property
+    def num_rounds(self):
+        return sum(self.pegging.values())
+
+
+class _RecordList(list):
+    """ Collects a GameRunner's records in memory
+    """
+    write = list.append
+
+
+def simulate(players, num_games, seed=0):
+    """ RoundDistributions from num_games between two bot classes
+    """
+    import game
+
+    records = _RecordList()
+    for game_idx in xrange(num_games):
+        game.GameRunner(players[0](), players[1](), seed=game.pair_seed(seed, game_idx),
+                recorder=records).run_game()
+    distributions = RoundDistributions()
+    for record in records:
+        distributions.add_game(record)
+    return distributions
+
+
+def _dense(counter, size, width=None):
+    """ Probabilities from counts, as a dense array of size
+
+    With a width, counter is keyed by (first, second) of a width * width
+    array.
+    """
+    total = float(sum(counter.values()))
+    probabilities = array.array(b'f', [0.0] * size)
+    for points, count in counter.items():
+        if width is not None:
+            points = points[0] * width + points[1]
+        probabilities[points] = count / total
+    return probabilities
+
+
+def _sparse(probabilities, width=None):
+    """ (points, probability) of every possible score in a dense array
+
+    With a width, points are (first, second) of a width * width array.
+    """
+    if width is None:
+        return [(points, p) for points, p in enumerate(probabilities) if p]
+    return [(divmod(points, width), p) for points, p in enumerate(probabilities) if p]
+
+
+class WinTable(object):
+    """ Win probabilities indexed by stage, dealer, my score and opponent score
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.entries = None
+        self.pegging = None
+        self.pone_hand = None
+        self.dealer_hand_and_crib = None
+        self.mean_crib = 0.0
+        # by_count results, by (my score, opp score, is dealer, crib shift)
+        self._by_count = {}
+
+    @classmethod
+    def index(cls, stage, is_dealer, my_score, opp_score):
+        return ((stage * 2 + int(is_dealer)) * NUM_SCORES + my_score) * NUM_SCORES + opp_score
+
+    def build(self, distributions):
+        """ Fill the table by dynamic programming over distributions
+        """
+        self.pegging = _dense(distributions.pegging, MAX_POINTS * MAX_POINTS, MAX_POINTS)
+        self.pone_hand = _dense(distributions.pone_hand, MAX_POINTS)
+        self.dealer_hand_and_crib = _dense(distributions.dealer_hand_and_crib, MAX_POINTS)
+        self.mean_crib = (float(sum(points * count for points, count in distributions.crib.items())) /
+                sum(distributions.crib.values()))
+        pegging = _sparse(self.pegging, MAX_POINTS)
+        pone_hand = _sparse(self.pone_hand)
+        dealer_points = _sparse(self.dealer_hand_and_crib)
+
+        # Chance the pone wins, by (pone score, dealer score): at the start of
+        # a round, after pegging, after the pone's hand is counted, and after
+        # pegging with only the pone's hand still to count, by (pone score,
+        # dealer score including the dealer's counts)
+        size = NUM_SCORES * NUM_SCORES
+        start = [0.0] * size
+        after_pegging = [0.0] * size
+        after_pone_hand = [0.0] * size
+        before_pone_hand = [0.0] * size
+        for total in reversed(xrange(2 * NUM_SCORES - 1)):
+            cells = [(pone, total - pone)
+                    for pone in xrange(max(0, total - NUM_SCORES + 1), min(total, NUM_SCORES - 1) + 1)]
+            for pone, dealer in cells:
+                value = 0.0
+                for (pone_points, dealer_pegged), p in pegging:
+                    if pone + pone_points >= NUM_SCORES:
+                        value += p
+                    elif dealer + dealer_pegged < NUM_SCORES:
+                        value += p * after_pegging[(pone + pone_points) * NUM_SCORES + dealer + dealer_pegged]
+                start[pone * NUM_SCORES + dealer] = value
+            for pone, dealer in cells:
+                # The dealer becomes the next round's pone
+                value = 0.0
+                for points, p in dealer_points:
+                    if dealer + points < NUM_SCORES:
+                        value += p * (1 - start[(dealer + points) * NUM_SCORES + pone])
+                after_pone_hand[pone * NUM_SCORES + dealer] = value
+            for pone, dealer in cells:
+                value = 0.0
+                counted = 0.0
+                for points, p in pone_hand:
+                    if pone + points >= NUM_SCORES:
+                        value += p
+                        counted += p
+                    else:
+                        value += p * after_pone_hand[(pone + points) * NUM_SCORES + dealer]
+                        counted += p * (1 - start[dealer * NUM_SCORES + pone + points])
+                after_pegging[pone * NUM_SCORES + dealer] = value
+                before_pone_hand[pone * NUM_SCORES + dealer] = counted
+
+        entries = array.array(b'f', [0.0] * (NUM_STAGES * 2 * size))
+        for my_score in xrange(NUM_SCORES):
+            for opp_score in xrange(NUM_SCORES):
+                as_pone = my_score * NUM_SCORES + opp_score
+                as_dealer = opp_score * NUM_SCORES + my_score
+                entries[self.index(START, False, my_score, opp_score)] = start[as_pone]
+                entries[self.index(START, True, my_score, opp_score)] = 1 - start[as_dealer]
+                entries[self.index(AFTER_PEGGING, False, my_score, opp_score)] = after_pegging[as_pone]
+                entries[self.index(AFTER_PEGGING, True, my_score, opp_score)] = 1 - after_pegging[as_dealer]
+                entries[self.index(BEFORE_OPPONENT_COUNT, False, my_score, opp_score)] = (
+                    after_pone_hand[as_pone])
+                entries[self.index(BEFORE_OPPONENT_COUNT, True, my_score, opp_score)] = (
+                    1 - before_pone_hand[as_dealer])
+        self.entries = entries
+        self._by_count = {}
+        return self
+
+    def save(self, path=None):
+        path = path or self.path
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as table_file:
+            table_file.write(HEADER.pack(MAGIC, VERSION, NUM_SCORES, MAX_POINTS, self.mean_crib))
+            for values in (self.entries, self.pegging, self.pone_hand, self.dealer_hand_and_crib):
+                values.tofile(table_file)
+        os.rename(temp_path, path)
+
+    def load(self, path=None):
+        """ Raises ValueError for a table saved by another version
+        """
+        path = path or self.path
+        with open(path, 'rb') as table_file:
+            header = table_file.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header)[:4] != (
+                    MAGIC, VERSION, NUM_SCORES, MAX_POINTS):
+                raise ValueError("Not a current win table: %s" % path)
+            self.mean_crib = HEADER.unpack(header)[4]
+            arrays = []
+            for size in (NUM_STAGES * 2 * NUM_SCORES * NUM_SCORES, MAX_POINTS * MAX_POINTS,
+                    MAX_POINTS, MAX_POINTS):
+                values = array.array(b'f')
+                values.fromfile(table_file, size)
+                arrays.append(values)
+        self.entries, self.pegging, self.pone_hand, self.dealer_hand_and_crib = arrays
+        self._by_count = {}
+        return self
+
+    def _lookup(self, stage, my_score, opp_score, is_dealer):
+        if my_score >= NUM_SCORES:
+            return 1.0
+        if opp_score >= NUM_SCORES:
+            return 0.0
+        return self.entries[self.index(stage, is_dealer, max(my_score, 0), max(opp_score, 0))]
+
+    def win_probability(self, my_score, opp_score, is_dealer):
+        """ Chance of winning from the start of a round
+        """
+        return self._lookup(START, my_score, opp_score, is_dealer)
+
+    def after_pegging(self, my_score, opp_score, is_dealer):
+        """ Chance of winning once this round's pegging is over
+        """
+        return self._lookup(AFTER_PEGGING, my_score, opp_score, is_dealer)
+
+    def before_opponent_count(self, my_score, opp_score, is_dealer):
+        """ Chance of winning after pegging, with my counts already in my_score
+
+        A dealer past 121 still loses if the pone counts out first.
+        """
+        if is_dealer and my_score >= NUM_SCORES and opp_score < NUM_SCORES:
+            return sum(p for points, p in enumerate(self.pone_hand) if opp_score + points < NUM_SCORES)
+        return self._lookup(BEFORE_OPPONENT_COUNT, my_score, opp_score, is_dealer)
+
+    def by_count(self, my_score, opp_score, is_dealer, crib_shift=0):
+        """ Chance of winning from the start of a round, by my count
+
+        Element k is the chance of winning if my counts come to k points,
+        averaged over this round's pegging and the opponent's count. A pone
+        can shift the opponent's count by how much its throw should add to
+        the dealer's crib over the average crib.
+
+        Each answer is computed once and cached, as a tuple.
+        """
+        key = (my_score, opp_score, bool(is_dealer), crib_shift)
+        values = self._by_count.get(key)
+        if values is None:
+            values = self._by_count[key] = tuple(
+                self._compute_by_count(my_score, opp_score, is_dealer, crib_shift))
+        return values
+
+    def _compute_by_count(self, my_score, opp_score, is_dealer, crib_shift):
+        values = [0.0] * MAX_POINTS
+        for (pone_pegged, dealer_pegged), p in _sparse(self.pegging, MAX_POINTS):
+            if is_dealer:
+                my_pegged, opp_pegged = dealer_pegged, pone_pegged
+                if opp_score + opp_pegged >= NUM_SCORES:
+                    continue
+                if my_score + my_pegged >= NUM_SCORES:
+                    for my_count in xrange(MAX_POINTS):
+                        values[my_count] += p
+                    continue
+            else:
+                my_pegged, opp_pegged = pone_pegged, dealer_pegged
+                if my_score + my_pegged >= NUM_SCORES:
+                    for my_count in xrange(MAX_POINTS):
+                        values[my_count] += p
+                    continue
+                if opp_score + opp_pegged >= NUM_SCORES:
+                    continue
+            opp_pegged += crib_shift
+            for my_count in xrange(MAX_POINTS):
+                values[my_count] += p * self.before_opponent_count(
+                    my_score + my_pegged + my_count, opp_score + opp_pegged, is_dealer)
+        return values
+
+
+# XXX: Ghetto memoization
+_default_table = None
+
+
+def default_table():
+    """ The WinTable saved at DEFAULT_PATH, or None if there is none
+    """
+    global _default_table
+    if _default_table is None and os.path.exists(DEFAULT_PATH):
+        _default_table = WinTable().load()
+    return _default_table
+
+
+if __name__ == '__main__':
+    import bot
+
+    parser = argparse.ArgumentParser(description='Build the win probability table.')
+    parser.add_argument(
+        '--records',
+        nargs='*',
+        default=[],
+        help='Game record files or globs to take round scores from',
+    )
+    parser.add_argument(
+        '--num_games',
+        default=DEFAULT_SIMULATED_GAMES,
+        required=False,
+        type=int,
+        help='Without --records, games to simulate for round scores',
+    )
+    parser.add_argument(
+        '--players',
+        nargs=2,
+        default=list(DEFAULT_PLAYERS),
+        required=False,
+        help='Without --records, the bots whose games are simulated',
+    )
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_PATH,
+        required=False,
+        help='File to save the table to',
+    )
+    args = parser.parse_args()
+
+    if args.records:
+        distributions = RoundDistributions()
+        for record in game_record.read_games(*args.records):
+            distributions.add_game(record)
+    else:
+        distributions = simulate([bot.load_bot(name) for name in args.players], args.num_games)
+    print "Rounds:", distributions.num_rounds
+
+    table = WinTable(args.path).build(distributions)
+    table.save()
+    for my_score, opp_score in ((0, 0), (100, 100), (115, 110), (119, 100), (100, 119)):
+        print "%3d-%3d: %.3f as pone, %.3f as dealer" % (
+            my_score, opp_score,
+            table.win_probability(my_score, opp_score, False),
+            table.win_probability(my_score, opp_score, True))